@@ -1,5 +1,7 @@
+import os
+
 from execo_engine import Engine
-from cloudal.utils import get_remote_executor
+from cloudal.utils import get_remote_executor, get_host_health_registry, set_output_log_dir
 
 
 class performing_actions(Engine):
@@ -11,6 +13,9 @@ class performing_actions(Engine):
 
         # initialize the remote_executor to execute a command on hosts
         self.remote_executor = get_remote_executor()
+        # the hosts that cannot be connected to are quarantined by the remote executions,
+        # self.host_health.live_hosts(hosts) and self.host_health.quarantined_hosts give the live and dead hosts
+        self.host_health = get_host_health_registry()
 
         self.args_parser.add_argument("--system_config_file",
                                       dest="config_file_path",
@@ -21,6 +26,10 @@ class performing_actions(Engine):
                                       help="the path to the experiment setting file.",
                                       type=str)
 
+    def init(self):
+        # the streamed outputs of the remote commands are written in the result dir of the engine
+        set_output_log_dir(os.path.join(self.result_dir, 'remote_logs'))
+
     def _provisioning(self):
         pass
 
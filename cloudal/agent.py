@@ -0,0 +1,216 @@
+"""A lightweight agent that runs commands and transfers files for cloudal on a host
+
+The agent is started once per host by `cloudal.utils.AgentActionFactory`, through one
+ssh session, and keeps this session as a multiplexed channel: the requests and the
+responses are JSON lines on its stdin and stdout, each request has an id and the
+requests are handled concurrently, so many commands share the same connection.
+
+The agent only uses the python standard library, it is run with:
+    python3 agent.py
+
+Requests:
+    {"id": 1, "op": "run", "cmd": "pidof elmerfs", "stream": false}
+    {"id": 2, "op": "put", "path": "/tmp/elmerfs", "data": "<base64>", "mode": 493}
+    {"id": 3, "op": "get", "path": "/tmp/results/filebench_node-1"}
+    {"id": 4, "op": "ping"}
+"""
+import os
+import sys
+import json
+import time
+import base64
+import threading
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+
+MAX_WORKERS = 64
+
+
+def _run(request, reply):
+    start_date = time.time()
+    p = subprocess.Popen(['bash', '-c', request['cmd']], stdin=subprocess.DEVNULL,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if request.get('stream'):
+        stderr = list()
+        reader = threading.Thread(target=lambda: stderr.append(p.stderr.read()))
+        reader.start()
+        stdout = list()
+        for line in iter(p.stdout.readline, b''):
+            line = line.decode(errors='replace')
+            stdout.append(line)
+            reply({'id': request['id'], 'stream': line})
+        p.wait()
+        reader.join()
+        stdout, stderr = ''.join(stdout), stderr[0].decode(errors='replace')
+    else:
+        stdout, stderr = p.communicate()
+        stdout, stderr = stdout.decode(errors='replace'), stderr.decode(errors='replace')
+    return {'exit_code': p.returncode,
+            'stdout': stdout,
+            'stderr': stderr,
+            'start_date': start_date,
+            'end_date': time.time()}
+
+
+def _put(request, reply):
+    path = request['path']
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(base64.b64decode(request['data']))
+    if request.get('mode') is not None:
+        os.chmod(path, request['mode'])
+    return dict()
+
+
+def _get(request, reply):
+    with open(request['path'], 'rb') as f:
+        data = f.read()
+    return {'data': base64.b64encode(data).decode(), 'mode': os.stat(request['path']).st_mode & 0o777}
+
+
+def _ping(request, reply):
+    return {'pid': os.getpid()}
+
+
+OPERATIONS = {'run': _run, 'put': _put, 'get': _get, 'ping': _ping}
+
+
+def serve(stdin, stdout, max_workers=MAX_WORKERS):
+    """Handle the requests read from stdin until it is closed"""
+    lock = threading.Lock()
+
+    def reply(message):
+        with lock:
+            stdout.write(json.dumps(message) + '\n')
+            stdout.flush()
+
+    def handle(request):
+        try:
+            response = OPERATIONS[request['op']](request, reply)
+        except Exception as e:
+            response = {'error': '%s: %s' % (type(e).__name__, e)}
+        response['id'] = request['id']
+        reply(response)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for line in stdin:
+            if line.strip():
+                pool.submit(handle, json.loads(line))
+
+
+class AgentError(Exception):
+    pass
+
+
+class AgentConnection(object):
+    """The control side of the channel to an agent
+
+    Parameters
+    ----------
+    command: list of str
+        the command that starts the agent, e.g. ssh to the host followed by `python3 agent.py`
+    """
+
+    def __init__(self, command):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, universal_newlines=True, bufsize=1)
+        self.pending = dict()
+        self.streams = dict()
+        self.error = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    @property
+    def alive(self):
+        return self.error is None and self.process.poll() is None
+
+    def _read(self):
+        for line in self.process.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                # messages of the login shell
+                continue
+            if 'stream' in message:
+                with self._lock:
+                    on_stream = self.streams.get(message['id'])
+                if on_stream is not None:
+                    on_stream(message['stream'])
+                continue
+            with self._lock:
+                future = self.pending.pop(message['id'], None)
+                self.streams.pop(message['id'], None)
+            if future is not None:
+                future.set_result(message)
+        # the channel is closed, fail the requests that are still waiting
+        self.process.wait()
+        with self._lock:
+            self.error = self.process.stderr.read().strip() or 'agent exited with code %s' % self.process.returncode
+            pending, self.pending = self.pending, dict()
+        for future in pending.values():
+            future.set_exception(AgentError(self.error))
+
+    def request(self, op, on_stream=None, **kwargs):
+        """Send a request to the agent
+
+        Returns
+        -------
+        concurrent.futures.Future
+            the future of the response of the agent
+        """
+        future = Future()
+        with self._lock:
+            if self.error is not None:
+                future.set_exception(AgentError(self.error))
+                return future
+            self._next_id += 1
+            kwargs.update({'id': self._next_id, 'op': op})
+            self.pending[self._next_id] = future
+            if on_stream is not None:
+                self.streams[self._next_id] = on_stream
+            try:
+                self.process.stdin.write(json.dumps(kwargs) + '\n')
+                self.process.stdin.flush()
+            except (OSError, ValueError) as e:
+                self.pending.pop(self._next_id)
+                future.set_exception(AgentError(str(e)))
+        return future
+
+    def run(self, cmd, on_stream=None, timeout=None):
+        """Run a command on the host and return its exit code, output and timing"""
+        return self.request('run', cmd=cmd, stream=on_stream is not None, on_stream=on_stream).result(timeout)
+
+    def put(self, local_path, remote_path, timeout=None):
+        """Send a local file to the host"""
+        with open(local_path, 'rb') as f:
+            data = base64.b64encode(f.read()).decode()
+        response = self.request('put', path=remote_path, data=data,
+                                mode=os.stat(local_path).st_mode & 0o777).result(timeout)
+        if 'error' in response:
+            raise AgentError(response['error'])
+
+    def get(self, remote_path, local_path, timeout=None):
+        """Get a file from the host"""
+        response = self.request('get', path=remote_path).result(timeout)
+        if 'error' in response:
+            raise AgentError(response['error'])
+        with open(local_path, 'wb') as f:
+            f.write(base64.b64decode(response['data']))
+        os.chmod(local_path, response['mode'])
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+if __name__ == '__main__':
+    serve(sys.stdin, sys.stdout)
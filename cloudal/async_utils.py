@@ -0,0 +1,288 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import tenacity
+
+from cloudal.utils import (get_logger, chunk_list, ExecuteCommandException, HostResult, ExecutionReport,
+                           get_connection_budget)
+
+from execo.config import default_connection_params
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+logger = get_logger()
+
+
+class AsyncRemoteExecutor(object):
+    """Run remote commands and file copies with asyncio, on top of asyncssh
+
+    One SSH connection is kept per host and shared by all the commands sent to this host.
+    The hosts that are contacted at once take slots of the global connection budget
+    (see `cloudal.utils.get_connection_budget`), shared with `execute_cmd` and `getput_file`.
+    Thousands of remote operations can be run concurrently from one thread.
+
+    The connections and the locks are bound to the event loop they are created in,
+    they are created again when the executor is used in a new event loop, e.g. by a second `asyncio.run`.
+    """
+
+    def __init__(self, connect_timeout=20):
+        if asyncssh is None:
+            raise ImportError('Please install asyncssh to use the asyncio remote executor')
+        self.connect_timeout = connect_timeout
+        self.connections = dict()
+        self.started_processes = list()
+        self._loop = None
+        self._locks = dict()
+        # the budget is a blocking semaphore, it is waited for in threads of its own
+        # so that the default executor of the event loop (e.g. DNS resolution) is never blocked
+        self._budget_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='cloudal-async-budget')
+
+    def _bind_loop(self):
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:
+            if self._loop is not None:
+                logger.debug('The async executor is used in a new event loop, '
+                             'dropping %s connections of the previous loop' % len(self.connections))
+            self._loop = loop
+            self._locks = dict()
+            self.connections = dict()
+            self.started_processes = list()
+
+    @asynccontextmanager
+    async def connection_slots(self, n_connections):
+        """Take n_connections slots of the global connection budget for the duration of the block"""
+        budget = get_connection_budget()
+        future = asyncio.get_event_loop().run_in_executor(self._budget_pool, budget.acquire, n_connections)
+        try:
+            n_connections = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # the slots are taken by the thread anyway, give them back
+            future.add_done_callback(lambda f: f.cancelled() or budget.release(f.result()))
+            raise
+        try:
+            yield n_connections
+        finally:
+            budget.release(n_connections)
+
+    def _connect_options(self):
+        options = {'known_hosts': None,
+                   'connect_timeout': self.connect_timeout}
+        if default_connection_params.get('user'):
+            options['username'] = default_connection_params['user']
+        if default_connection_params.get('port'):
+            options['port'] = default_connection_params['port']
+        if default_connection_params.get('keyfile'):
+            options['client_keys'] = [default_connection_params['keyfile']]
+        return options
+
+    async def connect(self, host):
+        """Return the SSH connection to a host, the connection is opened on the first call"""
+        self._bind_loop()
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            connection = self.connections.get(host)
+            if connection is None:
+                retrying = tenacity.AsyncRetrying(reraise=True,
+                                                  stop=tenacity.stop_after_attempt(10),
+                                                  wait=tenacity.wait_random(1, 10),
+                                                  retry=tenacity.retry_if_exception_type((OSError,
+                                                                                          asyncio.TimeoutError)))
+                async for attempt in retrying:
+                    with attempt:
+                        connection = await asyncssh.connect(host, **self._connect_options())
+                self.connections[host] = connection
+            return connection
+
+    async def run(self, cmd, host, mode='run'):
+        """Run a command on one host, with a slot of the connection budget
+
+        Returns
+        -------
+        HostResult
+            the exit code, output and timing of the command on this host,
+            the exit code is None if the host cannot be connected or in the `start` mode
+        """
+        async with self.connection_slots(1):
+            return await self._run(cmd, host, mode)
+
+    async def _run(self, cmd, host, mode='run'):
+        start_date = time.time()
+        try:
+            connection = await self.connect(host)
+            if mode == 'start':
+                process = await connection.create_process(cmd)
+                self.started_processes.append(process)
+                return HostResult(host=host, start_date=start_date)
+            r = await connection.run(cmd, check=False)
+        except (OSError, asyncio.TimeoutError, asyncssh.Error) as e:
+            logger.debug('Cannot run command on host %s: %s' % (host, e))
+            return HostResult(host=host, stderr=str(e), start_date=start_date, end_date=time.time())
+        return HostResult(host=host,
+                          exit_code=r.exit_status,
+                          stdout=r.stdout or '',
+                          stderr=r.stderr or '',
+                          start_date=start_date,
+                          end_date=time.time())
+
+    async def copy(self, host, file_paths, dest_location, action):
+        """Copy files between local and one host, with a slot of the connection budget,
+        return True if the copy succeeds"""
+        async with self.connection_slots(1):
+            return await self._copy(host, file_paths, dest_location, action)
+
+    async def _copy(self, host, file_paths, dest_location, action):
+        try:
+            connection = await self.connect(host)
+            if action == 'put':
+                await asyncssh.scp(file_paths, (connection, dest_location), preserve=True, recurse=True)
+            elif action == 'get':
+                await asyncssh.scp([(connection, path) for path in file_paths], dest_location,
+                                   preserve=True, recurse=True)
+        except (OSError, asyncio.TimeoutError, asyncssh.Error) as e:
+            logger.error('Cannot %s files on host %s: %s' % (action, host, e))
+            return False
+        return True
+
+    async def close(self):
+        for connection in self.connections.values():
+            connection.close()
+        for connection in self.connections.values():
+            await connection.wait_closed()
+        self.connections = dict()
+        self.started_processes = list()
+        self._locks = dict()
+        self._loop = None
+
+
+async_executor_singleton = list()
+
+
+def get_async_executor():
+    '''Get the asyncio remote executor, the executor is created on the first call
+
+    The number of hosts contacted at once is limited by the global connection budget,
+    see `cloudal.utils.set_max_connections`.
+
+    Returns
+    -------
+    AsyncRemoteExecutor
+        the executor shared by all async remote executions
+    '''
+    global async_executor_singleton
+    if len(async_executor_singleton) > 0:
+        return async_executor_singleton[0]
+    executor = AsyncRemoteExecutor()
+    async_executor_singleton.append(executor)
+    return executor
+
+
+async def _gather_chunks(executor, coroutine, hosts, batch_size):
+    """Run a coroutine on the chunks of hosts concurrently, as `cloudal.utils.run_chunks`:
+    a chunk takes one slot of the connection budget per host at once"""
+    async def _run_chunk(chunk):
+        async with executor.connection_slots(len(chunk)):
+            return await asyncio.gather(*[coroutine(host) for host in chunk])
+
+    results = await asyncio.gather(*[_run_chunk(chunk) for chunk in chunk_list(hosts, batch_size or 1)])
+    return [result for chunk in results for result in chunk]
+
+
+async def async_execute_cmd(cmd, hosts, mode='run', batch_size=None, is_continue=False):
+    """ Performing a command on remote hosts, the asyncio counterpart of `cloudal.utils.execute_cmd`
+
+    Parameters
+    ----------
+    cmd: str
+        command to perform on remote hosts
+
+    hosts: list of str
+        list of host names or IPs
+
+    mode: str
+        run: start a process and wait until it ends
+        start: start a process
+
+    batch_size: int
+        chunk the hosts to smaller batches with batch size,
+        the batches are run concurrently within the global limit of SSH connections;
+        if None, each host is its own batch
+
+    is_continue: bool
+        if True, do not raise an exception when all hosts cannot be connected
+
+    Returns
+    -------
+    host_errors: list of str
+        the hosts that cannot be connected to
+
+    report: ExecutionReport
+        the exit code, stdout, stderr, start and end time of the command on each host
+    """
+    if hosts is None:
+        raise Exception("Hosts cannot be None")
+    if isinstance(hosts, str):
+        hosts = [hosts]
+    executor = get_async_executor()
+    report = ExecutionReport()
+    results = await _gather_chunks(executor, lambda host: executor._run(cmd, host, mode), hosts, batch_size)
+    for host_result in results:
+        report[host_result.host] = host_result
+
+    host_errors = [host for host, r in report.items() if r.exit_code is None and r.end_date is not None]
+    if hosts and len(host_errors) == len(hosts):
+        logger.error("Connection error to %s/%s hosts" % (len(host_errors), len(hosts)))
+        if not is_continue:
+            raise ExecuteCommandException(message='Connection error to all hosts', is_continue=is_continue)
+    elif len(host_errors) > 0:
+        logger.error("Connection error to %s hosts:\n%s" % (len(host_errors), '\n'.join(host_errors)))
+    return host_errors, report
+
+
+async def async_get_file(remote_file_paths, host, local_dir):
+    """Get files from a remote host to a local directory, the asyncio counterpart of `cloudal.utils.get_file`"""
+    if isinstance(remote_file_paths, str):
+        remote_file_paths = [remote_file_paths]
+    return await get_async_executor().copy(host, remote_file_paths, local_dir, 'get')
+
+
+async def async_getput_file(hosts, file_paths, dest_location, action, batch_size=None):
+    """Perform files copy between local and remote, the asyncio counterpart of `cloudal.utils.getput_file`
+
+    Parameters
+    ----------
+    hosts: list of str
+        list of remote hosts to get/send files
+
+    file_paths: list of str
+        list of file paths to (1) the local files to send to remote hosts or (2) the remote files to get to local
+
+    dest_location: str
+        the path to the destination directory
+
+    action: str
+        get: get file from remote dest_location to local
+        put: send file from local to remote dest_location
+
+    batch_size: int
+        the list of hosts will be chunked into N chunks of size: batch_size,
+        the chunks are copied concurrently within the global limit of SSH connections;
+        if None, each host is its own chunk
+
+    Returns
+    -------
+    list of str
+        the hosts that the copy failed
+    """
+    if isinstance(hosts, str):
+        hosts = [hosts]
+    if isinstance(file_paths, str):
+        file_paths = [file_paths]
+    executor = get_async_executor()
+    is_ok = await _gather_chunks(executor, lambda host: executor._copy(host, file_paths, dest_location, action),
+                                 hosts, batch_size)
+    return [host for host, ok in zip(hosts, is_ok) if not ok]
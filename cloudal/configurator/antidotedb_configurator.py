@@ -2,8 +2,8 @@ import os
 
 from cloudal.utils import get_logger, execute_cmd, is_ip
 from cloudal.configurator import k8s_resources_configurator, CancelException, packages_configurator
+from cloudal.configurator.k8s_resources_configurator import get_manifest_renderer
 
-import yaml
 logger = get_logger()
 
 
@@ -40,24 +40,15 @@ class antidotedb_configurator(object):
             the name of K8s namespace
         """
 
-        logger.debug('Delete old createDC, connectDCs and exposer-service files if exists')
-        for filename in os.listdir(antidotedb_yaml_path):
-            if filename.startswith('createDC_') or filename.startswith('statefulSet_') or filename.startswith('exposer-service_') or filename.startswith('connectDCs_antidote'):
-                if '.template' not in filename:
-                    try:
-                        os.remove(os.path.join(antidotedb_yaml_path, filename))
-                    except OSError:
-                        logger.debug("Error while deleting file")
+        renderer = get_manifest_renderer()
+        statefulSets = renderer.load_all(os.path.join(antidotedb_yaml_path, 'headlessService.yaml'))
 
-        statefulSet_files = [os.path.join(antidotedb_yaml_path, 'headlessService.yaml')]
-        
-        logger.debug('Modify the statefulSet file')
+        logger.debug('Render the statefulSet of each cluster')
         ring_size  = self._calculate_ring_size(n_nodes)
-        file_path = os.path.join(antidotedb_yaml_path, 'statefulSet.yaml.template')    
-        with open(file_path) as f:
-            doc = yaml.safe_load(f)
+        file_path = os.path.join(antidotedb_yaml_path, 'statefulSet.yaml.template')
 
         for cluster in clusters:
+            doc = renderer.load(file_path)
             doc['spec']['replicas'] = n_nodes
             doc['metadata']['name'] = 'antidote-%s' % cluster.lower()
             doc['spec']['template']['spec']['nodeSelector'] = {
@@ -67,25 +58,24 @@ class antidotedb_configurator(object):
                 if env.get('name') == "RING_SIZE":
                     env['value'] = str(ring_size)
                     break
-            file_path = os.path.join(antidotedb_yaml_path, 'statefulSet_%s.yaml' % cluster.lower())
-            with open(file_path, 'w') as f:
-                yaml.safe_dump(doc, f)
-            statefulSet_files.append(file_path)
+            statefulSets.append(doc)
+        renderer.dump('statefulSet_antidote', statefulSets)
 
         logger.info("Starting AntidoteDB instances")
         logger.debug("Init configurator: k8s_resources_configurator")
         configurator = k8s_resources_configurator()
-        configurator.deploy_k8s_resources(files=statefulSet_files, namespace=kube_namespace)
+        configurator.deploy_k8s_resources(manifests=statefulSets, namespace=kube_namespace)
 
         logger.info('Waiting until all AntidoteDB instances are up')
         deploy_ok = configurator.wait_k8s_resources(resource='pod',
                                                     label_selectors="app=antidote",
                                                     timeout=600,
+                                                    n_expected=n_nodes * len(clusters),
                                                     kube_namespace=kube_namespace)
         if not deploy_ok:
             raise CancelException("Cannot deploy enough Antidotedb instances")
 
-        logger.debug('Creating createDc.yaml file for each AntidoteDB DC')
+        logger.debug('Render the createDC job of each AntidoteDB DC')
         dcs = dict()
         for cluster in clusters:
             dcs[cluster.lower()] = list()
@@ -102,35 +92,27 @@ class antidotedb_configurator(object):
             dcs[cluster].append(antidote)
 
         file_path = os.path.join(antidotedb_yaml_path, 'createDC.yaml.template')
-        with open(file_path) as f:
-            doc = yaml.safe_load(f)
-
         antidote_masters = list()
-        createdc_files = list()
+        createdcs = list()
         for cluster, pods in dcs.items():
+            doc = renderer.load(file_path)
             doc['spec']['template']['spec']['containers'][0]['args'] = ['--createDc',
                                                                         '%s.antidote:8087' % pods[0]] + ['antidote@%s.antidote' % pod for pod in pods]
             doc['metadata']['name'] = 'createdc-%s' % cluster
             antidote_masters.append('%s.antidote:8087' % pods[0])
-            file_path = os.path.join(antidotedb_yaml_path, 'createDC_%s.yaml' % cluster)
-            with open(file_path, 'w') as f:
-                yaml.safe_dump(doc, f)
-            createdc_files.append(file_path)
+            createdcs.append(doc)
 
-        logger.debug('Creating exposer-service.yaml files')
+        logger.debug('Render the exposer services')
         file_path = os.path.join(antidotedb_yaml_path, 'exposer-service.yaml.template')
-        with open(file_path) as f:
-            doc = yaml.safe_load(f)
         for cluster, pods in dcs.items():
+            doc = renderer.load(file_path)
             doc['spec']['selector']['statefulset.kubernetes.io/pod-name'] = pods[0]
             doc['metadata']['name'] = 'antidote-exposer-%s' % cluster
-            file_path = os.path.join(antidotedb_yaml_path, 'exposer-service_%s.yaml' % cluster)
-            with open(file_path, 'w') as f:
-                yaml.safe_dump(doc, f)
-            createdc_files.append(file_path)
+            createdcs.append(doc)
+        renderer.dump('createDC_antidote', createdcs)
 
         logger.info("Creating AntidoteDB DCs and exposing services")
-        configurator.deploy_k8s_resources(files=createdc_files, namespace=kube_namespace)
+        configurator.deploy_k8s_resources(manifests=createdcs, namespace=kube_namespace)
 
         logger.info('Waiting until all AntidoteDB DCs are created')
         deploy_ok = configurator.wait_k8s_resources(resource='job',
@@ -140,18 +122,14 @@ class antidotedb_configurator(object):
         if not deploy_ok:
             raise CancelException("Cannot connect AntidoteDB instances to create DC")
 
-        logger.debug('Creating connectDCs_antidote.yaml to connect all AntidoteDB DCs')
-        file_path = os.path.join(antidotedb_yaml_path, 'connectDCs.yaml.template')
-        with open(file_path) as f:
-            doc = yaml.safe_load(f)
+        logger.debug('Render the connectDCs job to connect all AntidoteDB DCs')
+        doc = renderer.load(os.path.join(antidotedb_yaml_path, 'connectDCs.yaml.template'))
         doc['spec']['template']['spec']['containers'][0]['args'] = [
             '--connectDcs'] + antidote_masters
-        file_path = os.path.join(antidotedb_yaml_path, 'connectDCs_antidote.yaml')
-        with open(file_path, 'w') as f:
-            yaml.safe_dump(doc, f)
+        renderer.dump('connectDCs_antidote', [doc])
 
         logger.info("Connecting all AntidoteDB DCs into a cluster")
-        configurator.deploy_k8s_resources(files=[file_path], namespace=kube_namespace)
+        configurator.deploy_k8s_resources(manifests=[doc], namespace=kube_namespace)
 
         logger.info('Waiting until connecting all AntidoteDB DCs')
         deploy_ok = configurator.wait_k8s_resources(resource='job',
@@ -204,7 +182,7 @@ class antidotedb_configurator(object):
         configurator.create_configmap(file=prometheus_configmap_file,
                                       namespace=kube_namespace,
                                       configmap_name='prometheus-configmap')
-        logger.debug('Modify the deploy_prometheus.yaml file with node info')
+        logger.debug('Render the Prometheus deployment with node info')
         
         if not is_ip(node):
             node_info = configurator.get_k8s_resources(resource='node',
@@ -219,36 +197,30 @@ class antidotedb_configurator(object):
             _, r = execute_cmd(cmd, node)
             node_hostname = r.processes[0].stdout.strip().lower()
 
-        file_path = os.path.join(monitoring_yaml_path, 'deploy_prometheus.yaml.template')
-        with open(file_path) as f:
-            doc = f.read().replace('node_ip', '%s' % node_ip)
-            doc = doc.replace("node_hostname", '%s' % node_hostname)
-        prometheus_deploy_file = os.path.join(monitoring_yaml_path, 'deploy_prometheus.yaml')
-        with open(prometheus_deploy_file, 'w') as f:
-            f.write(doc)
+        renderer = get_manifest_renderer()
+        replacements = {'node_ip': '%s' % node_ip, 'node_hostname': '%s' % node_hostname}
+        prometheus = renderer.render_text(os.path.join(monitoring_yaml_path, 'deploy_prometheus.yaml.template'),
+                                          replacements)
+        renderer.dump('deploy_prometheus', prometheus)
 
         logger.info("Starting Prometheus service")
-        configurator.deploy_k8s_resources(files=[prometheus_deploy_file], namespace=kube_namespace)
+        configurator.deploy_k8s_resources(manifests=prometheus, namespace=kube_namespace)
         logger.info('Waiting until Prometheus instance is up')
         configurator.wait_k8s_resources(resource='pod',
                                         label_selectors="app=prometheus",
                                         kube_namespace=kube_namespace)
 
-        logger.debug('Modify the deploy_grafana.yaml file with node info')
-        file_path = os.path.join(monitoring_yaml_path, 'deploy_grafana.yaml.template')
-        with open(file_path) as f:
-            doc = f.read().replace('node_ip', '%s' % node_ip)
-            doc = doc.replace("node_hostname", '%s' % node_hostname)
-        grafana_deploy_file = os.path.join(monitoring_yaml_path, 'deploy_grafana.yaml')
-        with open(grafana_deploy_file, 'w') as f:
-            f.write(doc)
+        logger.debug('Render the Grafana deployment with node info')
+        grafana = renderer.render_text(os.path.join(monitoring_yaml_path, 'deploy_grafana.yaml.template'),
+                                       replacements)
+        renderer.dump('deploy_grafana', grafana)
 
         file = '/root/antidote_stats/monitoring/grafana-config/provisioning/datasources/all.yml'
         cmd = """ sed -i "s/localhost/%s/" %s """ % (node_ip, file)
         execute_cmd(cmd, node)
 
         logger.info("Starting Grafana service")
-        configurator.deploy_k8s_resources(files=[grafana_deploy_file], namespace=kube_namespace)
+        configurator.deploy_k8s_resources(manifests=grafana, namespace=kube_namespace)
         logger.info('Waiting until Grafana instance is up')
         configurator.wait_k8s_resources(resource='pod',
                                         label_selectors="app=grafana",
@@ -1,4 +1,4 @@
-from cloudal.utils import get_logger, execute_cmd
+from cloudal.utils import get_logger, ensure_cmd
 from cloudal.configurator import packages_configurator
 
 logger = get_logger()
@@ -22,8 +22,8 @@ class docker_configurator(object):
         configurator.install_packages(['wget'], self.hosts)
         logger.info('Downloading the official get_docker script')
         cmd = 'wget https://get.docker.com -O get-docker.sh'
-        self.error_hosts = execute_cmd(cmd, self.hosts)
+        self.error_hosts = ensure_cmd(cmd, self.hosts)
         logger.info('Installing Docker by using get_docker script')
         cmd = 'sh get-docker.sh'
-        self.error_hosts = execute_cmd(cmd, self.hosts)
+        self.error_hosts = ensure_cmd(cmd, self.hosts)
         logger.info('Finish installing Docker on %s hosts' % len(self.hosts))
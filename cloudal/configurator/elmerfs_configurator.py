@@ -1,12 +1,21 @@
 from time import sleep
 
-from cloudal.utils import get_logger, execute_cmd, getput_file
+from cloudal.utils import get_logger, execute_cmd, execute_cmd_per_host, getput_file, start_job, CommandBatch
 from cloudal.configurator import packages_configurator, k8s_resources_configurator
 
 logger = get_logger()
 class elmerfs_configurator(object):
 
-    def install_elmerfs(self, kube_master, elmerfs_hosts, elmerfs_mountpoint, elmerfs_repo, elmerfs_version, elmerfs_path):
+    def install_elmerfs(self, kube_master, elmerfs_hosts, elmerfs_mountpoint, elmerfs_repo, elmerfs_version, elmerfs_path,
+                        broadcast=None):
+        """Build (if no elmerfs_path is given) and upload the elmerfs binary to the elmerfs hosts
+
+        Parameters
+        ----------
+        broadcast: str
+            the method used to send the binary to the hosts (see `broadcast_file`),
+            None to upload it from local to every host
+        """
 
         # Create folder to build the elmerfs from the repo
         # cmd = 'rm -rf /tmp/elmerfs_repo && mkdir -p /tmp/elmerfs_repo'
@@ -21,22 +30,17 @@ class elmerfs_configurator(object):
             logger.info('Installing elmerfs')
             configurator = packages_configurator()
             configurator.install_packages(['libfuse2', 'wget', 'jq'], elmerfs_hosts)
-            logger.info('Create folder to build the elmerfs from the repo')
-            # Create folder to build the elmerfs from the repo
-            cmd = 'rm -rf /tmp/elmerfs_repo && mkdir -p /tmp/elmerfs_repo'
-            execute_cmd(cmd, kube_master)
-
             logger.info('Downloading elmerfs project from the repo')
-            cmd = '''curl \
+            batch = CommandBatch(kube_master)
+            # Create folder to build the elmerfs from the repo
+            batch.add('rm -rf /tmp/elmerfs_repo && mkdir -p /tmp/elmerfs_repo')
+            batch.add('''curl \
                     -H 'Accept: application/vnd.github.v3+json' \
                     https://api.github.com/repos/scality/elmerfs/releases/%s | jq '.tag_name' \
-                    | xargs -I tag_name git clone https://github.com/scality/elmerfs.git --branch tag_name --single-branch /tmp/elmerfs_repo ''' % elmerfs_version
-            execute_cmd(cmd, kube_master)
-
-            logger.info('update the repo')
-            cmd = 'cd /tmp/elmerfs_repo \
-                   && git submodule update --init --recursive'
-            execute_cmd(cmd, kube_master)
+                    | xargs -I tag_name git clone https://github.com/scality/elmerfs.git --branch tag_name --single-branch /tmp/elmerfs_repo ''' % elmerfs_version)
+            batch.add('cd /tmp/elmerfs_repo \
+                   && git submodule update --init --recursive')
+            batch.run()
 
             logger.info('Creating the Docker file')
             cmd = '''cat <<EOF | sudo tee /tmp/elmerfs_repo/Dockerfile
@@ -54,13 +58,13 @@ class elmerfs_configurator(object):
             logger.info('Building elmerfs Docker image')
             cmd = 'cd /tmp/elmerfs_repo/ \
                    && docker build -t elmerfs .'
-            execute_cmd(cmd, kube_master)
+            execute_cmd(cmd, kube_master, log_step='elmerfs_docker_build')
 
             logger.info('Building elmerfs')
             cmd = 'docker run --name elmerfs elmerfs \
                    && docker cp -L elmerfs:/elmerfs/target/release/main /tmp/elmerfs \
                    && docker rm elmerfs'
-            execute_cmd(cmd, kube_master)
+            execute_cmd(cmd, kube_master, log_step='elmerfs_build')
 
             getput_file(hosts=[kube_master],
                         file_paths=['/tmp/elmerfs'],
@@ -72,51 +76,47 @@ class elmerfs_configurator(object):
         getput_file(hosts=elmerfs_hosts,
                     file_paths=[elmerfs_path],
                     dest_location='/tmp',
-                    action='put')
-        cmd = 'chmod +x /tmp/elmerfs'
-        execute_cmd(cmd, elmerfs_hosts)
+                    action='put',
+                    broadcast=broadcast)
         logger.info('Create mountpoint and result folder')
-        cmd = 'rm -rf /tmp/results && mkdir -p /tmp/results && \
-               rm -rf %s && mkdir -p %s' % (elmerfs_mountpoint, elmerfs_mountpoint)
-        execute_cmd(cmd, elmerfs_hosts)
+        batch = CommandBatch(elmerfs_hosts, stop_on_failure=False)
+        batch.add('chmod +x /tmp/elmerfs')
+        batch.add('rm -rf /tmp/results && mkdir -p /tmp/results && \
+                   rm -rf %s && mkdir -p %s' % (elmerfs_mountpoint, elmerfs_mountpoint))
+        batch.run()
 
     def deploy_elmerfs(self, clusters, kube_namespace, elmerfs_hosts, elmerfs_mountpoint, antidote_ips):
         logger.info('Killing elmerfs process if it is running')
         logger.debug('elmerfs_hosts: %s' % elmerfs_hosts)
-        for host in elmerfs_hosts:
-            cmd = 'pidof elmerfs'
-            _, r = execute_cmd(cmd, host)
-            pids = r.processes[0].stdout.strip().split(' ')
-
-            if len(pids) >= 1 and pids[0] != '':
-                for pid in pids:
-                    cmd = 'kill %s' % pid.strip()
-                    execute_cmd(cmd, host)
-                sleep(5)
-
-            cmd = 'mount | grep %s' % elmerfs_mountpoint
-            _, r = execute_cmd(cmd, host)
-            is_mount = r.processes[0].stdout.strip()
-
-            if is_mount:
-                cmd = 'umount %s ' % elmerfs_mountpoint
-                execute_cmd(cmd, host)
-
-        logger.info('Delete all files on elmerfs nodes from the previous run')
-        cmd = 'rm -rf /tmp/results && mkdir -p /tmp/results'
-        execute_cmd(cmd, elmerfs_hosts)
-        cmd = 'rm -rf %s && mkdir -p %s' % (elmerfs_mountpoint, elmerfs_mountpoint)
-        execute_cmd(cmd, elmerfs_hosts)
-
-        logger.info('Downloading the elmerfs configuration file on %s hosts' % len(elmerfs_hosts))
-        cmd = 'wget https://raw.githubusercontent.com/scality/elmerfs/master/Elmerfs.template.toml -P /tmp/ -N'
-        execute_cmd(cmd, elmerfs_hosts)
+        cmd = 'pidof elmerfs'
+        _, r = execute_cmd(cmd, elmerfs_hosts)
+        running_hosts = [host for host, pids in r.report.stdout().items() if pids]
+        if running_hosts:
+            cmd = 'kill $(pidof elmerfs)'
+            execute_cmd(cmd, running_hosts)
+            sleep(5)
+
+        cmd = 'mount | grep %s' % elmerfs_mountpoint
+        _, r = execute_cmd(cmd, elmerfs_hosts)
+        mounted_hosts = [host for host, is_mount in r.report.stdout().items() if is_mount]
+        if mounted_hosts:
+            cmd = 'umount %s ' % elmerfs_mountpoint
+            execute_cmd(cmd, mounted_hosts)
+
+        logger.info('Delete all files on elmerfs nodes from the previous run and '
+                    'download the elmerfs configuration file on %s hosts' % len(elmerfs_hosts))
+        batch = CommandBatch(elmerfs_hosts, stop_on_failure=False)
+        batch.add('rm -rf /tmp/results && mkdir -p /tmp/results')
+        batch.add('rm -rf %s && mkdir -p %s' % (elmerfs_mountpoint, elmerfs_mountpoint))
+        batch.add('wget https://raw.githubusercontent.com/scality/elmerfs/master/Elmerfs.template.toml -P /tmp/ -N')
+        batch.run()
 
         elmerfs_cluster_id = set(range(0, len(clusters)))
         elmerfs_node_id = set(range(0, len(elmerfs_hosts)))
         elmerfs_uid = set(range(len(elmerfs_hosts), len(elmerfs_hosts)*2))
 
         logger.info('Editing the elmerfs configuration file on %s hosts' % len(elmerfs_hosts))
+        host_vars = dict()
         for cluster in clusters:
             configurator = k8s_resources_configurator()
             host_info = configurator.get_k8s_resources(resource='node',
@@ -126,15 +126,15 @@ class elmerfs_configurator(object):
             cluster_id = elmerfs_cluster_id.pop()
             for host in hosts:
                 if host in antidote_ips:
-                    logger.debug('Editing the configuration file on host %s' % host)
-                    logger.debug('elmerfs_node_id = %s, elmerfs_cluster_id = %s' %
-                                (elmerfs_node_id, elmerfs_cluster_id))
-                    ips = ' '.join([ip for ip in antidote_ips[host]])
-                    cmd = '''sed -i 's/127.0.0.1:8101/%s:8087/g' /tmp/Elmerfs.template.toml ;
-                            sed -i 's/node_id = 0/node_id = %s/g' /tmp/Elmerfs.template.toml ;
-                            sed -i 's/cluster_id = 0/cluster_id = %s/g' /tmp/Elmerfs.template.toml
-                        ''' % (ips, elmerfs_node_id.pop(), cluster_id)
-                    execute_cmd(cmd, host)
+                    host_vars[host] = {'ips': ' '.join([ip for ip in antidote_ips[host]]),
+                                       'node_id': elmerfs_node_id.pop(),
+                                       'cluster_id': cluster_id}
+                    logger.debug('Configuration of host %s: %s' % (host, host_vars[host]))
+        cmd = '''sed -i 's/127.0.0.1:8101/%(ips)s:8087/g' /tmp/Elmerfs.template.toml ;
+                 sed -i 's/node_id = 0/node_id = %(node_id)s/g' /tmp/Elmerfs.template.toml ;
+                 sed -i 's/cluster_id = 0/cluster_id = %(cluster_id)s/g' /tmp/Elmerfs.template.toml
+              '''
+        execute_cmd_per_host(cmd, host_vars)
 
         logger.info('Running bootstrap command on host %s' % elmerfs_hosts[0])
         cmd = '/tmp/elmerfs --config /tmp/Elmerfs.template.toml --bootstrap --mount %s' % elmerfs_mountpoint
@@ -143,28 +143,23 @@ class elmerfs_configurator(object):
         sleep(30)
 
         logger.info('Starting elmerfs on %s hosts' % len(elmerfs_hosts))
-        for host in elmerfs_hosts:
-            elmerfs_cmd = 'RUST_BACKTRACE=1 RUST_LOG=debug nohup /tmp/elmerfs --config /tmp/Elmerfs.template.toml --mount=%s --force-view=%s > /tmp/elmer.log 2>&1' % (elmerfs_mountpoint, elmerfs_uid.pop())
-            logger.debug('Starting elmerfs on %s with cmd: %s' % (host, elmerfs_cmd))
-            execute_cmd(elmerfs_cmd, host, mode='start')
-            
-            logger.info('Checking if elmerfs is running on host %s' % host)
+        elmerfs_cmd = 'RUST_BACKTRACE=1 RUST_LOG=debug /tmp/elmerfs --config /tmp/Elmerfs.template.toml --mount=%(mountpoint)s --force-view=%(uid)s > /tmp/elmer.log 2>&1'
+        host_vars = {host: {'mountpoint': elmerfs_mountpoint, 'uid': elmerfs_uid.pop()} for host in elmerfs_hosts}
+        job = start_job(elmerfs_cmd, elmerfs_hosts, host_vars=host_vars, name='elmerfs')
+
+        logger.info('Checking if elmerfs is running on %s hosts' % len(elmerfs_hosts))
+        sleep(5)
+        for i in range(10):
+            pending_hosts = [host for host, state in job.poll(elmerfs_hosts).items() if state != job.RUNNING]
+            if not pending_hosts:
+                logger.info('elmerfs starts successfully')
+                break
+            logger.info('---> Retrying: starting elmerfs again on %s hosts' % len(pending_hosts))
+            job.start(pending_hosts)
             sleep(5)
-            for i in range(10):
-                cmd = 'pidof elmerfs'
-                _, r = execute_cmd(cmd, host)
-                pid = r.processes[0].stdout.strip().split(' ')
-
-                if len(pid) >= 1 and pid[0].strip():
-                    logger.info('elmerfs starts successfully')
-                    break
-                else:
-                    logger.info('---> Retrying: starting elmerfs again')
-                    execute_cmd(elmerfs_cmd, host, mode='start')
-                    sleep(5)
-            else:
-                logger.info('Cannot deploy elmerfs on host %s' % host)
-                return False
+        else:
+            logger.info('Cannot deploy elmerfs on hosts %s' % pending_hosts)
+            return False
 
         logger.info('Finish deploying elmerfs')
         return True
\ No newline at end of file
@@ -1,6 +1,8 @@
-from time import sleep
+import os
+import threading
 
-from cloudal.utils import get_logger, execute_cmd
+from cloudal.utils import (get_logger, execute_cmd, ensure_cmd, start_job, get_output_log_dir, CommandBatch,
+                          RemoteLogTailer)
 from cloudal.configurator import packages_configurator
 
 logger = get_logger()
@@ -13,9 +15,9 @@ class filebench_configurator(object):
         configurator.install_packages(['build-essential', 'bison', 'flex', 'libtool'], hosts)
         
         cmd = 'wget https://github.com/filebench/filebench/archive/refs/tags/1.5-alpha3.tar.gz -P /tmp/ -N'
-        execute_cmd(cmd, hosts)
+        ensure_cmd(cmd, hosts)
         cmd = 'tar -xf /tmp/1.5-alpha3.tar.gz --directory /tmp/'
-        execute_cmd(cmd, hosts)
+        ensure_cmd(cmd, hosts)
         cmd = '''cd /tmp/filebench-1.5-alpha3/ &&
                  libtoolize &&
                  aclocal &&
@@ -25,39 +27,78 @@ class filebench_configurator(object):
                  ./configure &&
                  make &&
                  make install'''
-        execute_cmd(cmd, hosts)
+        ensure_cmd(cmd, hosts, log_step='filebench_install')
 
-    def run_mailserver(self, hosts, mountpoint, duration, n_threads):
-        
-        logger.info('Dowloading Filebench configuration file')
-        cmd = 'wget https://raw.githubusercontent.com/filebench/filebench/master/workloads/varmail.f -P /tmp/ -N'
-        execute_cmd(cmd, hosts)
-
-        logger.info('Editing the configuration file')
-        cmd = 'sed -i "s/tmp/%s/g" /tmp/varmail.f' % mountpoint
-        execute_cmd(cmd, hosts)
-        cmd = 'sed -i "s/run 60/run %s/g" /tmp/varmail.f' % duration
-        execute_cmd(cmd, hosts)
-        cmd = 'sed -i "s/name=bigfileset/name=bigfileset-$(hostname)/g" /tmp/varmail.f'
-        execute_cmd(cmd, hosts)
-        cmd = 'sed -i "s/meandirwidth=1000000/meandirwidth=1000/g" /tmp/varmail.f'
-        execute_cmd(cmd, hosts)
-        cmd = 'sed -i "s/nthreads=16/nthreads=%s/g" /tmp/varmail.f' % n_threads
-        execute_cmd(cmd, hosts)
-
-        logger.info('Clearing cache ')
-        cmd = 'rm -rf /tmp/dc-$(hostname)/bigfileset'
-        execute_cmd(cmd, hosts)
-        cmd = 'sync; echo 3 > /proc/sys/vm/drop_caches'
-        execute_cmd(cmd, hosts)
+    def run_mailserver(self, hosts, mountpoint, duration, n_threads, abort_patterns=None, log_dir=None):
+        """Run the mailserver workload of filebench on the hosts
+
+        Parameters
+        ----------
+        hosts: list of string
+            the list of hostnames
+
+        mountpoint: str
+            the directory where filebench creates its files
+
+        duration: int
+            the duration of the run in seconds
+
+        n_threads: int
+            the number of threads of filebench
+
+        abort_patterns: dict
+            key: str, the path of a remote log file to follow during the run, e.g. /tmp/elmer.log
+            value: list of str, the regular expressions that abort the run when a line matches them
+
+        log_dir: str
+            the local directory where the followed remote log files are copied
+
+        Returns
+        -------
+        bool
+            True if filebench runs successfully on all hosts
+        """
+
+        logger.info('Dowloading and editing the Filebench configuration file, clearing cache')
+        batch = CommandBatch(hosts, stop_on_failure=False)
+        batch.add('wget https://raw.githubusercontent.com/filebench/filebench/master/workloads/varmail.f -P /tmp/ -N')
+        batch.add('sed -i "s/tmp/%s/g" /tmp/varmail.f' % mountpoint)
+        batch.add('sed -i "s/run 60/run %s/g" /tmp/varmail.f' % duration)
+        batch.add('sed -i "s/name=bigfileset/name=bigfileset-$(hostname)/g" /tmp/varmail.f')
+        batch.add('sed -i "s/meandirwidth=1000000/meandirwidth=1000/g" /tmp/varmail.f')
+        batch.add('sed -i "s/nthreads=16/nthreads=%s/g" /tmp/varmail.f' % n_threads)
+        batch.add('rm -rf /tmp/dc-$(hostname)/bigfileset')
+        batch.add('sync; echo 3 > /proc/sys/vm/drop_caches')
+        batch.run()
 
         logger.info('Running mailserver on hosts:\n%s' % hosts)
         logger.info('Running filebench in %s second' % duration)
         cmd = 'setarch $(arch) -R filebench -f /tmp/varmail.f > /tmp/results/filebench_$(hostname)'
-        _, results = execute_cmd(cmd, hosts, mode='start')
-        for each in results.processes:
-            if 'Failed to create filesets' in each.stdout.strip():
-                logger.info('Cannot run filebench.')
-                return False
-        sleep(duration + 60)
+        job = start_job(cmd, hosts, name='filebench')
+        abort = threading.Event()
+        tailers = list()
+        for remote_path, patterns in (abort_patterns or dict()).items():
+            sink = os.path.join(log_dir or get_output_log_dir(), os.path.basename(remote_path))
+            tailer = RemoteLogTailer(remote_path, hosts, sink)
+            for pattern in patterns:
+                tailer.add_trigger(pattern, lambda host, line: abort.set())
+            tailers.append(tailer.start())
+        try:
+            is_finished = job.wait(timeout=duration + 600, interval=10, abort=abort)
+        finally:
+            for tailer in tailers:
+                tailer.stop()
+        if abort.is_set():
+            logger.info('Aborting filebench, a followed log file matches an abort pattern')
+        if not is_finished:
+            logger.info('Filebench does not finish, killing it')
+            job.kill()
+            return False
+        failed_hosts = [host for host, exit_code in job.exit_codes.items() if exit_code != 0]
+        cmd = "grep -l 'Failed to create filesets' /tmp/results/filebench_$(hostname)"
+        _, r = execute_cmd(cmd, hosts)
+        failed_hosts += [host for host, output in r.report.stdout().items() if output]
+        if failed_hosts:
+            logger.info('Cannot run filebench on hosts:\n%s' % '\n'.join(sorted(set(failed_hosts))))
+            return False
         return True
@@ -1,13 +1,12 @@
 import os
 import re
-import shutil
 
 from time import sleep
 
 from cloudal.utils import get_logger, execute_cmd, getput_file
 from cloudal.configurator import k8s_resources_configurator, CancelException
+from cloudal.configurator.k8s_resources_configurator import get_manifest_renderer
 
-import yaml
 logger = get_logger()
 
 
@@ -31,14 +30,6 @@ class fmke_configurator(object):
         kube_namespace: str
             the name of K8s namespace
         """
-        logger.debug('Delete old k8s yaml files if exists')
-        for filename in os.listdir(fmke_yaml_path):
-            if filename.startswith('create_fmke_client_') or filename.startswith('fmke_client_'):
-                if '.template' not in filename:
-                    try:
-                        os.remove(os.path.join(fmke_yaml_path, filename))
-                    except OSError:
-                        logger.debug('Error while deleting file')
         if workload:
             logger.debug('Create the new workload ratio')
             new_workload = ',\n'.join(['  {%s, %s}' % (key, val) for key, val in workload.items()])
@@ -50,7 +41,8 @@ class fmke_configurator(object):
                                                    label_selectors='app=fmke',
                                                    kube_namespace=kube_namespace)
 
-        fmke_client_files = list()
+        renderer = get_manifest_renderer()
+        fmke_clients = list()
         config_file_path = os.path.join(fmke_yaml_path, 'fmke_client.config.template')
         create_file_path = os.path.join(fmke_yaml_path, 'create_fmke_client.yaml.template')
         for fmke in fmke_list.items:
@@ -75,21 +67,18 @@ class fmke_configurator(object):
             getput_file(hosts=fmke.status.host_ip, file_paths=[file_path], dest_location='/tmp/fmke_client/', action='put')
 
 
-            logger.debug('Create create_fmke_client.yaml files to deploy one FMKe client')
-            with open(create_file_path) as f:
-                doc = yaml.safe_load(f)            
+            logger.debug('Render the job to deploy one FMKe client')
+            doc = renderer.load(create_file_path)
             doc['metadata']['name'] = 'fmke-client-%s' % node
             doc['spec']['template']['spec']['containers'][0]['lifecycle']['postStart']['exec']['command'] = [
                 'cp', '/cluster_node/fmke_client_%s.config' % node, '/fmke_client/fmke_client.config']
             doc['spec']['template']['spec']['nodeSelector'] = {
                 'service': 'fmke', 'kubernetes.io/hostname': '%s' % fmke.spec.node_name}
-            file_path = os.path.join(fmke_yaml_path, 'create_fmke_client_%s.yaml' % node)
-            with open(file_path, 'w') as f:
-                yaml.safe_dump(doc, f)
-            fmke_client_files.append(file_path)
+            fmke_clients.append(doc)
+        renderer.dump('create_fmke_client', fmke_clients)
 
         logger.info('Starting FMKe client instances on each AntidoteDB DC')
-        configurator.deploy_k8s_resources(files=fmke_client_files, namespace=kube_namespace)
+        configurator.deploy_k8s_resources(manifests=fmke_clients, namespace=kube_namespace)
         sleep(20)
         logger.info('Checking if deploying enough the number of running FMKe_client or not')
         fmke_client_list = configurator.get_k8s_resources_name(resource='pod',
@@ -126,23 +115,11 @@ class fmke_configurator(object):
         kube_namespace: str
             the name of K8s namespace
         """
-        logger.debug('Delete old deployment files')
-        for filename in os.listdir(fmke_yaml_path):
-            if '.template' not in filename:
-                try:
-                    os.remove(os.path.join(fmke_yaml_path, filename))
-                except OSError:
-                    logger.debug('Error while deleting file')
-
-        logger.debug('Create headless service file')
-        file1 = os.path.join(fmke_yaml_path, 'headlessService.yaml.template')
-        file2 = os.path.join(fmke_yaml_path, 'headlessService.yaml')
-        shutil.copyfile(file1, file2)
-
-        logger.debug('Create FMKe statefulSet files for each DC')
+        renderer = get_manifest_renderer()
+        fmke_apps = renderer.load_all(os.path.join(fmke_yaml_path, 'headlessService.yaml.template'))
+
+        logger.debug('Render the FMKe statefulSet of each DC')
         file_path = os.path.join(fmke_yaml_path, 'statefulSet_fmke.yaml.template')
-        with open(file_path) as f:
-            doc = yaml.safe_load(f)
 
         for i in range(1,11):
             if 2 ** i > concurrent_clients:
@@ -159,6 +136,7 @@ class fmke_configurator(object):
             for service in service_list.items:
                 if cluster.lower() in service.metadata.name:
                     ip = service.spec.cluster_ip
+            doc = renderer.load(file_path)
             doc['spec']['replicas'] = n_fmke_app_per_dc
             doc['metadata']['name'] = 'fmke-%s' % cluster.lower()
             doc['spec']['template']['spec']['containers'][0]['env'] = [
@@ -166,17 +144,17 @@ class fmke_configurator(object):
                 {'name': 'CONNECTION_POOL_SIZE', 'value': '%s' % connection_pool_size}]
             doc['spec']['template']['spec']['nodeSelector'] = {
                 'service': 'fmke', 'cluster': '%s' % cluster.lower()}
-            file_path = os.path.join(fmke_yaml_path, 'statefulSet_fmke_%s.yaml' % cluster.lower())
-            with open(file_path, 'w') as f:
-                yaml.safe_dump(doc, f)
+            fmke_apps.append(doc)
+        renderer.dump('statefulSet_fmke', fmke_apps)
 
         logger.info('Starting FMKe instances on each AntidoteDB DC')
-        configurator.deploy_k8s_resources(path=fmke_yaml_path, namespace=kube_namespace)
+        configurator.deploy_k8s_resources(manifests=fmke_apps, namespace=kube_namespace)
 
         logger.info('Waiting until all fmke app instances are up')
         deploy_ok = configurator.wait_k8s_resources(resource='pod',
                                                     label_selectors='app=fmke',
                                                     timeout=600,
+                                                    n_expected=n_fmke_app_per_dc * len(clusters),
                                                     kube_namespace=kube_namespace)
 
         if not deploy_ok:
@@ -219,19 +197,18 @@ class fmke_configurator(object):
             for fmke in fmke_list.items:
                 if cluster.lower() in fmke.metadata.name:
                     fmke_IPs.append('fmke@%s' % fmke.status.pod_ip)
-        with open(os.path.join(fmke_yaml_path, 'populate_data.yaml.template')) as f:
-            doc = yaml.safe_load(f)
+        renderer = get_manifest_renderer()
+        template_path = os.path.join(fmke_yaml_path, 'populate_data.yaml.template')
+        doc = renderer.load(template_path)
         doc['metadata']['name'] = 'populate-data-without-prescriptions'
         doc['spec']['template']['spec']['containers'][0]['args'] = ['-f -d %s --noprescriptions -p %s' %
                                                                     (dataset, n_fmke_pop_process)] + fmke_IPs
-        with open(os.path.join(fmke_yaml_path, 'populate_data.yaml'), 'w') as f:
-            yaml.safe_dump(doc, f)
+        renderer.dump('populate_data_without_prescriptions', [doc])
 
         logger.info('Populating the FMKe benchmark data without prescriptions')
         logger.debug('Init configurator: k8s_resources_configurator')
         configurator = k8s_resources_configurator()
-        configurator.deploy_k8s_resources(files=[os.path.join(fmke_yaml_path, 'populate_data.yaml')],
-                                          namespace=kube_namespace)
+        configurator.deploy_k8s_resources(manifests=[doc], namespace=kube_namespace)
 
         logger.info('Waiting for populating data without prescriptions')
         deploy_ok = configurator.wait_k8s_resources(resource='job',
@@ -264,18 +241,15 @@ class fmke_configurator(object):
                 raise CancelException('Populating process ERROR')
             logger.debug('FMKe populator result: \n%s' % pop_result)
 
-        logger.debug('Modify the populate_data file to populate prescriptions')
-        with open(os.path.join(fmke_yaml_path, 'populate_data.yaml.template')) as f:
-            doc = yaml.safe_load(f)
+        logger.debug('Render the populate_data job to populate prescriptions')
+        doc = renderer.load(template_path)
         doc['metadata']['name'] = 'populate-data-with-onlyprescriptions'
         doc['spec']['template']['spec']['containers'][0]['args'] = [
             '-f --onlyprescriptions -p 1'] + fmke_IPs
-        with open(os.path.join(fmke_yaml_path, 'populate_data.yaml'), 'w') as f:
-            yaml.safe_dump(doc, f)
+        renderer.dump('populate_data_with_onlyprescriptions', [doc])
 
         logger.info('Populating the FMKe benchmark data with prescriptions')
-        configurator.deploy_k8s_resources(files=[os.path.join(fmke_yaml_path, 'populate_data.yaml')],
-                                          namespace=kube_namespace)
+        configurator.deploy_k8s_resources(manifests=[doc], namespace=kube_namespace)
 
         logger.info('Waiting for populating data with prescriptions')
         configurator.wait_k8s_resources(resource='job',
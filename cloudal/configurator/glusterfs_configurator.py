@@ -14,10 +14,11 @@ class glusterfs_configurator(object):
         execute_cmd(cmd, hosts)
 
         gluster_configuration = list()
+        cmd = "hostname -I | awk '{print $1}'"
+        _, r = execute_cmd(cmd, hosts)
+        host_ips = r.report.stdout()
         for index, host in enumerate(hosts):
-            cmd = "hostname -I | awk '{print $1}'"
-            _, r = execute_cmd(cmd, host)
-            host_ip = r.processes[0].stdout.strip()
+            host_ip = host_ips[host]
             gluster_configuration.append("%s gluster-%s.%s.local gluster-%s " % (host_ip, index, host, index))
         gluster_configuration = "\n".join(gluster_configuration)
         cmd = "echo '%s' >> /etc/hosts" % gluster_configuration
@@ -1,17 +1,588 @@
 import os
+import copy
 import json
+import yaml
+import threading
 from functools import partial
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import sleep, time
 
 from cloudal.utils import get_logger
 
-from kubernetes import utils, client
+from kubernetes import client, watch
+from kubernetes.client.rest import ApiException
+from kubernetes.dynamic import DynamicClient
 from kubernetes.stream import stream
 from kubernetes.utils import FailToCreateError
 from kubernetes.client.api_client import ApiClient
 
 logger = get_logger()
 
+K8S_POOL_SIZE = 32
+# GKE access tokens are valid for 1 hour, they are refreshed before
+K8S_TOKEN_LIFETIME = 50 * 60
+
+K8S_APPLY_WORKERS = 16
+K8S_FIELD_MANAGER = 'cloudal'
+# the order of the kinds in a deploy: an object is applied after the objects of the lower ranks
+# that it can depend on, i.e. the cluster-scoped ones and the ones of its namespace
+K8S_KIND_RANKS = {
+    'Namespace': 0,
+    'CustomResourceDefinition': 0,
+    'StorageClass': 0,
+    'PriorityClass': 0,
+    'PersistentVolume': 1,
+    'ServiceAccount': 1,
+    'ClusterRole': 1,
+    'Role': 1,
+    'ConfigMap': 1,
+    'Secret': 1,
+    'ClusterRoleBinding': 2,
+    'RoleBinding': 2,
+    'PersistentVolumeClaim': 2,
+    'Service': 3,
+}
+# the workloads and the other kinds
+K8S_DEFAULT_RANK = 4
+K8S_CLUSTER_KINDS = ('Namespace', 'CustomResourceDefinition', 'StorageClass', 'PriorityClass',
+                     'PersistentVolume', 'ClusterRole', 'ClusterRoleBinding', 'Node')
+
+
+class K8sClientRegistry(object):
+    """Keep one long-lived ApiClient per k8s cluster endpoint
+
+    The ApiClient keeps its HTTPS connections alive in a pool, so the calls to the same
+    cluster reuse the connections and the TLS sessions instead of opening new ones.
+    The number of requests and their latency are recorded per cluster.
+
+    Parameters
+    ----------
+    pool_size: int
+        the maximum number of connections kept open to each cluster
+    """
+
+    def __init__(self, pool_size=K8S_POOL_SIZE):
+        self.pool_size = pool_size
+        self.clients = dict()
+        self.metrics = dict()
+        self.token_refreshers = dict()
+        self.dynamic_clients = dict()
+        self._lock = threading.Lock()
+
+    def _get_endpoint(self, kube_config):
+        return kube_config.host or 'default'
+
+    def get_client(self, kube_config=None):
+        """Get the ApiClient of a cluster, it is created at the first call for this cluster
+
+        Parameters
+        ----------
+        kube_config: kubernetes.client.configuration.Configuration
+            the configuration to the kubernetes cluster, the default configuration is used if None
+
+        Returns
+        -------
+        kubernetes.client.api_client.ApiClient
+        """
+        if kube_config is None:
+            kube_config = client.Configuration.get_default_copy()
+        endpoint = self._get_endpoint(kube_config)
+        with self._lock:
+            api_client = self.clients.get(endpoint)
+            if api_client is None:
+                kube_config.connection_pool_maxsize = self.pool_size
+                api_client = ApiClient(kube_config)
+                api_client.call_api = partial(self._call_api, endpoint, api_client.call_api)
+                self.clients[endpoint] = api_client
+                self.metrics[endpoint] = {'requests': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0}
+                logger.debug('Created the k8s client of %s' % endpoint)
+            elif kube_config is not api_client.configuration and endpoint not in self.token_refreshers:
+                # a new configuration of the same cluster may come with a new token
+                api_client.configuration.api_key.update(kube_config.api_key)
+            return api_client
+
+    def get_dynamic_client(self, kube_config=None):
+        """Get the DynamicClient of a cluster, on top of its shared ApiClient
+
+        The API discovery of the cluster is done at the first call for this cluster only.
+        """
+        api_client = self.get_client(kube_config)
+        endpoint = self._get_endpoint(api_client.configuration)
+        with self._lock:
+            if endpoint not in self.dynamic_clients:
+                self.dynamic_clients[endpoint] = DynamicClient(api_client)
+            return self.dynamic_clients[endpoint]
+
+    def set_token_refresher(self, kube_config, refresh_token, token_lifetime=K8S_TOKEN_LIFETIME):
+        """Refresh the bearer token of a cluster when it is about to expire or is rejected
+
+        Parameters
+        ----------
+        kube_config: kubernetes.client.configuration.Configuration
+            the configuration to the kubernetes cluster
+
+        refresh_token: function
+            a function without argument that returns a new token
+
+        token_lifetime: int
+            the number of seconds after which the token is refreshed before a request
+        """
+        api_client = self.get_client(kube_config)
+        endpoint = self._get_endpoint(api_client.configuration)
+        refresher = {'refresh_token': refresh_token, 'lifetime': token_lifetime,
+                     'refreshed_at': time(), 'lock': threading.Lock()}
+        with self._lock:
+            self.token_refreshers[endpoint] = refresher
+
+        def refresh_api_key_hook(configuration):
+            if time() - refresher['refreshed_at'] > refresher['lifetime']:
+                self._refresh_token(endpoint)
+        api_client.configuration.refresh_api_key_hook = refresh_api_key_hook
+
+    def _refresh_token(self, endpoint):
+        refresher = self.token_refreshers[endpoint]
+        with refresher['lock']:
+            logger.debug('Refreshing the token of %s' % endpoint)
+            self.clients[endpoint].configuration.api_key['authorization'] = refresher['refresh_token']()
+            refresher['refreshed_at'] = time()
+
+    def _call_api(self, endpoint, call_api, method, url, header_params=None, *args, **kwargs):
+        start = time()
+        try:
+            response = call_api(method, url, header_params, *args, **kwargs)
+            if response.status == 401 and endpoint in self.token_refreshers:
+                # the token expired earlier than expected, the request is sent again with a new one,
+                # after the rejected response is released so its connection goes back to the pool
+                response.response.drain_conn()
+                response.response.release_conn()
+                self._refresh_token(endpoint)
+                header_params['authorization'] = self.clients[endpoint].configuration.get_api_key_with_prefix(
+                    'BearerToken', alias='authorization')
+                response = call_api(method, url, header_params, *args, **kwargs)
+        except Exception:
+            self._record(endpoint, time() - start, error=True)
+            raise
+        self._record(endpoint, time() - start, error=response.status >= 400)
+        return response
+
+    def _record(self, endpoint, duration, error):
+        with self._lock:
+            metrics = self.metrics[endpoint]
+            metrics['requests'] += 1
+            metrics['errors'] += int(error)
+            metrics['total_time'] += duration
+            metrics['max_time'] = max(metrics['max_time'], duration)
+
+    def stats(self):
+        """Get the number of requests and their latency for each cluster
+
+        Returns
+        -------
+        dict
+            key: str, the endpoint of a cluster
+            value: dict of the number of requests and errors, the mean and max latency in seconds
+        """
+        with self._lock:
+            return {endpoint: {'requests': m['requests'],
+                               'errors': m['errors'],
+                               'mean_time': m['total_time'] / m['requests'] if m['requests'] else 0.0,
+                               'max_time': m['max_time']}
+                    for endpoint, m in self.metrics.items()}
+
+    def close(self):
+        with self._lock:
+            for api_client in self.clients.values():
+                api_client.close()
+            self.clients.clear()
+            self.dynamic_clients.clear()
+
+
+k8s_client_registry_singleton = list()
+
+
+def get_k8s_client_registry():
+    if not k8s_client_registry_singleton:
+        k8s_client_registry_singleton.append(K8sClientRegistry())
+    return k8s_client_registry_singleton[0]
+
+
+K8S_INFORMER_SYNC_TIMEOUT = 60
+K8S_INFORMER_WATCH_TIMEOUT = 300
+
+
+def _parse_label_selectors(label_selectors):
+    """Parse equality-based label selectors: key1=value1,key2!=value2,key3
+
+    Returns
+    -------
+    list of tuple (key, operator, value)
+        the requirements of the selectors, None if they use set-based selectors
+    """
+    requirements = list()
+    for selector in (label_selectors or '').split(','):
+        selector = selector.strip()
+        if not selector:
+            continue
+        if '(' in selector or ' ' in selector:
+            return None
+        if '!=' in selector:
+            key, value = selector.split('!=', 1)
+            requirements.append((key.strip(), '!=', value.strip()))
+        elif '=' in selector:
+            key, value = selector.replace('==', '=').split('=', 1)
+            requirements.append((key.strip(), '=', value.strip()))
+        elif selector.startswith('!'):
+            requirements.append((selector[1:], '!', None))
+        else:
+            requirements.append((selector, 'exists', None))
+    return requirements
+
+
+class K8sInformer(object):
+    """A local copy of the k8s resources of a kind, kept up to date with the k8s watch API
+
+    The resources are listed once, then the changes are received in a background thread.
+    The resources are indexed by label, so the label selector queries are answered from memory.
+
+    Parameters
+    ----------
+    list_resources: function
+        the list function of the k8s API for this kind, with its namespace if any
+
+    name: str
+        the name of the informer, used in the logs
+    """
+
+    def __init__(self, list_resources, name):
+        self.list_resources = list_resources
+        self.name = name
+        self.objects = dict()
+        # (label key, label value) -> the keys of the objects with this label
+        self.index = dict()
+        self.synced = threading.Event()
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._watcher = None
+        self._thread = None
+
+    def _get_key(self, r):
+        return (r.metadata.namespace, r.metadata.name)
+
+    def _add(self, r):
+        self._remove(self._get_key(r))
+        key = self._get_key(r)
+        self.objects[key] = r
+        for label in (r.metadata.labels or dict()).items():
+            self.index.setdefault(label, set()).add(key)
+
+    def _remove(self, key):
+        r = self.objects.pop(key, None)
+        if r is not None:
+            for label in (r.metadata.labels or dict()).items():
+                self.index[label].discard(key)
+
+    def _relist(self):
+        resources = self.list_resources()
+        with self._lock:
+            self.objects = dict()
+            self.index = dict()
+            for r in resources.items:
+                self._add(r)
+        self.synced.set()
+        return resources.metadata.resource_version
+
+    def _run(self):
+        resource_version = None
+        while not self._stopped:
+            try:
+                if resource_version is None:
+                    resource_version = self._relist()
+                self._watcher = watch.Watch()
+                for event in self._watcher.stream(self.list_resources, resource_version=resource_version,
+                                                  timeout_seconds=K8S_INFORMER_WATCH_TIMEOUT):
+                    with self._lock:
+                        if event['type'] == 'DELETED':
+                            self._remove(self._get_key(event['object']))
+                        elif event['type'] in ('ADDED', 'MODIFIED'):
+                            self._add(event['object'])
+                    resource_version = self._watcher.resource_version
+            except ApiException as e:
+                if e.status != 410:
+                    logger.warning('Watch of %s failed: %s' % (self.name, e.reason))
+                    sleep(1)
+                resource_version = None
+            except Exception as e:
+                logger.warning('Watch of %s failed: %s' % (self.name, e))
+                sleep(1)
+                resource_version = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if self._watcher is not None:
+            self._watcher.stop()
+
+    def list(self, label_selectors=''):
+        """Get the resources that match the label selectors
+
+        Returns
+        -------
+        list of k8s resources
+            None if the label selectors cannot be answered from the local copy
+        """
+        requirements = _parse_label_selectors(label_selectors)
+        if requirements is None or not self.synced.wait(K8S_INFORMER_SYNC_TIMEOUT):
+            return None
+        with self._lock:
+            keys = None
+            for key, operator, value in requirements:
+                if operator == '=':
+                    matches = self.index.get((key, value), set())
+                    keys = matches if keys is None else keys & matches
+            if keys is None:
+                keys = set(self.objects)
+            resources = list()
+            for name in sorted(keys):
+                labels = self.objects[name].metadata.labels or dict()
+                if all((operator == '=') or
+                       (operator == '!=' and labels.get(key) != value) or
+                       (operator == '!' and key not in labels) or
+                       (operator == 'exists' and key in labels)
+                       for key, operator, value in requirements):
+                    resources.append(self.objects[name])
+            return resources
+
+    def get(self, name, namespace=None):
+        """Get a resource by its name, None if it does not exist"""
+        if not self.synced.wait(K8S_INFORMER_SYNC_TIMEOUT):
+            return None
+        with self._lock:
+            return self.objects.get((namespace, name))
+
+
+class K8sInformerRegistry(object):
+    """The informers of the pods, nodes and services of the k8s clusters
+
+    The informers are disabled by default, when they are enabled with `enable()`,
+    `k8s_resources_configurator` answers the queries of these resources from them.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.informers = dict()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def get_informer(self, resource, kube_config=None, kube_namespace='default'):
+        """Get the informer of a kind of resources, it is started at the first call
+
+        Returns
+        -------
+        K8sInformer
+            None if the informers are disabled or if this kind of resources is not supported
+        """
+        if not self.enabled or resource not in ('pod', 'node', 'service'):
+            return None
+        api_client = get_k8s_client_registry().get_client(kube_config)
+        v1 = client.CoreV1Api(api_client)
+        if resource == 'pod':
+            list_resources = partial(v1.list_namespaced_pod, namespace=kube_namespace)
+        elif resource == 'node':
+            list_resources = v1.list_node
+            kube_namespace = None
+        else:
+            list_resources = v1.list_service_for_all_namespaces
+            kube_namespace = None
+        key = (api_client.configuration.host, resource, kube_namespace)
+        with self._lock:
+            informer = self.informers.get(key)
+            if informer is None:
+                informer = K8sInformer(list_resources, '%s %s' % (resource, kube_namespace or ''))
+                informer.start()
+                self.informers[key] = informer
+            return informer
+
+    def stop(self):
+        with self._lock:
+            for informer in self.informers.values():
+                informer.stop()
+            self.informers.clear()
+
+
+k8s_informer_registry_singleton = list()
+
+
+def get_k8s_informer_registry():
+    if not k8s_informer_registry_singleton:
+        k8s_informer_registry_singleton.append(K8sInformerRegistry())
+    return k8s_informer_registry_singleton[0]
+
+
+def load_manifests(files):
+    """Load the k8s objects of yaml files
+
+    Parameters
+    ----------
+    files: list of str
+        the paths to the yaml files, a file can contain several documents and `List` objects
+
+    Returns
+    -------
+    list of dict
+        the k8s objects, in the order of the files
+    """
+    manifests = list()
+    for file in files:
+        with open(file) as f:
+            for doc in yaml.safe_load_all(f):
+                if not doc:
+                    continue
+                if doc.get('kind', '').endswith('List') and 'items' in doc:
+                    manifests += doc['items']
+                else:
+                    manifests.append(doc)
+    return manifests
+
+
+class ManifestRenderer(object):
+    """Render k8s objects from yaml templates in memory
+
+    Each template file is read and parsed once, the objects are rendered from copies
+    of the parsed template and are given to the k8s API directly, without being written
+    to files and parsed again. The rendered objects are written in `dump_dir` if it is set,
+    to check them.
+
+    Parameters
+    ----------
+    dump_dir: str
+        the directory to write the rendered objects in, None to not write them
+    """
+
+    def __init__(self, dump_dir=None):
+        self.dump_dir = dump_dir
+        # path -> the modification time, the text and the parsed documents of a template
+        self.templates = dict()
+        self._lock = threading.Lock()
+
+    def _get_template(self, path):
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            template = self.templates.get(path)
+            if template is None or template['mtime'] != mtime:
+                with open(path) as f:
+                    template = {'mtime': mtime, 'text': f.read(), 'docs': None}
+                self.templates[path] = template
+            return template
+
+    def load_all(self, path):
+        """Get copies of the k8s objects of a yaml template"""
+        template = self._get_template(path)
+        if template['docs'] is None:
+            template['docs'] = [doc for doc in yaml.safe_load_all(template['text']) if doc]
+        return copy.deepcopy(template['docs'])
+
+    def load(self, path):
+        """Get a copy of the k8s object of a yaml template with one object"""
+        return self.load_all(path)[0]
+
+    def render_text(self, path, replacements):
+        """Get the k8s objects of a yaml template after replacing strings in its text
+
+        Parameters
+        ----------
+        path: str
+            the path to the template
+
+        replacements: dict
+            key: str, the string to replace
+            value: str, the new string
+        """
+        text = self._get_template(path)['text']
+        for old, new in replacements.items():
+            text = text.replace(old, new)
+        return [doc for doc in yaml.safe_load_all(text) if doc]
+
+    def dump(self, name, manifests):
+        """Write the rendered objects in `dump_dir` as `name.yaml`, if `dump_dir` is set"""
+        if self.dump_dir is None:
+            return
+        if not os.path.exists(self.dump_dir):
+            os.makedirs(self.dump_dir)
+        with open(os.path.join(self.dump_dir, '%s.yaml' % name), 'w') as f:
+            yaml.safe_dump_all(manifests, f)
+
+
+manifest_renderer_singleton = list()
+
+
+def get_manifest_renderer():
+    if not manifest_renderer_singleton:
+        manifest_renderer_singleton.append(ManifestRenderer())
+    return manifest_renderer_singleton[0]
+
+
+def get_apply_dependencies(manifests, namespace='default'):
+    """Build the dependency DAG of k8s objects
+
+    An object depends on the objects of the lower ranks in `K8S_KIND_RANKS`
+    that are cluster-scoped or in its namespace, e.g. a StatefulSet depends on the Namespace,
+    the ConfigMaps and the Services of its namespace.
+
+    Returns
+    -------
+    list of set of int
+        the indexes of the objects that each object depends on
+    """
+    def get_namespace(manifest):
+        if manifest['kind'] in K8S_CLUSTER_KINDS:
+            return None
+        return manifest['metadata'].get('namespace') or namespace
+
+    ranks = [K8S_KIND_RANKS.get(manifest['kind'], K8S_DEFAULT_RANK) for manifest in manifests]
+    namespaces = [get_namespace(manifest) for manifest in manifests]
+    dependencies = list()
+    for i in range(len(manifests)):
+        dependencies.append(set(j for j in range(len(manifests))
+                                if ranks[j] < ranks[i] and namespaces[j] in (None, namespaces[i])))
+    return dependencies
+
+
+def _get_manifest_name(manifest):
+    return '%s/%s' % (manifest['kind'], manifest['metadata'].get('name'))
+
+
+def _has_condition(r, condition_type):
+    return any(condition.status == 'True' and condition.type.lower() == condition_type
+               for condition in r.status.conditions or list())
+
+
+def _replicas_ready(r):
+    replicas = r.spec.replicas if r.spec.replicas is not None else 1
+    return ((r.status.observed_generation or 0) >= (r.metadata.generation or 0) and
+            (r.status.ready_replicas or 0) >= replicas and
+            (r.status.updated_replicas or 0) >= replicas)
+
+
+# the list type of each resource that can be served by an informer
+INFORMER_LIST_TYPES = {
+    'pod': client.V1PodList,
+    'node': client.V1NodeList,
+    'service': client.V1ServiceList,
+}
+
+# the API, list function and readiness check of each resource that can be waited for
+READY_CONDITIONS = {
+    'pod': (client.CoreV1Api, 'list_namespaced_pod', partial(_has_condition, condition_type='ready')),
+    'job': (client.BatchV1Api, 'list_namespaced_job', partial(_has_condition, condition_type='complete')),
+    'deployment': (client.AppsV1Api, 'list_namespaced_deployment', _replicas_ready),
+    'statefulset': (client.AppsV1Api, 'list_namespaced_stateful_set', _replicas_ready),
+}
+
 
 def _split_argument(command):
     """Spliting arguments in a command to be use by K8s API
@@ -53,8 +624,76 @@ class k8s_resources_configurator(object):
     """
     """
 
-    def deploy_k8s_resources(self, path=None, files=None, kube_config=None, namespace="default"):
-        """Deploy k8s resources on a k8s cluster from deployment yaml files
+    def apply_k8s_resources(self, manifests, kube_config=None, namespace='default', max_workers=K8S_APPLY_WORKERS):
+        """Apply k8s objects on a k8s cluster with server-side apply, in the order of their dependencies
+
+        The objects whose dependencies are applied are submitted concurrently. An object that
+        exists already is updated, and is not changed if it is the same.
+
+        Parameters
+        ----------
+        manifests: list of dict
+            the k8s objects
+
+        kube_config: kubernetes.client.configuration.Configuration
+            the configuration to the kubernetes cluster
+
+        namespace: string
+            the namespace of the objects that do not set their namespace
+
+        max_workers: int
+            the maximum number of objects applied at once
+
+        Returns
+        -------
+        list of str
+            the objects that cannot be applied, as `kind/name`
+        """
+        dynamic_client = get_k8s_client_registry().get_dynamic_client(kube_config)
+
+        def apply(manifest):
+            resource = dynamic_client.resources.get(api_version=manifest['apiVersion'], kind=manifest['kind'])
+            dynamic_client.server_side_apply(resource,
+                                             body=manifest,
+                                             namespace=manifest['metadata'].get('namespace') or namespace,
+                                             field_manager=K8S_FIELD_MANAGER,
+                                             force_conflicts=True)
+
+        dependencies = get_apply_dependencies(manifests, namespace)
+        pending = set(range(len(manifests)))
+        applied = set()
+        failed = set()
+        futures = dict()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while pending or futures:
+                for i in sorted(pending):
+                    if dependencies[i] & failed:
+                        logger.error('Skip %s because its dependencies cannot be applied' %
+                                     _get_manifest_name(manifests[i]))
+                        pending.discard(i)
+                        failed.add(i)
+                    elif dependencies[i] <= applied:
+                        pending.discard(i)
+                        futures[pool.submit(apply, manifests[i])] = i
+                if not futures:
+                    continue
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = futures.pop(future)
+                    try:
+                        future.result()
+                        applied.add(i)
+                        logger.debug('Apply %s successfully' % _get_manifest_name(manifests[i]))
+                    except ApiException as e:
+                        failed.add(i)
+                        logger.error('Error: %s, because: %s' % (e.reason, e.body))
+                    except Exception as e:
+                        failed.add(i)
+                        logger.error('Cannot apply %s: %s' % (_get_manifest_name(manifests[i]), e))
+        return [_get_manifest_name(manifests[i]) for i in sorted(failed)]
+
+    def deploy_k8s_resources(self, path=None, files=None, kube_config=None, namespace="default", manifests=None):
+        """Deploy k8s resources on a k8s cluster from deployment yaml files or k8s objects
 
         Parameters
         ----------
@@ -70,34 +709,114 @@ class k8s_resources_configurator(object):
         namespace: string
             a namespace for k8s working with
 
-        """
-        if kube_config:
-            api_client = ApiClient(kube_config)
-        else:
-            api_client = ApiClient()
+        manifests: list of dict
+            the k8s objects to deploy, e.g. rendered by `ManifestRenderer`
 
+        """
         if path is not None:
             files = list()
             for file in os.listdir(path):
                 if file.endswith('.yaml'):
                     files.append(os.path.join(path, file))
-        for file in files:
-            logger.info('--> Deploying file %s' % file.split('/')[-1])
+        manifests = list(manifests or list())
+        if files:
+            logger.info('--> Deploying files %s' % ', '.join(file.split('/')[-1] for file in files))
+            manifests = load_manifests(files) + manifests
+        self.apply_k8s_resources(manifests, kube_config=kube_config, namespace=namespace)
+
+    def watch_k8s_resources(self, resource, label_selectors, kube_config=None, kube_namespace='default',
+                            timeout=300, n_expected=1):
+        '''Watch specified k8s resources in a namespace until they are all completed or ready
+
+        The current state is listed once, then the changes are received from the k8s watch API,
+        so the wait returns as soon as the last resource reaches its condition.
+
+        Parameters
+        ----------
+        resource: string
+            the name of the resource (job, pod, deployment or statefulset)
+
+        label_selectors: string
+            the k8s labels used to filter to resource, the format is: key1=value1,key2=value2,...
+
+        kube_config: kubernetes.client.configuration.Configuration
+            the configuration to the kubernetes cluster
+
+        kube_namespace: string
+            the k8s namespace to perform the wait of k8s resources operation on,
+            the default namespace is 'default'
+
+        timeout: int
+            the number of seconds to wait before giving up
+
+        n_expected: int
+            the minimum number of resources to wait for, as the resources can be created
+            after the wait starts (e.g. the pods of a statefulset)
+
+        Returns
+        -------
+        dict
+            key: str, the name of a resource
+            value: float, the number of seconds until the resource was completed or ready,
+                   None if it was not before the timeout
+        '''
+        api_client = get_k8s_client_registry().get_client(kube_config)
+
+        if resource not in READY_CONDITIONS:
+            logger.info('Not support this type of resource: %s' % resource)
+            return dict()
+        api_class, list_name, is_ready = READY_CONDITIONS[resource]
+        list_resources = partial(getattr(api_class(api_client), list_name),
+                                 namespace=kube_namespace, label_selector=label_selectors)
+
+        start = time()
+        ready_times = dict()
+
+        def update(r):
+            name = r.metadata.name
+            if ready_times.get(name) is None:
+                ready_times[name] = time() - start if is_ready(r) else None
+                if ready_times[name] is not None:
+                    logger.debug('%s %s is up after %.1f seconds' % (resource, name, ready_times[name]))
+
+        def is_done():
+            return len(ready_times) >= n_expected and None not in ready_times.values()
+
+        resource_version = None
+        watcher = watch.Watch()
+        while not is_done() and time() - start < timeout:
+            if resource_version is None:
+                resources = list_resources()
+                for r in resources.items:
+                    update(r)
+                resource_version = resources.metadata.resource_version
+                continue
             try:
-                utils.create_from_yaml(k8s_client=api_client, yaml_file=file, namespace=namespace)
-                logger.debug('Deploy file %s successfully' % file)
-            except FailToCreateError as e:
-                for api_exception in e.api_exceptions:
-                    body = json.loads(api_exception.body)
-                    logger.error('Error: %s, because: %s' % (api_exception.reason, body['message']))
-
-    def wait_k8s_resources(self, resource, label_selectors, kube_config=None, kube_namespace='default', timeout=300):
+                for event in watcher.stream(list_resources, resource_version=resource_version,
+                                            timeout_seconds=max(1, int(timeout - (time() - start)))):
+                    if event['type'] == 'DELETED':
+                        ready_times.pop(event['object'].metadata.name, None)
+                    elif event['type'] in ('ADDED', 'MODIFIED'):
+                        update(event['object'])
+                    resource_version = watcher.resource_version
+                    if is_done():
+                        watcher.stop()
+            except ApiException as e:
+                if e.status != 410:
+                    raise
+                # the resource version is too old, list the resources again
+                logger.debug('Watch of %s expired, listing them again' % resource)
+                resource_version = None
+        return ready_times
+
+    def wait_k8s_resources(self, resource, label_selectors, kube_config=None, kube_namespace='default', timeout=300,
+                           n_expected=1):
         '''Wait until specified k8s resources are completed or ready in a namespace
 
         Parameters
         ----------
         resource: string
-            the name of the resource (job, pod, etc.)
+            the name of the resource (job, pod, deployment or statefulset)
 
         label_selectors: string
             the k8s labels used to filter to resource, the format is: key1=value1,key2=value2,...
@@ -112,6 +831,9 @@ class k8s_resources_configurator(object):
         timeout: int
             the number of seconds to wait before giving up
 
+        n_expected: int
+            the minimum number of resources to wait for
+
         Returns
         -------
         bool
@@ -119,49 +841,21 @@ class k8s_resources_configurator(object):
             False: wait unsuccessfully
 
         '''
-        MAX_ATTEMPT = 10
-        SLEEP_TIME = int(1.0 + timeout / MAX_ATTEMPT)
-        if kube_config:
-            api_client = ApiClient(kube_config)
-        else:
-            api_client = ApiClient()
-
-        if resource == 'job':
-            wait_condition = 'complete'
-            v1 = client.BatchV1Api(api_client)
-            list_resources = v1.list_namespaced_job
-        elif resource == 'pod':
-            wait_condition = 'ready'
-            v1 = client.CoreV1Api(api_client)
-            list_resources = v1.list_namespaced_pod
-        else:
-            logger.info('Not support this type of resource: %s' % resource)
-            return False
-
-        for attempt in range(MAX_ATTEMPT):
-            count = 0
-            resources = list_resources(label_selector=label_selectors, namespace=kube_namespace)
-            if not resources:
-                logger.info('Cannot find %s with labels %s in namespace %s' %
-                            (resource, label_selectors, kube_namespace))
-                sleep(SLEEP_TIME)
-                continue
-            for r in resources.items:
-                count += 1
-                if r.status.conditions is None:
-                    logger.debug('%s %s status is None' % (resource, r.metadata.name))
-                    break
-
-                for condition in r.status.conditions:
-                    if condition.status == 'True' and condition.type.lower() == wait_condition:
-                        logger.debug('Status of %s %s: %s' %
-                                     (resource, r.metadata.name, condition.type))
-                        count -= 1
-            if count == 0:
-                logger.debug('All %s are up' % resource)
-                return True
-            sleep(SLEEP_TIME)
-            logger.debug('Attempt #%s' % (attempt + 1))
+        ready_times = self.watch_k8s_resources(resource=resource,
+                                               label_selectors=label_selectors,
+                                               kube_config=kube_config,
+                                               kube_namespace=kube_namespace,
+                                               timeout=timeout,
+                                               n_expected=n_expected)
+        for name, ready_time in sorted(ready_times.items()):
+            logger.info('Time to ready of %s %s: %s' % (resource, name,
+                                                        '%.1fs' % ready_time if ready_time is not None else 'timeout'))
+        if len(ready_times) >= n_expected and None not in ready_times.values():
+            logger.debug('All %s are up' % resource)
+            return True
+        if len(ready_times) < n_expected:
+            logger.info('Cannot find %s %s with labels %s in namespace %s' %
+                        (n_expected, resource, label_selectors, kube_namespace))
         logger.info('Timeout! Cannot wait until all %s are up' % resource)
         return False
 
@@ -186,10 +880,7 @@ class k8s_resources_configurator(object):
         the content of the log
         '''
 
-        if kube_config:
-            api_client = ApiClient(kube_config)
-        else:
-            api_client = ApiClient()
+        api_client = get_k8s_client_registry().get_client(kube_config)
 
         v1 = client.CoreV1Api(api_client)
         log = v1.read_namespaced_pod_log(name=pod_name, namespace=kube_namespace)
@@ -220,10 +911,7 @@ class k8s_resources_configurator(object):
         (ref: https://github.com/kubernetes-client/python/blob/master/kubernetes/README.md#documentation-for-models)
 
         '''
-        if kube_config:
-            api_client = ApiClient(kube_config)
-        else:
-            api_client = ApiClient()
+        api_client = get_k8s_client_registry().get_client(kube_config)
 
         if resource == 'job':
             v1 = client.BatchV1Api(api_client)
@@ -244,6 +932,12 @@ class k8s_resources_configurator(object):
             logger.info('Not support this type of resource: %s' % resource)
             return False
 
+        informer = get_k8s_informer_registry().get_informer(resource, kube_config, kube_namespace)
+        if informer is not None:
+            items = informer.list(label_selectors)
+            if items is not None:
+                return INFORMER_LIST_TYPES[resource](items=items, metadata=client.V1ListMeta())
+
         resources = list_resources(label_selector=label_selectors)
         return resources
 
@@ -296,10 +990,7 @@ class k8s_resources_configurator(object):
         string
             the ip of a k8s endpoint
         '''
-        if kube_config:
-            api_client = ApiClient(kube_config)
-        else:
-            api_client = ApiClient()
+        api_client = get_k8s_client_registry().get_client(kube_config)
 
         v1 = client.CoreV1Api(api_client)
         endpoints = v1.read_namespaced_endpoints(name=service_name, namespace=kube_namespace)
@@ -323,10 +1014,7 @@ class k8s_resources_configurator(object):
         -------
         V1Namespace (https://github.com/kubernetes-client/python/blob/master/kubernetes/docs/V1Namespace.md)
         """
-        if kube_config:
-            api_client = ApiClient(kube_config)
-        else:
-            api_client = ApiClient()
+        api_client = get_k8s_client_registry().get_client(kube_config)
 
         v1 = client.CoreV1Api(api_client)
         logger.debug('Creating namespace % s' % namespace)
@@ -356,10 +1044,7 @@ class k8s_resources_configurator(object):
             True: delete successfully
             False: delete unsuccessfully
         """
-        if kube_config:
-            api_client = ApiClient(kube_config)
-        else:
-            api_client = ApiClient()
+        api_client = get_k8s_client_registry().get_client(kube_config)
 
         v1 = client.CoreV1Api(api_client)
         logger.debug('Deleting namespace %s' % namespace)
@@ -400,17 +1085,16 @@ class k8s_resources_configurator(object):
         None
             if label node unsuccessfully
         """
-        if kube_config:
-            api_client = ApiClient(kube_config)
-        else:
-            api_client = ApiClient()
+        api_client = get_k8s_client_registry().get_client(kube_config)
 
         v1 = client.CoreV1Api(api_client)
         logger.debug('Label node %s with %s' % (nodename, labels))
-        for node in v1.list_node().items:
-            if node.metadata.name == nodename:
-                break
+        informer = get_k8s_informer_registry().get_informer('node', kube_config)
+        if informer is not None and informer.synced.wait(K8S_INFORMER_SYNC_TIMEOUT):
+            node_exists = informer.get(nodename) is not None
         else:
+            node_exists = nodename in [node.metadata.name for node in v1.list_node().items]
+        if not node_exists:
             logger.warning('Node %s does not exist' % nodename)
             return None
 
@@ -448,10 +1132,9 @@ class k8s_resources_configurator(object):
         string
             the std output when run the command in the pod
         """
-        if kube_config:
-            api_client = ApiClient(kube_config)
-        else:
-            api_client = ApiClient()
+        # the exec stream replaces the transport of its client during the call,
+        # so it uses its own client with the configuration of the shared one
+        api_client = ApiClient(get_k8s_client_registry().get_client(kube_config).configuration)
 
         v1 = client.CoreV1Api(api_client)
         logger.debug('Run command %s on pod %s' % (command, pod_name))
@@ -474,10 +1157,7 @@ class k8s_resources_configurator(object):
             raise Exception(
                 "Please provide either a configmap or a file to create a Kubernetes configmap")
 
-        if kube_config:
-            api_client = ApiClient(kube_config)
-        else:
-            api_client = ApiClient()
+        api_client = get_k8s_client_registry().get_client(kube_config)
 
         # Configureate ConfigMap metadata
         metadata = client.V1ObjectMeta(name=configmap_name, namespace=namespace)
@@ -1,4 +1,4 @@
-from cloudal.utils import get_logger, execute_cmd
+from cloudal.utils import get_logger, execute_cmd, ensure_cmd, CommandBatch
 from cloudal.configurator import docker_configurator, packages_configurator
 
 
@@ -16,30 +16,26 @@ class kubernetes_configurator(object):
     def _install_kubeadm(self):
         logger.info('Starting installing kubeadm on %s nodes' % len(self.hosts))
 
-        logger.debug('Turning off Firewall on hosts')
-        cmd = '''cat <<EOF | sudo tee /etc/sysctl.d/k8s.conf
-                 net.bridge.bridge-nf-call-ip6tables = 1
-                 net.bridge.bridge-nf-call-iptables = 1'''
-        execute_cmd(cmd, self.hosts)
-        cmd = 'sudo sysctl --system'
-        execute_cmd(cmd, self.hosts)
-
-        logger.debug('Turning off swap on hosts')
-        cmd = 'swapoff -a'
-        execute_cmd(cmd, self.hosts)
+        logger.debug('Turning off Firewall and swap on hosts')
+        batch = CommandBatch(self.hosts, stop_on_failure=False)
+        batch.add("printf 'net.bridge.bridge-nf-call-ip6tables = 1\\nnet.bridge.bridge-nf-call-iptables = 1\\n' "
+                  "| sudo tee /etc/sysctl.d/k8s.conf")
+        batch.add('sudo sysctl --system')
+        batch.add('swapoff -a')
+        batch.run()
 
         logger.debug('Installing kubeadm kubelet kubectl')
         configurator = packages_configurator()
         configurator.install_packages(['apt-transport-https', 'curl'], self.hosts)
 
-        cmd = 'curl -s https://packages.cloud.google.com/apt/doc/apt-key.gpg | sudo apt-key add -'
-        execute_cmd(cmd, self.hosts)
-
-        cmd = '''cat <<EOF | sudo tee /etc/apt/sources.list.d/kubernetes.list
-                deb https://apt.kubernetes.io/ kubernetes-xenial main'''
-        execute_cmd(cmd, self.hosts)
+        batch = CommandBatch(self.hosts)
+        batch.add('curl -s https://packages.cloud.google.com/apt/doc/apt-key.gpg | sudo apt-key add -')
+        batch.add("echo 'deb https://apt.kubernetes.io/ kubernetes-xenial main' "
+                  "| sudo tee /etc/apt/sources.list.d/kubernetes.list")
+        batch.run()
 
-        configurator.install_packages(['kubelet', 'kubeadm', 'kubectl'], self.hosts)
+        # the index has to be refreshed again to find the packages of the new repository
+        configurator.install_packages(['kubelet', 'kubeadm', 'kubectl'], self.hosts, refresh=True)
 
     def deploy_kubernetes_cluster(self):
         configurator = docker_configurator(self.hosts)
@@ -54,12 +50,9 @@ class kubernetes_configurator(object):
         logger.info('Kubernetes master: %s' % self.kube_master)
         logger.info('Changing cgroups driver of Docker to systemd to be compatible with kubeadm v1.22+')
         # https://kubernetes.io/docs/tasks/administer-cluster/kubeadm/configure-cgroup-driver/
-        cmd = '''cat <<EOF >> /etc/docker/daemon.json
-        {
-        "exec-opts": ["native.cgroupdriver=systemd"]
-        }
-        EOF'''
-        execute_cmd(cmd, self.hosts)
+        cmd = ("printf '{\\n  \"exec-opts\": [\"native.cgroupdriver=systemd\"]\\n}\\n' "
+               "| tee /etc/docker/daemon.json")
+        ensure_cmd(cmd, self.hosts)
 
         logger.info('Restarting Docker')
         cmd = 'systemctl restart docker'
@@ -67,7 +60,7 @@ class kubernetes_configurator(object):
 
         logger.info('Initializing kubeadm on master')
         cmd = 'kubeadm init --pod-network-cidr=10.244.0.0/16'
-        execute_cmd(cmd, [self.kube_master])
+        ensure_cmd(cmd, [self.kube_master], log_step='kubeadm_init')
 
         cmd = '''mkdir -p $HOME/.kube
                  cp -i /etc/kubernetes/admin.conf $HOME/.kube/config
@@ -83,13 +76,14 @@ class kubernetes_configurator(object):
         logger.debug('Adding %s kube workers' % len(kube_workers))
         cmd = 'kubeadm join' + \
             result.processes[0].stdout.split('kubeadm join')[-1]
-        execute_cmd(cmd.strip(), kube_workers)
+        # the join command contains a new token at each run
+        ensure_cmd(cmd.strip(), kube_workers, inputs=self.kube_master, key='kubeadm join')
 
         logger.debug('Adding kubectl completion bash on master')
         cmd = '''echo 'source <(kubectl completion bash)' >> ~/.bashrc
                  kubectl completion bash >/etc/bash_completion.d/kubectl
                  source ~/.bashrc'''
-        execute_cmd(cmd, [self.kube_master])
+        ensure_cmd(cmd, [self.kube_master])
 
         logger.info('Deploying Kubernetes cluster successfully')
 
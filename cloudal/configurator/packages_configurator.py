@@ -1,6 +1,4 @@
-from time import sleep
-
-from cloudal.utils import get_logger, execute_cmd
+from cloudal.utils import get_logger, execute_cmd, execute_cmd_per_host, gather_facts
 
 logger = get_logger()
 
@@ -35,33 +33,123 @@ OS_NAMES = {
     "midnightbsd": "MidnightBSD",
 }
 
-MAX_RETRIES = 10
+# the (host, boot id) whose package index has been refreshed in this session,
+# the boot id changes when the OS of a host is deployed again
+refreshed_hosts = set()
 
 
 class packages_configurator(object):
 
-    def install_packages_with_apt(self, packages, hosts):
+    def _get_missing_packages(self, packages, hosts, query_cmd, parse_line):
+        '''Query the installed packages on all hosts with one call and return the missing packages of each host
+
+        Returns
+        -------
+        dict
+            key: str, the host name
+            value: list of str, the requested packages that are not installed on this host
+        '''
+        _, r = execute_cmd(query_cmd, hosts, is_continue=True)
+        missing_packages = dict()
+        installed = {host: dict() for host in hosts}
+        for host, host_result in (r.report.items() if r else list()):
+            for line in host_result.stdout.splitlines():
+                name_version = parse_line(line)
+                if name_version:
+                    installed[host][name_version[0]] = name_version[1]
+        for host in hosts:
+            missing = list()
+            for package in packages:
+                name, _, version = package.partition('=')
+                if name not in installed[host] or (version and installed[host][name] != version):
+                    missing.append(package)
+            missing_packages[host] = missing
+        return missing_packages
+
+    def _install_missing_packages(self, packages, hosts, query_cmd, parse_line, refresh_cmd, install_cmd,
+                                  refresh=False):
+        '''Install the packages that are missing on the hosts, with one call for all hosts
+
+        The package index of a host is refreshed with `refresh_cmd` before its first install
+        of the session only, or again after the host is rebooted or deployed, or when `refresh` is True.
+        '''
+        missing_packages = self._get_missing_packages(packages, hosts, query_cmd, parse_line)
+        missing_hosts = [host for host, missing in missing_packages.items() if missing]
+        facts = gather_facts(missing_hosts) if missing_hosts else dict()
+        boot_ids = {host: facts.get(host, dict()).get('boot_id') for host in missing_hosts}
+        host_vars = dict()
+        for host in missing_hosts:
+            refreshed = not refresh and boot_ids[host] is not None and (host, boot_ids[host]) in refreshed_hosts
+            host_vars[host] = {'refresh': '' if refreshed else refresh_cmd + ' && ',
+                               'packages': ' '.join(missing_packages[host])}
+        n_installed = len(hosts) - len(host_vars)
+        if n_installed:
+            logger.debug('Packages %s are already installed on %s/%s hosts' % (', '.join(packages),
+                                                                               n_installed, len(hosts)))
+        if not host_vars:
+            return
+        logger.debug("Installing packages: %s on %s hosts" % (', '.join(packages), len(host_vars)))
+        _, r = execute_cmd_per_host('%(refresh)s' + install_cmd + ' %(packages)s', host_vars)
+        if r:
+            for host, host_result in r.report.items():
+                if host_vars[host]['refresh'] and host_result.ok:
+                    refreshed_hosts.add((host, boot_ids[host]))
+                elif not host_result.ok:
+                    logger.error('Cannot install packages %s on host %s:\n%s' % (host_vars[host]['packages'],
+                                                                                host, host_result.stderr.strip()))
+
+    def install_packages_with_apt(self, packages, hosts, refresh=False):
         '''Install a list of given packages
 
         Parameters
         ----------
         packages: list of string
-            the list of package names to be installed
+            the list of package names to be installed, a version can be given as `name=version`
 
         hosts: list of string
             the list of hostnames
 
+        refresh: bool
+            if True, refresh the package index even if it is already refreshed in this session,
+            e.g. after adding a new package repository
+
         '''
-        logger.debug("Installing packages: %s on %s hosts" % (', '.join(packages), len(hosts)))
-        cmd = ("export DEBIAN_FRONTEND=noninteractive && "
-               "apt-get update && "
-               "apt-get install -q -y --allow-change-held-packages %s") % ' '.join(packages)
+        # dpkg-query fails when a package is not installed, only its output is used
+        query_cmd = "dpkg-query -W -f='${Package} ${Version} ${db:Status-Status}\\n' %s 2>/dev/null; true" % (
+            ' '.join([package.split('=')[0] for package in packages]))
+
+        def parse_line(line):
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == 'installed':
+                return fields[0], fields[1]
+
+        try:
+            self._install_missing_packages(packages, hosts, query_cmd, parse_line,
+                                           refresh_cmd='export DEBIAN_FRONTEND=noninteractive && apt-get update',
+                                           install_cmd=('export DEBIAN_FRONTEND=noninteractive && '
+                                                        'apt-get install -q -y --allow-change-held-packages'),
+                                           refresh=refresh)
+        except Exception as e:
+            logger.error("---> Bug [%s] when installing: %s" % (e, packages), exc_info=True)
+
+    def _install_packages_with_rpm(self, packages, hosts, package_manager, refresh=False):
+        query_cmd = "rpm -q --qf '%%{NAME} %%{VERSION}-%%{RELEASE}\\n' %s 2>/dev/null; true" % (
+            ' '.join([package.split('=')[0] for package in packages]))
+
+        def parse_line(line):
+            fields = line.split()
+            if len(fields) == 2:
+                return fields[0], fields[1]
+
         try:
-            execute_cmd(cmd, hosts)
+            self._install_missing_packages(packages, hosts, query_cmd, parse_line,
+                                           refresh_cmd='%s makecache -q' % package_manager,
+                                           install_cmd='%s install -y -q' % package_manager,
+                                           refresh=refresh)
         except Exception as e:
-            logger.error("---> Bug [%s] with command: %s" % (e, cmd), exc_info=True)
+            logger.error("---> Bug [%s] when installing: %s" % (e, packages), exc_info=True)
 
-    def install_packages_with_yum(self, packages, hosts):
+    def install_packages_with_yum(self, packages, hosts, refresh=False):
         '''Install a list of given packages
 
         Parameters
@@ -72,16 +160,13 @@ class packages_configurator(object):
         hosts: list of string
             the list of hostnames
 
+        refresh: bool
+            if True, refresh the package index even if it is already refreshed in this session
+
         '''
-        logger.debug("Installing packages: %s on %s hosts" % (', '.join(packages), len(hosts)))
-        cmd = ("yum update -y -q && "
-               "yum install -y -q %s") % ' '.join(packages)
-        try:
-            execute_cmd(cmd, hosts)
-        except Exception as e:
-            logger.error("---> Bug [%s] with command: %s" % (e, cmd), exc_info=True)
+        self._install_packages_with_rpm(packages, hosts, 'yum', refresh)
 
-    def install_packages_with_dnf(self, packages, hosts):
+    def install_packages_with_dnf(self, packages, hosts, refresh=False):
         '''Install a list of given packages
 
         Parameters
@@ -92,14 +177,43 @@ class packages_configurator(object):
         hosts: list of string
             the list of hostnames
 
+        refresh: bool
+            if True, refresh the package index even if it is already refreshed in this session
+
         '''
-        logger.debug("Installing packages: %s on %s hosts" % (', '.join(packages), len(hosts)))
-        cmd = ("dnf update -y -q && "
-               "dnf install -y -q %s") % ' '.join(packages)
-        try:
-            execute_cmd(cmd, hosts)
-        except Exception as e:
-            logger.error("---> Bug [%s] with command: %s" % (e, cmd), exc_info=True)
+        self._install_packages_with_rpm(packages, hosts, 'dnf', refresh)
+
+    def _parse_os_name(self, os_info):
+        for os_name, os_full_name in OS_NAMES.items():
+            if os_name in os_info:
+                return os_name, os_full_name
+        return None, None
+
+    def _get_os_names(self, hosts):
+        '''Get the OS names of a list of hosts from their facts
+
+        Parameters
+        ----------
+        hosts: list of string
+            the list of hostnames
+
+        Returns
+        -------
+        dict
+            key: str, the host name
+            value: tuple of (os_name, os_full_name), (None, None) if no OS name found
+        '''
+        os_names = dict()
+        facts = gather_facts(hosts)
+        for host in hosts:
+            if host not in facts:
+                os_names[host] = (None, None)
+            elif facts[host]['os'] in OS_NAMES:
+                os_names[host] = (facts[host]['os'], OS_NAMES[facts[host]['os']])
+            else:
+                os_names[host] = self._parse_os_name(facts[host]['os_full_name'].lower())
+            logger.debug('OS of %s: %s' % (host, os_names[host][1]))
+        return os_names
 
     def _get_os_name(self, host):
         '''Get the OS name of a host
@@ -117,22 +231,9 @@ class packages_configurator(object):
             full name of an OS
 
         '''
-        os_name = None
-        for attempt in range(MAX_RETRIES):
-            cmd = 'hostnamectl | grep "Operating System"'
-            _, r = execute_cmd(cmd, host)
-            os_info = r.processes[0].stdout.strip().lower()
-            if os_info:
-                for os_name, os_full_name in OS_NAMES.items():
-                    if os_name in os_info:
-                        logger.debug('OS of %s: %s' % (host, os_full_name))
-                        return os_name, os_full_name
-                return None, None
-            logger.info('---> Retrying: "%s" on host %s ' % (cmd, host))
-            sleep(10)
-        return None, None
+        return self._get_os_names([host])[host]
 
-    def install_packages(self, packages, hosts):
+    def install_packages(self, packages, hosts, refresh=False):
         '''Install a list of given packages
 
         Parameters
@@ -143,12 +244,15 @@ class packages_configurator(object):
         hosts: list of string
             the list of hostnames
 
+        refresh: bool
+            if True, refresh the package index even if it is already refreshed in this session,
+            e.g. after adding a new package repository
+
         '''
         list_os_hosts = dict()
         logger.info("Installing packages: %s" % ', '.join(packages))
 
-        for host in hosts:
-            os_name, os_full_name = self._get_os_name(host)
+        for host, (os_name, os_full_name) in self._get_os_names(hosts).items():
             if os_name:
                 list_os_hosts[os_name] = list_os_hosts.get(os_name, list()) + [host]
             else:
@@ -156,10 +260,10 @@ class packages_configurator(object):
 
         for os_name, list_hosts in list_os_hosts.items():
             if os_name in ['debian', 'ubuntu']:
-                self.install_packages_with_apt(packages, list_hosts)
+                self.install_packages_with_apt(packages, list_hosts, refresh)
             elif os_name in ['centos']:
-                self.install_packages_with_yum(packages, list_hosts)
+                self.install_packages_with_yum(packages, list_hosts, refresh)
             elif os_name in ['fedora']:
-                self.install_packages_with_dnf(packages, list_hosts)
+                self.install_packages_with_dnf(packages, list_hosts, refresh)
             else:
                 logger.info('Not support to install packages on OS %s yet' % os_name)
@@ -0,0 +1,56 @@
+"""Run a command on the hosts of a site and print the results as JSON
+
+This module is shipped to a relay host of each site (e.g. a Grid'5000 frontend)
+by `cloudal.utils.RelayActionFactory` and run there with `python3`,
+so it only uses the python standard library.
+
+The request is read as JSON from stdin:
+    {"cmd": "hostname", "hosts": ["node-1", "node-2"], "ssh_cmd": ["ssh", "-l", "root"], "max_workers": 50}
+"""
+import sys
+import json
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_on_host(ssh_cmd, host, cmd):
+    """Run a command on one host and return its exit code, output and timing"""
+    start_date = time.time()
+    try:
+        p = subprocess.run(ssh_cmd + [host, cmd], stdin=subprocess.DEVNULL,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        return {'host': host, 'exit_code': None, 'stdout': '', 'stderr': str(e),
+                'start_date': start_date, 'end_date': time.time()}
+    return {'host': host,
+            'exit_code': p.returncode,
+            'stdout': p.stdout.decode(errors='replace'),
+            'stderr': p.stderr.decode(errors='replace'),
+            'start_date': start_date,
+            'end_date': time.time()}
+
+
+def dispatch(request):
+    """Run the command of a request on all its hosts concurrently
+
+    Returns
+    -------
+    list of dict
+        the result of each host, in the order of the hosts of the request
+    """
+    hosts = request['hosts']
+    if not hosts:
+        return list()
+    with ThreadPoolExecutor(max_workers=min(request.get('max_workers', 50), len(hosts))) as pool:
+        return list(pool.map(lambda host: run_on_host(request['ssh_cmd'], host, request['cmd']), hosts))
+
+
+def main():
+    request = json.load(sys.stdin)
+    # the results are printed on one line, after the messages of the login shell if any
+    sys.stdout.write('\n' + json.dumps(dispatch(request)) + '\n')
+
+
+if __name__ == '__main__':
+    main()
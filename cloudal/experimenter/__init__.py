@@ -7,6 +7,7 @@ from .experimenter import (
     create_paramsweeper,
     define_parameters,
     create_combs_queue,
+    collect_results,
     get_results)
 
 from .g5k_experimenter import (
@@ -1,7 +1,11 @@
 import os
 import re
+import shutil
+import tarfile
+import tempfile
 
-from cloudal.utils import get_logger, getput_file
+from cloudal.utils import (get_logger, getput_file, execute_cmd, get_remote_executor,
+                           run_chunks, build_report)
 
 from execo_engine import utils, sweep, ParamSweeper
 
@@ -142,7 +146,85 @@ def create_combination_dir(comb, result_dir):
     return comb_dir
 
 
-def get_results(comb, hosts, remote_result_files, local_result_dir):
+REMOTE_RESULT_ARCHIVE = '/tmp/cloudal_results.tar'
+
+
+def _extract_archive(archive_path, dest_dir):
+    with tarfile.open(archive_path) as tar:
+        for member in tar.getmembers():
+            if os.path.isabs(member.name) or '..' in member.name.split('/'):
+                raise ValueError('Unsafe path in the result archive: %s' % member.name)
+        tar.extractall(dest_dir)
+
+
+def collect_results(hosts, remote_result_files, comb_dir):
+    """Get the result files from remote hosts as one compressed archive per host
+
+    The result files of each host are packed in one tar.gz archive on the host, the archives
+    are downloaded from all hosts concurrently and then unpacked into the combination directory.
+
+    Parameters
+    ----------
+    hosts: list
+        a list of hosts to get the results from
+
+    remote_result_files: list
+        a list of results files on the remote nodes, shell glob patterns are allowed
+
+    comb_dir: str
+        the path to the directory to store the results on the local node
+
+    Returns
+    -------
+    dict
+        key: str, the host
+        value: dict, the size of the archive of this host in bytes and the seconds to pack and download it
+    """
+    if isinstance(hosts, str):
+        hosts = [hosts]
+    logger.debug('Packing the result files on %s hosts' % len(hosts))
+    cmd = ('rm -f {archive} {archive}.gz; '
+           'for f in {files}; do '
+           '[ -e "$f" ] && tar -rf {archive} -C "$(dirname "$f")" "$(basename "$f")"; '
+           'done; '
+           '[ -f {archive} ] && gzip -f {archive}; true').format(archive=REMOTE_RESULT_ARCHIVE,
+                                                              files=' '.join(remote_result_files))
+    _, r = execute_cmd(cmd, hosts)
+    pack_report = r.report
+
+    archive_dir = tempfile.mkdtemp(prefix='cloudal_results_')
+    remote_executor = get_remote_executor()
+    try:
+        for host in hosts:
+            os.mkdir(os.path.join(archive_dir, host))
+        actions = run_chunks(lambda chunk: remote_executor.get_fileget(chunk,
+                                                                       [REMOTE_RESULT_ARCHIVE + '.gz'],
+                                                                       os.path.join(archive_dir, chunk[0])),
+                             hosts, 1)
+        download_report = build_report([p for action in actions for p in action.processes])
+
+        stats = dict()
+        for host in hosts:
+            archive_path = os.path.join(archive_dir, host, os.path.basename(REMOTE_RESULT_ARCHIVE) + '.gz')
+            seconds = 0
+            for report in (pack_report, download_report):
+                if host in report and report[host].duration is not None:
+                    seconds += report[host].duration
+            if not os.path.exists(archive_path):
+                logger.warning('No result file is downloaded from host %s' % host)
+                stats[host] = {'bytes': 0, 'seconds': seconds}
+                continue
+            stats[host] = {'bytes': os.path.getsize(archive_path), 'seconds': seconds}
+            _extract_archive(archive_path, comb_dir)
+    finally:
+        shutil.rmtree(archive_dir, ignore_errors=True)
+
+    for host, host_stats in sorted(stats.items(), key=lambda item: item[1]['seconds'], reverse=True):
+        logger.debug('Results of %s: %s bytes in %.2f seconds' % (host, host_stats['bytes'], host_stats['seconds']))
+    return stats
+
+
+def get_results(comb, hosts, remote_result_files, local_result_dir, compress=False):
     """Get all the results files from remote hosts to a local result directory
 
     Parameters
@@ -161,10 +243,17 @@ def get_results(comb, hosts, remote_result_files, local_result_dir):
     local_result_dir: str
         the path to the directory to store the results on the local node
 
+    compress: bool
+        if True, download one compressed archive per host concurrently (see `collect_results`),
+        it is much faster than copying many small files one by one
+
     """
     logger.info('Create combination dir locally')
     comb_dir = create_combination_dir(comb, local_result_dir)
     logger.info('Download the result')
+    if compress:
+        collect_results(hosts, remote_result_files, comb_dir)
+        return comb_dir
     getput_file(hosts=hosts,
                 file_paths=remote_result_files,
                 dest_location=comb_dir,
@@ -3,9 +3,11 @@ import time
 import datetime
 
 from cloudal.provisioner.provisioning import cloud_provisioning
-from cloudal.utils import get_remote_executor, get_logger, parse_config_file
+from cloudal.utils import (get_remote_executor, get_logger, parse_config_file, get_fact_cache, HYBRID,
+                          RelayActionFactory)
 
 from execo import format_date, Host
+from execo.config import TAKTUK
 # from execo.config import default_connection_params
 from execo.time_utils import timedelta_to_seconds, get_unixts
 from execo_g5k import (
@@ -16,6 +18,7 @@ from execo_g5k.planning import get_planning, compute_slots, get_jobs_specs
 from execo_g5k.utils import hosts_list
 from execo_g5k.api_utils import canonical_host_name
 from execo_g5k.oar import get_oar_job_info, oardel
+from execo_g5k.config import default_frontend_connection_params
 
 
 logger = get_logger()
@@ -230,6 +233,16 @@ class g5k_provisioner(cloud_provisioning):
 
         for site, resource in self.resources.items():
             self.hosts += resource['hosts']
+        # the facts of the hosts are kept on disk for the following runs on the same reservation
+        get_fact_cache().cache_key = 'g5k:%s' % ','.join('%s:%s' % (site, oar_job_id)
+                                                          for oar_job_id, site in sorted(self.oar_result))
+
+        remote_executor = get_remote_executor()
+        if isinstance(remote_executor, RelayActionFactory):
+            # the frontend of each site runs the commands on the reserved nodes of its site
+            for site, resource in self.resources.items():
+                remote_executor.add_relay(site, resource['hosts'],
+                                          connection_params=default_frontend_connection_params)
 
     def _launch_kadeploy(self, max_tries=10, check_deploy=True):
         """Create an execo_g5k.Deployment object, launch the deployment and
@@ -273,6 +286,8 @@ class g5k_provisioner(cloud_provisioning):
                                                   check_deployed_command=check_deploy)
         deployed_hosts = list(deployed_hosts)
         undeployed_hosts = list(undeployed_hosts)
+        # a new OS is deployed on the hosts, their cached facts are outdated
+        get_fact_cache().invalidate([host.address for host in deployed_hosts + undeployed_hosts])
         # # Renaming hosts if a kavlan is used
         # if self.kavlan:
         #     for i, host in enumerate(deployed_hosts):
@@ -287,7 +302,7 @@ class g5k_provisioner(cloud_provisioning):
 
     def _configure_ssh(self):
         self.remote_executor = get_remote_executor()
-        if self.remote_executor.remote_tool == 2:
+        if self.remote_executor.remote_tool in (TAKTUK, HYBRID):
             # Configuring SSH with precopy of id_rsa and id_rsa.pub keys on all
             # host to allow TakTuk connection
             taktuk_conf = ('-s', '-S',
@@ -1,10 +1,27 @@
 import os
+import re
+import json
+import time
+import socket
+import base64
+import hashlib
+import inspect
 import yaml
+import atexit
+import shutil
 import logging
+import tempfile
+import threading
 import tenacity
 from tenacity import retry
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
-from execo.action import ActionFactory
+from cloudal import agent, dispatcher
+
+from execo.action import ActionFactory, ChainPut, Remote, TaktukRemote
+from execo.host import Host
+from execo.process import Process, ProcessOutputHandler, STDOUT, STDERR
 from execo.config import TAKTUK, SSH, SCP, default_connection_params
 
 
@@ -68,16 +85,527 @@ def parse_config_file(config_file_path):
                 return content
 
 
+class SshConnectionPool(object):
+    """Keep multiplexed SSH master connections to the remote hosts
+
+    When the pool is enabled, every ssh/scp connection made by execo goes through
+    one master connection per host (OpenSSH ControlMaster), so the key exchange and
+    the authentication happen only once per host for the whole engine lifetime.
+    The control sockets are kept in a directory managed by cloudal, a master connection
+    exits after `idle_timeout` seconds without any use.
+    """
+
+    def __init__(self, socket_dir=None, idle_timeout=600):
+        if socket_dir is None:
+            # unix socket paths are limited to ~100 characters, keep the directory short
+            socket_dir = tempfile.mkdtemp(prefix='cloudal-ssh-', dir='/tmp')
+        elif not os.path.exists(socket_dir):
+            os.makedirs(socket_dir)
+        os.chmod(socket_dir, 0o700)
+        self.socket_dir = socket_dir
+        self.idle_timeout = idle_timeout
+        self.last_used = dict()
+        self.enabled = False
+        self._origin_options = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def control_options(self):
+        return ('-o', 'ControlMaster=auto',
+                '-o', 'ControlPath=%s' % os.path.join(self.socket_dir, '%C'),
+                '-o', 'ControlPersist=%s' % self.idle_timeout)
+
+    def enable(self):
+        """Make all ssh and scp connections go through the master connections"""
+        if self.enabled:
+            return
+        for key in ['ssh_options', 'scp_options']:
+            self._origin_options[key] = default_connection_params[key]
+            default_connection_params[key] = tuple(default_connection_params[key]) + self.control_options
+        self.enabled = True
+        logger.debug('SSH connection pool is enabled with sockets in %s' % self.socket_dir)
+
+    def disable(self):
+        """Close all the master connections and go back to one connection per command"""
+        if not self.enabled:
+            return
+        self.close_connections(list(self.last_used))
+        for key, options in self._origin_options.items():
+            default_connection_params[key] = options
+        self.enabled = False
+
+    def touch(self, hosts):
+        """Record that the given hosts are being used"""
+        now = time.time()
+        with self._lock:
+            for host in hosts:
+                self.last_used[_host_address(host)] = now
+
+    def _control_cmd(self, operation, host):
+        cmd = [default_connection_params['ssh'], '-O', operation,
+               '-o', 'ControlPath=%s' % os.path.join(self.socket_dir, '%C')]
+        if default_connection_params.get('user'):
+            cmd += ['-l', default_connection_params['user']]
+        if default_connection_params.get('port'):
+            cmd += ['-p', str(default_connection_params['port'])]
+        return Process(cmd + [host], shell=False, ignore_exit_code=True, nolog_exit_code=True)
+
+    def health_check(self, hosts=None):
+        """Check if the master connections to the given hosts are alive
+
+        Parameters
+        ----------
+        hosts: list of str
+            the hosts to check, all the hosts in the pool by default
+
+        Returns
+        -------
+        dict
+            key: str, the host
+            value: bool, True if the master connection to the host is alive
+        """
+        if hosts is None:
+            hosts = list(self.last_used)
+        processes = [self._control_cmd('check', _host_address(host)) for host in hosts]
+        for process in processes:
+            process.start()
+        status = dict()
+        for host, process in zip(hosts, processes):
+            process.wait()
+            status[_host_address(host)] = process.exit_code == 0
+        with self._lock:
+            for host, is_alive in status.items():
+                if not is_alive:
+                    self.last_used.pop(host, None)
+        return status
+
+    def close_connections(self, hosts):
+        """Close the master connections to the given hosts"""
+        processes = [self._control_cmd('exit', _host_address(host)) for host in hosts]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.wait()
+        with self._lock:
+            for host in hosts:
+                self.last_used.pop(_host_address(host), None)
+
+    def evict_idle(self):
+        """Close the master connections that are not used for more than `idle_timeout` seconds
+
+        Returns
+        -------
+        list of str
+            the evicted hosts
+        """
+        now = time.time()
+        with self._lock:
+            idle_hosts = [host for host, last_used in self.last_used.items()
+                          if now - last_used > self.idle_timeout]
+        if idle_hosts:
+            logger.debug('Closing idle SSH master connections to %s hosts' % len(idle_hosts))
+            self.close_connections(idle_hosts)
+        return idle_hosts
+
+    def close(self):
+        """Close all the master connections and remove the socket directory"""
+        self.disable()
+        shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+
+connection_pool_singleton = list()
+
+
+def get_connection_pool(socket_dir=None, idle_timeout=600):
+    '''Get the SSH connection pool, the pool is created on the first call
+
+    Parameters
+    ----------
+    socket_dir: str
+        the directory to store the control sockets, a temporary directory by default
+
+    idle_timeout: int
+        the number of seconds before closing an unused master connection
+
+    Returns
+    -------
+    SshConnectionPool
+        the connection pool shared by all remote executions
+    '''
+    global connection_pool_singleton
+    if len(connection_pool_singleton) > 0:
+        return connection_pool_singleton[0]
+    pool = SshConnectionPool(socket_dir=socket_dir, idle_timeout=idle_timeout)
+    connection_pool_singleton.append(pool)
+    atexit.register(pool.close)
+    return pool
+
+
+# the remote executor that chooses between ssh and TakTuk for each command
+HYBRID = 'hybrid'
+# the number of hosts above which the hybrid executor uses TakTuk
+TAKTUK_THRESHOLD = 20
+
+
+class HybridActionFactory(ActionFactory):
+    """An `ActionFactory` that runs a command with TakTuk when it targets many hosts and with ssh otherwise
+
+    TakTuk propagates itself as a tree through the hosts, so a command on hundreds of hosts
+    needs only a few connections from the local machine, while ssh has a lower startup cost
+    for a few hosts. The strategy and the fan-out time of each call are recorded in `stats`
+    to tune `taktuk_threshold`.
+    """
+
+    def __init__(self, taktuk_threshold=TAKTUK_THRESHOLD, fileput_tool=SCP, fileget_tool=SCP):
+        ActionFactory.__init__(self, remote_tool=HYBRID, fileput_tool=fileput_tool, fileget_tool=fileget_tool)
+        self.taktuk_threshold = taktuk_threshold
+        self.stats = deque(maxlen=1000)
+        self._lock = threading.Lock()
+
+    def get_strategy(self, hosts):
+        if isinstance(hosts, str) or len(hosts) <= self.taktuk_threshold:
+            return SSH
+        return TAKTUK
+
+    def get_remote(self, cmd, hosts, *args, **kwargs):
+        if self.get_strategy(hosts) == TAKTUK:
+            return TaktukRemote(cmd, hosts, *args, **kwargs)
+        return Remote(cmd, hosts, *args, **kwargs)
+
+    def record(self, strategy, n_hosts, seconds):
+        """Record the fan-out time of a call"""
+        with self._lock:
+            self.stats.append({'strategy': 'taktuk' if strategy == TAKTUK else 'ssh',
+                               'n_hosts': n_hosts,
+                               'seconds': seconds})
+        logger.debug('Fan-out with %s to %s hosts in %.2f seconds' % (self.stats[-1]['strategy'], n_hosts, seconds))
+
+    def summary(self):
+        """Return the average seconds per call of each strategy and number of hosts
+
+        Returns
+        -------
+        dict
+            key: tuple of (strategy, n_hosts)
+            value: float, the average fan-out time in seconds
+        """
+        with self._lock:
+            stats = list(self.stats)
+        durations = dict()
+        for record in stats:
+            durations.setdefault((record['strategy'], record['n_hosts']), list()).append(record['seconds'])
+        return {key: sum(values) / len(values) for key, values in durations.items()}
+
+
+# the remote executor that sends the command of each site once to a relay host of the site
+RELAY = 'relay'
+
+
+class HostProcess(object):
+    """The result of a command run on a host by a relay or an agent,
+    with the attributes of the execo processes used by cloudal"""
+
+    def __init__(self, host, exit_code=None, stdout='', stderr='', start_date=None, end_date=None,
+                 error_reason=None):
+        self.host = Host(host)
+        self.exit_code = exit_code
+        self.stdout = stdout
+        self.stderr = stderr
+        self.start_date = start_date
+        self.end_date = end_date
+        self.error_reason = error_reason
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+
+class RelayActionFactory(ActionFactory):
+    """An `ActionFactory` that sends a command once to a relay host of each site
+
+    The relay (e.g. the frontend of a Grid'5000 site) runs `cloudal.dispatcher` with python3,
+    which runs the command on the hosts of the site from their local network and returns
+    all the results at once, so the number of connections from the local machine is the
+    number of sites. The hosts without a relay, or whose relay cannot be used,
+    are contacted directly with ssh.
+    """
+
+    def __init__(self, fileput_tool=SCP, fileget_tool=SCP, max_workers=50, ssh_cmd=None):
+        """
+        Parameters
+        ----------
+        max_workers: int
+            the maximum number of hosts contacted at once by a relay
+
+        ssh_cmd: list of str
+            the command used by the relays to run a command on a host, the host and the command
+            are appended to it; by default ssh with the user of `default_connection_params`
+        """
+        ActionFactory.__init__(self, remote_tool=SSH, fileput_tool=fileput_tool, fileget_tool=fileget_tool)
+        self.max_workers = max_workers
+        self.ssh_cmd = ssh_cmd
+        # relay -> the connection params to the relay
+        self.relays = dict()
+        # host -> its relay
+        self.host_relays = dict()
+
+    def add_relay(self, relay, hosts, connection_params=None):
+        """Use a relay host to run the commands on the given hosts"""
+        self.relays[relay] = connection_params
+        for host in hosts:
+            self.host_relays[_host_address(host)] = relay
+
+    def group_hosts(self, hosts):
+        """Split the hosts by relay
+
+        Returns
+        -------
+        relay_hosts: dict
+            key: str, the relay
+            value: list of str, the hosts of this relay
+
+        direct_hosts: list of str
+            the hosts without a relay
+        """
+        relay_hosts = dict()
+        direct_hosts = list()
+        for host in hosts:
+            relay = self.host_relays.get(_host_address(host))
+            if relay is None:
+                direct_hosts.append(host)
+            else:
+                relay_hosts.setdefault(relay, list()).append(_host_address(host))
+        return relay_hosts, direct_hosts
+
+    def get_ssh_cmd(self):
+        if self.ssh_cmd is not None:
+            return list(self.ssh_cmd)
+        ssh_cmd = ['ssh', '-o', 'BatchMode=yes', '-o', 'StrictHostKeyChecking=no', '-o', 'ConnectTimeout=20']
+        if default_connection_params.get('user'):
+            ssh_cmd += ['-l', default_connection_params['user']]
+        return ssh_cmd
+
+    def get_dispatch_cmd(self, cmd, hosts):
+        """Return the command that runs the dispatcher on a relay for the given command and hosts"""
+        request = json.dumps({'cmd': cmd,
+                              'hosts': hosts,
+                              'ssh_cmd': self.get_ssh_cmd(),
+                              'max_workers': self.max_workers})
+        return 'echo %s | base64 -d | python3 -c "$(echo %s | base64 -d)"' % (
+            base64.b64encode(request.encode()).decode(),
+            base64.b64encode(inspect.getsource(dispatcher).encode()).decode())
+
+    def get_relay_remote(self, cmd, relay, hosts):
+        return Remote(self.get_dispatch_cmd(cmd, hosts), [relay], connection_params=self.relays.get(relay))
+
+    def parse_results(self, process):
+        """Return the processes of the hosts from the output of a relay, None if the relay failed"""
+        lines = process.stdout.strip().splitlines()
+        if not process.ok or not lines:
+            return None
+        try:
+            results = json.loads(lines[-1])
+        except ValueError:
+            return None
+        return [HostProcess(**result) for result in results]
+
+
+# the remote executor that runs the commands through a persistent agent on each host, see `cloudal.agent`
+AGENT = 'agent'
+# the number of seconds to wait for a new agent to answer
+AGENT_START_TIMEOUT = 60
+# the number of seconds to wait for the result of a command run by the agents
+AGENT_CMD_TIMEOUT = 3600
+
+
+class AgentAction(object):
+    """The processes of a command run by the agents, with the attributes of the execo actions used by cloudal"""
+
+    def __init__(self, processes):
+        self.processes = processes
+
+    @property
+    def ok(self):
+        return all(process.ok for process in self.processes)
+
+
+class AgentActionFactory(ActionFactory):
+    """An `ActionFactory` that runs the commands and the file copies through an agent on each host
+
+    The agent (`cloudal.agent`) is started on a host at the first use, through one ssh session
+    that is then kept open and shared by all the following commands and file copies,
+    so a command costs a round trip on an open channel instead of a new ssh connection.
+    """
+
+    def __init__(self, fileput_tool=SCP, fileget_tool=SCP, connect_cmd=None, cmd_timeout=AGENT_CMD_TIMEOUT):
+        """
+        Parameters
+        ----------
+        connect_cmd: function
+            a function that takes a host and returns the command that starts the agent of this host,
+            by default ssh to the host with `default_connection_params` and run the agent with python3
+
+        cmd_timeout: int
+            the number of seconds to wait for the result of a command on a host,
+            the hosts that do not answer in time are reported as host errors
+        """
+        ActionFactory.__init__(self, remote_tool=SSH, fileput_tool=fileput_tool, fileget_tool=fileget_tool)
+        self.connect_cmd = connect_cmd
+        self.cmd_timeout = cmd_timeout
+        self.agents = dict()
+        self._lock = threading.Lock()
+
+    def get_connect_cmd(self, host):
+        if self.connect_cmd is not None:
+            return self.connect_cmd(host)
+        ssh_cmd = ['ssh', '-o', 'BatchMode=yes', '-o', 'StrictHostKeyChecking=no', '-o', 'ConnectTimeout=20']
+        if default_connection_params.get('user'):
+            ssh_cmd += ['-l', default_connection_params['user']]
+        if default_connection_params.get('port'):
+            ssh_cmd += ['-p', str(default_connection_params['port'])]
+        if default_connection_params.get('keyfile'):
+            ssh_cmd += ['-i', default_connection_params['keyfile']]
+        source = base64.b64encode(inspect.getsource(agent).encode()).decode()
+        return ssh_cmd + [host, 'python3 -u -c "$(echo %s | base64 -d)"' % source]
+
+    def _start_agent(self, host):
+        """Start the agent of a host and wait until it answers, with a slot of the connection budget"""
+        budget = get_connection_budget()
+        n_connections = budget.acquire(1)
+        try:
+            logger.debug('Starting the agent on host %s' % host)
+            connection = agent.AgentConnection(self.get_connect_cmd(host))
+            try:
+                connection.request('ping').result(AGENT_START_TIMEOUT)
+            except FutureTimeoutError:
+                # the requests to this agent fail as a connection error
+                connection.close()
+            except agent.AgentError:
+                pass
+        finally:
+            budget.release(n_connections)
+        return connection
+
+    def get_agents(self, hosts):
+        """Return the connections to the agents of the hosts, the agents that are not running are (re)started
+
+        The ssh sessions of the agents are opened concurrently, at most the size of the connection budget at once.
+
+        Returns
+        -------
+        dict
+            host address -> its `cloudal.agent.AgentConnection`
+        """
+        addresses = [_host_address(host) for host in hosts]
+        with self._lock:
+            connections = {host: self.agents[host] for host in addresses
+                           if host in self.agents and self.agents[host].alive}
+        to_start = [host for host in set(addresses) if host not in connections]
+        if to_start:
+            with ThreadPoolExecutor(max_workers=min(len(to_start),
+                                                    get_connection_budget().max_connections)) as pool:
+                started = dict(zip(to_start, pool.map(self._start_agent, to_start)))
+            with self._lock:
+                self.agents.update(started)
+            connections.update(started)
+        return connections
+
+    def get_agent(self, host):
+        """Return the connection to the agent of a host, the agent is (re)started if it is not running"""
+        return self.get_agents([host])[_host_address(host)]
+
+    def run(self, cmd, hosts, timeout=None):
+        """Run a command on the hosts through their agents
+
+        Parameters
+        ----------
+        timeout: int
+            the number of seconds to wait for the result of the command, `cmd_timeout` if None
+
+        Returns
+        -------
+        AgentAction
+            the processes of all hosts, in the order of the hosts
+        """
+        if timeout is None:
+            timeout = self.cmd_timeout
+        agents = self.get_agents(hosts)
+        futures = [(_host_address(host), agents[_host_address(host)].request('run', cmd=cmd)) for host in hosts]
+        deadline = time.time() + timeout
+        processes = list()
+        for host, future in futures:
+            try:
+                response = future.result(max(0, deadline - time.time()))
+            except FutureTimeoutError:
+                processes.append(HostProcess(host, stderr='no result after %s seconds' % timeout,
+                                             error_reason='agent timed out'))
+                continue
+            except agent.AgentError as e:
+                processes.append(HostProcess(host, stderr=str(e), error_reason='agent connection failed'))
+                continue
+            if 'error' in response:
+                processes.append(HostProcess(host, stderr=response['error'], error_reason='agent error'))
+                continue
+            processes.append(HostProcess(host,
+                                         exit_code=response['exit_code'],
+                                         stdout=response['stdout'],
+                                         stderr=response['stderr'],
+                                         start_date=response['start_date'],
+                                         end_date=response['end_date']))
+        return AgentAction(processes)
+
+    def copy(self, hosts, file_paths, dest_location, action):
+        """Copy regular files between local and the hosts through their agents
+
+        Returns
+        -------
+        list of str
+            the hosts that the copy failed
+        """
+        agents = self.get_agents(hosts)
+
+        def _copy(host):
+            connection = agents[_host_address(host)]
+            for file_path in file_paths:
+                dest_path = os.path.join(dest_location, os.path.basename(file_path))
+                if action == 'put':
+                    connection.put(file_path, dest_path)
+                elif action == 'get':
+                    connection.get(file_path, dest_path)
+
+        failed_hosts = list()
+        with ThreadPoolExecutor(max_workers=get_connection_budget().max_connections) as pool:
+            futures = [(host, pool.submit(_copy, host)) for host in hosts]
+            for host, future in futures:
+                try:
+                    future.result()
+                except (agent.AgentError, OSError) as e:
+                    logger.debug('Cannot %s files on host %s with the agent: %s' % (action, _host_address(host), e))
+                    failed_hosts.append(_host_address(host))
+        return failed_hosts
+
+    def close(self):
+        with self._lock:
+            agents, self.agents = self.agents, dict()
+        for connection in agents.values():
+            connection.close()
+
+
 executor_singleton = list()
 
+# the asyncio remote executor, see `cloudal.async_utils`
+ASYNCSSH = 'asyncssh'
 
-def get_remote_executor(remote_tool=SSH, fileput_tool=SCP, fileget_tool=SCP):
+
+def get_remote_executor(remote_tool=SSH, fileput_tool=SCP, fileget_tool=SCP, connection_pool=False,
+                        taktuk_threshold=TAKTUK_THRESHOLD):
     '''Instantiate remote process execution and file copies tool
 
     Parameters
     ----------
     remote_tool: str
-        can be `execo.config.SSH` or `execo.config.TAKTUK`
+        can be `execo.config.SSH`, `execo.config.TAKTUK`, `cloudal.utils.HYBRID`, `cloudal.utils.RELAY`,
+        `cloudal.utils.AGENT` or `cloudal.utils.ASYNCSSH`
 
     fileput_tool: str
         can be `execo.config.SCP`, `execo.config.TAKTUK` or `execo.config.CHAINPUT`
@@ -85,15 +613,44 @@ def get_remote_executor(remote_tool=SSH, fileput_tool=SCP, fileget_tool=SCP):
     fileget_tool: str
         can be `execo.config.SCP` or `execo.config.TAKTUK`
 
+    connection_pool: bool
+        if True, keep persistent multiplexed SSH connections to the hosts (see `get_connection_pool`)
+
+    taktuk_threshold: int
+        only used with the `HYBRID` remote tool, commands on more hosts than this threshold use TakTuk
+
     Returns
     -------
     ActionFactory
         an object contains multiple remote process execution and file copies tools
         For more detail, see this: http://execo.gforge.inria.fr/doc/latest-stable/execo.html#actionfactory
+    AsyncRemoteExecutor
+        if remote_tool is `ASYNCSSH`, the asyncio executor used by `async_execute_cmd`,
+        `async_get_file` and `async_getput_file` in `cloudal.async_utils`
     '''
     global executor_singleton
+    if remote_tool == ASYNCSSH:
+        from cloudal.async_utils import get_async_executor
+        return get_async_executor()
+    if connection_pool:
+        get_connection_pool().enable()
     if len(executor_singleton) > 0:
         return executor_singleton[0]
+    elif remote_tool == AGENT:
+        executor = AgentActionFactory(fileput_tool=fileput_tool, fileget_tool=fileget_tool)
+        atexit.register(executor.close)
+        executor_singleton.append(executor)
+        return executor
+    elif remote_tool == RELAY:
+        executor = RelayActionFactory(fileput_tool=fileput_tool, fileget_tool=fileget_tool)
+        executor_singleton.append(executor)
+        return executor
+    elif remote_tool == HYBRID:
+        executor = HybridActionFactory(taktuk_threshold=taktuk_threshold,
+                                       fileput_tool=fileput_tool,
+                                       fileget_tool=fileget_tool)
+        executor_singleton.append(executor)
+        return executor
     else:
         executor = ActionFactory(remote_tool=remote_tool,
                                  fileput_tool=fileput_tool,
@@ -108,6 +665,304 @@ def chunk_list(input_list, n):
         yield input_list[i:i + n]
 
 
+# the maximum number of concurrent SSH connections opened by cloudal, shared by all callers.
+# G5k limits the number of concurrent ssh connections from a machine outside of Grid5000
+MAX_SSH_CONNECTIONS = 20
+
+
+class ConnectionBudget(object):
+    """A counting semaphore on the number of concurrent SSH connections
+
+    A chunk of N hosts takes N connections from the budget at once, so that
+    concurrent callers never hold a partial share of the budget while waiting.
+    """
+
+    def __init__(self, max_connections=MAX_SSH_CONNECTIONS):
+        self.max_connections = max(1, int(max_connections))
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, n_connections):
+        """Block until n_connections are available and take them
+
+        Returns
+        -------
+        int
+            the number of connections taken, to be given back to `release()`
+        """
+        with self._condition:
+            n_connections = max(1, min(n_connections, self.max_connections))
+            while self.in_use + n_connections > self.max_connections:
+                self._condition.wait()
+            self.in_use += n_connections
+            return n_connections
+
+    def release(self, n_connections):
+        with self._condition:
+            self.in_use = max(0, self.in_use - n_connections)
+            self._condition.notify_all()
+
+    def resize(self, max_connections):
+        with self._condition:
+            self.max_connections = max(1, int(max_connections))
+            self._condition.notify_all()
+
+
+connection_budget_singleton = list()
+
+
+def get_connection_budget(max_connections=MAX_SSH_CONNECTIONS):
+    '''Get the global budget of concurrent SSH connections
+
+    Parameters
+    ----------
+    max_connections: int
+        the maximum number of concurrent SSH connections, only used when the budget is created
+
+    Returns
+    -------
+    ConnectionBudget
+        the budget shared by all `execute_cmd` and `getput_file` calls
+    '''
+    global connection_budget_singleton
+    if len(connection_budget_singleton) > 0:
+        return connection_budget_singleton[0]
+    budget = ConnectionBudget(max_connections)
+    connection_budget_singleton.append(budget)
+    return budget
+
+
+def set_max_connections(max_connections):
+    """Change the global limit of concurrent SSH connections"""
+    get_connection_budget(max_connections).resize(max_connections)
+
+
+BATCH_SIZE_STATE_FILE = os.path.join(os.path.expanduser('~'), '.cloudal', 'batch_size.json')
+
+
+def get_network_origin():
+    """Identify the network that the commands are sent from, e.g. a G5k frontend or a laptop on VPN"""
+    local_ip = '127.0.0.1'
+    try:
+        # no packet is sent, this only selects the interface of the default route
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(('10.255.255.255', 1))
+        local_ip = s.getsockname()[0]
+        s.close()
+    except Exception:
+        pass
+    return '%s/%s' % (socket.getfqdn(), local_ip)
+
+
+class BatchSizeController(object):
+    """Adjust the batch size of the SSH fan-out with additive-increase/multiplicative-decrease
+
+    The batch size grows by `increase` after each chunk that connects successfully to all its hosts
+    while the chunk latency stays within `latency_tolerance` times the latency of the first chunk
+    of the same call. It is multiplied by `decrease` when a chunk gets an `exchange_identification`
+    or timeout error. The learned batch size is saved per network origin between runs.
+    """
+
+    def __init__(self, initial_size=5, min_size=1, max_size=MAX_SSH_CONNECTIONS, increase=1, decrease=0.5,
+                 latency_tolerance=1.5, state_file=BATCH_SIZE_STATE_FILE, origin=None):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.state_file = state_file
+        self.origin = origin or get_network_origin()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._saved_size = self._load()
+        self.batch_size = self._saved_size or initial_size
+
+    def _load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return None
+        try:
+            with open(self.state_file) as f:
+                batch_size = json.load(f).get(self.origin)
+        except (IOError, ValueError) as e:
+            logger.debug('Cannot load the batch size from %s: %s' % (self.state_file, e))
+            return None
+        if batch_size:
+            logger.debug('Use the learned batch size %s for %s' % (batch_size, self.origin))
+            return max(self.min_size, min(int(batch_size), self.max_size))
+
+    def save(self):
+        """Save the batch size of the network origin if it changed since the last save
+
+        `run_chunks` saves the batch size after each call, from several threads at once,
+        so the state file is replaced atomically under a lock.
+        """
+        if not self.state_file:
+            return
+        with self._save_lock:
+            batch_size = self.batch_size
+            if batch_size == self._saved_size:
+                return
+            try:
+                state = dict()
+                if os.path.exists(self.state_file):
+                    with open(self.state_file) as f:
+                        state = json.load(f)
+                else:
+                    os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+                state[self.origin] = batch_size
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.state_file), suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w') as f:
+                        json.dump(state, f)
+                    os.replace(tmp_path, self.state_file)
+                except BaseException:
+                    os.remove(tmp_path)
+                    raise
+                self._saved_size = batch_size
+            except (IOError, ValueError) as e:
+                logger.debug('Cannot save the batch size to %s: %s' % (self.state_file, e))
+
+    def update(self, latency, baseline_latency, has_connection_error):
+        """Update the batch size with the feedback of one chunk
+
+        Parameters
+        ----------
+        latency: float
+            the seconds to run the chunk
+
+        baseline_latency: float
+            the seconds to run the first chunk of the same call
+
+        has_connection_error: bool
+            True if a host of the chunk got a connection error
+        """
+        with self._lock:
+            if has_connection_error:
+                self.batch_size = max(self.min_size, int(self.batch_size * self.decrease))
+            elif baseline_latency is None or latency <= baseline_latency * self.latency_tolerance:
+                self.batch_size = min(self.max_size, self.batch_size + self.increase)
+            return self.batch_size
+
+
+batch_size_controller_singleton = list()
+
+
+def get_batch_size_controller():
+    '''Get the controller of the adaptive batch size, the controller is created on the first call
+
+    Returns
+    -------
+    BatchSizeController
+        the controller used when no batch size is given to `execute_cmd` or `getput_file`
+    '''
+    global batch_size_controller_singleton
+    if len(batch_size_controller_singleton) > 0:
+        return batch_size_controller_singleton[0]
+    controller = BatchSizeController()
+    batch_size_controller_singleton.append(controller)
+    return controller
+
+
+SSH_CONNECTION_ERRORS = ('Connection refused', 'No route to host', 'Could not resolve hostname',
+                         'Connection closed by remote host', 'Host is down')
+
+
+def _is_connection_error(process):
+    """Check if a process failed because its host cannot be connected to"""
+    if process.error_reason in ('taktuk connection failed', 'agent connection failed', 'agent timed out'):
+        return True
+    if 'exchange_identification' in process.stderr or 'Connection timed out' in process.stderr:
+        return True
+    # ssh exits with 255 when the connection fails
+    return process.exit_code == 255 and any(error in process.stderr for error in SSH_CONNECTION_ERRORS)
+
+
+def _has_connection_error(action):
+    return any(_is_connection_error(process) for process in getattr(action, 'processes', list()))
+
+
+def run_chunks(get_action, hosts, batch_size, mode='run'):
+    """Run an execo action on chunks of hosts concurrently
+
+    The hosts are chunked into batches of `batch_size` hosts and up to
+    `MAX_SSH_CONNECTIONS` hosts (see `set_max_connections`) are contacted at once,
+    in all the threads of the program.
+
+    Parameters
+    ----------
+    get_action: function
+        a function that takes a chunk of hosts and returns an execo action
+
+    hosts: list of str
+        list of host names or IPs
+
+    batch_size: int
+        the number of hosts in one chunk,
+        if None, the batch size is adjusted automatically (see `BatchSizeController`)
+
+    mode: str
+        run: start the actions and wait until they end
+        start: start the actions
+
+    Returns
+    -------
+    list of execo actions
+        the actions of all chunks, in the order of the chunks
+    """
+    budget = get_connection_budget()
+    connection_pool = connection_pool_singleton[0] if connection_pool_singleton else None
+    controller = get_batch_size_controller() if batch_size is None else None
+    baseline = dict()
+
+    def _run_chunk(chunk, n_connections):
+        start_time = time.time()
+        action = None
+        try:
+            if connection_pool is not None and connection_pool.enabled:
+                connection_pool.touch(chunk)
+            action = get_action(chunk)
+            if action is None:
+                return None
+            if mode == 'run':
+                action = action.run()
+            elif mode == 'start':
+                action = action.start()
+            else:
+                action = None
+            return action
+        finally:
+            budget.release(n_connections)
+            if controller is not None and action is not None:
+                latency = time.time() - start_time
+                baseline.setdefault('latency', latency)
+                controller.update(latency, baseline['latency'], _has_connection_error(action))
+
+    if controller is None:
+        chunks = list(chunk_list(hosts, batch_size))
+        if len(chunks) <= 1:
+            return [action for action in [_run_chunk(chunk, budget.acquire(len(chunk))) for chunk in chunks]
+                    if action is not None]
+
+    futures = list()
+    with ThreadPoolExecutor(max_workers=budget.max_connections, thread_name_prefix='cloudal') as thread_pool:
+        if controller is None:
+            for chunk in chunks:
+                futures.append(thread_pool.submit(lambda chunk: _run_chunk(chunk, budget.acquire(len(chunk))),
+                                                  chunk))
+        else:
+            # the size of the next chunk is decided when enough connections are available,
+            # so it takes into account the feedback of the previous chunks
+            index = 0
+            while index < len(hosts):
+                chunk = hosts[index:index + controller.batch_size]
+                index += len(chunk)
+                futures.append(thread_pool.submit(_run_chunk, chunk, budget.acquire(len(chunk))))
+    actions = [future.result() for future in futures]
+    if controller is not None:
+        controller.save()
+    return [action for action in actions if action is not None]
+
+
 class ExecuteCommandException(Exception):
     def __init__(self, message, is_continue=False):
         self.message = message
@@ -128,107 +983,1308 @@ def custom_retry_return(retry_state):
         raise(retry_state.outcome.exception())
 
 
-@retry(
-    reraise=True,
-    stop=tenacity.stop_after_attempt(10),
-    wait=tenacity.wait_random(1, 10),
-    retry_error_callback=custom_retry_return,
-    retry=tenacity.retry_if_exception_type(ExecuteCommandException)
-)
-def execute_cmd(cmd, hosts, mode='run', batch_size=5, is_continue=False):
-    """ Performing a command on remote hosts
-    Parameters
-    ----------
-    cmd: str
-        command to perform on remote hosts
+class HostResult(object):
+    """The result of a command on one host"""
+    __slots__ = ('host', 'exit_code', 'stdout', 'stderr', 'start_date', 'end_date')
 
-    hosts: list of str
-        list of host names or IPs 
+    def __init__(self, host, exit_code=None, stdout='', stderr='', start_date=None, end_date=None):
+        self.host = host
+        self.exit_code = exit_code
+        self.stdout = stdout
+        self.stderr = stderr
+        self.start_date = start_date
+        self.end_date = end_date
 
-    mode: str
-        run: start a process and wait until it ends
-        start: start a process
+    @property
+    def ok(self):
+        return self.exit_code == 0
 
-    batch_size: int
-        chunk the hosts to smaller batches with batch size
+    @property
+    def duration(self):
+        """The running time of the command in seconds, None if it is not finished"""
+        if self.start_date is None or self.end_date is None:
+            return None
+        return self.end_date - self.start_date
 
-    is_continue: bool
+    def __repr__(self):
+        return 'HostResult(host=%r, exit_code=%r, duration=%r)' % (self.host, self.exit_code, self.duration)
+
+
+class ExecutionReport(dict):
+    """A mapping from host to `HostResult`, in the order of the given hosts"""
+
+    @property
+    def ok_hosts(self):
+        return [host for host, r in self.items() if r.ok]
+
+    @property
+    def failed_hosts(self):
+        return [host for host, r in self.items() if not r.ok]
+
+    def stdout(self):
+        """Return a dict from host to its stripped stdout"""
+        return {host: r.stdout.strip() for host, r in self.items()}
+
+    def slowest(self, n=5):
+        """Return the n finished hosts which took the longest time, the slowest first"""
+        finished = [r for r in self.values() if r.duration is not None]
+        return sorted(finished, key=lambda r: r.duration, reverse=True)[:n]
+
+
+def build_report(processes):
+    """Build an `ExecutionReport` from execo processes
+
+    Parameters
+    ----------
+    processes: list of execo.process.ProcessBase
+        the processes returned by an execo action
 
     Returns
     -------
+    ExecutionReport
+        key: str, the address of the host
+        value: HostResult, the exit code, output and timing of the command on this host
     """
-    if hosts is None:
-        raise Exception("Hosts cannot be None")
-    if isinstance(hosts, str):
-        hosts = [hosts]
-    remote_executor = get_remote_executor()
-    # workaround to fix a bug of sending command to many hosts from personal machine outside of G5k:
-    result = list()
-    for chunk in chunk_list(hosts, batch_size):
-        if mode == 'run':
-            result.append(remote_executor.get_remote(cmd, chunk).run())
-        elif mode == 'start':
-            result.append(remote_executor.get_remote(cmd, chunk).start())
+    report = ExecutionReport()
+    for process in processes:
+        host = _host_address(process.host)
+        report[host] = HostResult(host=host,
+                                  exit_code=process.exit_code,
+                                  stdout=process.stdout,
+                                  stderr=process.stderr,
+                                  start_date=getattr(process, 'start_date', None),
+                                  end_date=getattr(process, 'end_date', None))
+    return report
 
-    host_errors = list()
-    for chunk in result:
-        for process in chunk.processes:
-            if process.error_reason == 'taktuk connection failed':
-                host_errors.append(process.host)
-            if ('exchange_identification' in process.stderr 
-                or 'Connection timed out' in process.stderr
-                or (process.ok == False and process.stdout.strip())):
-                logger.info('---> Retrying: %s\n' % cmd)
-                raise ExecuteCommandException(message=process.stderr.strip(), is_continue=is_continue)
-            # config host -> check for alive hosts at the end of the configuration
-        # workflow -> detect by wrap the execute_cmd by another command and check
-        #             for return host_errors --> remove host from all hosts/available host
-        #             then cancel the combination, remember to check the finally statement of
-        #             the workflow
-    if len(host_errors) == len(hosts):
-        logger.error("Connection error to %s/%s hosts.\nProgram is terminated" %
-                     (len(host_errors), len(hosts)))
-        exit()
-    elif len(host_errors) > 0:
-        logger.error("Connection error to %s hosts:\n%s" %
-                     (len(host_errors), '\n'.join(host_errors)))
-        hosts = [host for host in hosts if host not in host_errors]
-    processes = list()
-    for each in result:
-        processes += each.processes
-    if result:
-        result[0].processes = processes
-        result[0].hosts = hosts
-        result = result[0]
-    return host_errors, result
 
+class HostHealthRegistry(object):
+    """Track the connection failures of the hosts and quarantine the unreachable ones
 
-def get_file(remote_file_paths, host, local_dir, mode='run'):
-    """
-    2 modes:
-        run: start a process and wait until it ends
-        start: start a process
+    A host is quarantined after `max_failures` consecutive connection failures and is skipped
+    by the next executions. A quarantined host is probed again after `probe_delay` seconds,
+    the delay is doubled after each failed probe up to `max_probe_delay` seconds,
+    the host is released as soon as it answers.
     """
-    remote_executor = get_remote_executor()
-    if mode == 'run':
-        remote_executor.get_fileget(host, remote_file_paths, local_dir).run()
-    elif mode == 'start':
-        remote_executor.get_fileget(host, remote_file_paths, local_dir).start()
 
+    def __init__(self, max_failures=3, probe_delay=30, max_probe_delay=1800):
+        self.max_failures = max_failures
+        self.probe_delay = probe_delay
+        self.max_probe_delay = max_probe_delay
+        self.failures = dict()
+        # host -> (the time of the next probe, the current delay between probes)
+        self.quarantine = dict()
+        self._lock = threading.Lock()
 
-def getput_file(hosts, file_paths, dest_location, action, mode='run', batch_size=5):
-    """Perform files copy between local and remote
+    @property
+    def quarantined_hosts(self):
+        return set(self.quarantine)
 
-    Parameters
-    ----------
-    hosts: list of str
-        list of remote hosts to get/send files
+    def live_hosts(self, hosts):
+        """Return the given hosts that are not quarantined"""
+        return [host for host in hosts if _host_address(host) not in self.quarantine]
 
-    file_paths: list of str
-        list of file paths to (1) the local files to send to remote hosts or (2) the remote files to get to local
+    def record(self, ok_hosts, failed_hosts):
+        """Record the hosts that answer and the hosts that cannot be connected to"""
+        with self._lock:
+            for host in ok_hosts:
+                self.failures.pop(host, None)
+                if self.quarantine.pop(host, None) is not None:
+                    logger.info('Host %s is reachable again, release it from quarantine' % host)
+            for host in failed_hosts:
+                self.failures[host] = self.failures.get(host, 0) + 1
+                if host in self.quarantine:
+                    delay = min(self.quarantine[host][1] * 2, self.max_probe_delay)
+                    self.quarantine[host] = (time.time() + delay, delay)
+                elif self.failures[host] >= self.max_failures:
+                    logger.warning('Cannot connect to host %s %s times in a row, put it in quarantine' %
+                                   (host, self.failures[host]))
+                    self.quarantine[host] = (time.time() + self.probe_delay, self.probe_delay)
 
-    dest_location: str
-        the path to the destination directory
+    def probe(self):
+        """Probe the quarantined hosts whose backoff delay is over
+
+        Returns
+        -------
+        list of str
+            the hosts that are released from quarantine
+        """
+        now = time.time()
+        hosts = [host for host, (next_probe, _) in self.quarantine.items() if next_probe <= now]
+        if not hosts:
+            return list()
+        logger.debug('Probing %s quarantined hosts' % len(hosts))
+        remote_executor = get_remote_executor()
+        actions = run_chunks(lambda chunk: remote_executor.get_remote('true', chunk), hosts, len(hosts))
+        ok_hosts = [_host_address(process.host) for action in actions for process in action.processes
+                    if process.ok]
+        self.record(ok_hosts, [host for host in hosts if host not in ok_hosts])
+        return ok_hosts
+
+    def filter(self, hosts):
+        """Probe the quarantined hosts if it is time to, then return the given hosts that are not quarantined"""
+        if self.quarantine:
+            self.probe()
+        return self.live_hosts(hosts)
+
+
+host_health_singleton = list()
+
+
+def get_host_health_registry(max_failures=3, probe_delay=30, max_probe_delay=1800):
+    '''Get the registry of the health of the hosts, the registry is created on the first call
+
+    Parameters
+    ----------
+    max_failures: int
+        the number of consecutive connection failures before a host is quarantined
+
+    probe_delay: int
+        the number of seconds before the first probe of a quarantined host
+
+    max_probe_delay: int
+        the maximum number of seconds between two probes of a quarantined host
+
+    Returns
+    -------
+    HostHealthRegistry
+        the registry shared by all the remote executions
+    '''
+    global host_health_singleton
+    if len(host_health_singleton) > 0:
+        return host_health_singleton[0]
+    registry = HostHealthRegistry(max_failures=max_failures, probe_delay=probe_delay,
+                                  max_probe_delay=max_probe_delay)
+    host_health_singleton.append(registry)
+    return registry
+
+
+# the size in characters of the tail of the output of a process kept in memory when the output is streamed
+OUTPUT_TAIL_SIZE = 64 * 1024
+
+
+class StreamingOutputHandler(ProcessOutputHandler):
+    """Write the output of remote processes to per-host log files as it arrives
+
+    The output of the step on each host is appended to `<log_dir>/<step>/<host>.stdout`
+    and `<log_dir>/<step>/<host>.stderr`, and only its last `tail_size` characters are kept
+    in the `stdout` and `stderr` of the process, for the error detection.
+    It is used by `execute_cmd` with the `log_step` argument.
+    """
+
+    def __init__(self, step, log_dir=None, tail_size=OUTPUT_TAIL_SIZE):
+        ProcessOutputHandler.__init__(self)
+        self.step_dir = os.path.join(log_dir or get_output_log_dir(), step)
+        self.tail_size = tail_size
+        self.files = dict()
+        self._lock = threading.Lock()
+        os.makedirs(self.step_dir, exist_ok=True)
+
+    def get_log_path(self, host, stream_name):
+        return os.path.join(self.step_dir, '%s.%s' % (_host_address(host), stream_name))
+
+    def read(self, process, stream, string, eof, error):
+        stream_name = 'stdout' if stream == STDOUT else 'stderr'
+        key = (_host_address(process.host), stream_name)
+        with self._lock:
+            f = self.files.get(key)
+            if f is None:
+                f = self.files[key] = open(self.get_log_path(process.host, stream_name), 'a')
+        if string:
+            f.write(string)
+            f.flush()
+            setattr(process, stream_name, (getattr(process, stream_name) + string)[-self.tail_size:])
+        if eof or error:
+            with self._lock:
+                self.files.pop(key, None)
+            f.close()
+
+    def save(self, processes):
+        """Write the complete outputs of finished processes (e.g. from relays or agents) to the log files"""
+        for process in processes:
+            stdout, stderr = process.stdout, process.stderr
+            process.stdout, process.stderr = '', ''
+            self.read(process, STDOUT, stdout, True, False)
+            self.read(process, STDERR, stderr, True, False)
+
+    def get_process_args(self):
+        """Return the arguments of the execo processes that stream their output to this handler"""
+        return {'default_stdout_handler': False,
+                'default_stderr_handler': False,
+                'stdout_handlers': [self],
+                'stderr_handlers': [self]}
+
+
+output_log_dir_singleton = list()
+
+
+def set_output_log_dir(log_dir):
+    """Set the directory of the log files of the streamed remote outputs, e.g. in the result dir of the engine"""
+    global output_log_dir_singleton
+    output_log_dir_singleton[:] = [log_dir]
+
+
+def get_output_log_dir():
+    '''Get the directory of the log files of the streamed remote outputs
+
+    Returns
+    -------
+    str
+        the directory set by `set_output_log_dir`, by default `cloudal_remote_logs` in the temporary directory
+    '''
+    if len(output_log_dir_singleton) > 0:
+        return output_log_dir_singleton[0]
+    return os.path.join(tempfile.gettempdir(), 'cloudal_remote_logs')
+
+
+def _host_address(host):
+    return getattr(host, 'address', host)
+
+
+def _is_retryable(process):
+    """Check if a process failed because of a transient connection error"""
+    return ('exchange_identification' in process.stderr
+            or 'Connection timed out' in process.stderr
+            or (process.ok == False and process.stdout.strip()))
+
+
+def _collect_results(hosts, actions, processes):
+    """Merge the processes of all chunks into the first action and check the connection errors"""
+    host_errors = list()
+    for process in processes:
+        if _is_connection_error(process):
+            host_errors.append(_host_address(process.host))
+        # config host -> check for alive hosts at the end of the configuration
+        # workflow -> detect by wrap the execute_cmd by another command and check
+        #             for return host_errors --> remove host from all hosts/available host
+        #             then cancel the combination, remember to check the finally statement of
+        #             the workflow
+    get_host_health_registry().record([_host_address(process.host) for process in processes
+                                       if process.exit_code is not None and not _is_connection_error(process)],
+                                      host_errors)
+    if len(host_errors) == len(hosts):
+        logger.error("Connection error to %s/%s hosts.\nProgram is terminated" %
+                     (len(host_errors), len(hosts)))
+        exit()
+    elif len(host_errors) > 0:
+        logger.error("Connection error to %s hosts:\n%s" %
+                     (len(host_errors), '\n'.join(host_errors)))
+        hosts = [host for host in hosts if _host_address(host) not in host_errors]
+    result = actions
+    if actions:
+        result = actions[0]
+        result.processes = processes
+        result.hosts = hosts
+        result.report = build_report(processes)
+    return host_errors, result
+
+
+def _get_cmd(cmd, host):
+    """Get the command of a host, cmd is a command or a dict from host to its own command"""
+    if isinstance(cmd, dict):
+        return cmd[_host_address(host)]
+    return cmd
+
+
+def _get_remote(remote_executor, cmd, chunk, process_args=None):
+    if process_args:
+        return remote_executor.get_remote(_get_cmd(cmd, chunk[0]), chunk, process_args=process_args)
+    return remote_executor.get_remote(_get_cmd(cmd, chunk[0]), chunk)
+
+
+@retry(
+    reraise=True,
+    stop=tenacity.stop_after_attempt(10),
+    wait=tenacity.wait_random(1, 10),
+    retry_error_callback=custom_retry_return,
+    retry=tenacity.retry_if_exception_type(ExecuteCommandException)
+)
+def _execute_cmd_on_all_hosts(cmd, hosts, mode, batch_size, is_continue, process_args=None):
+    remote_executor = get_remote_executor()
+    # workaround to fix a bug of sending command to many hosts from personal machine outside of G5k:
+    result = run_chunks(lambda chunk: _get_remote(remote_executor, cmd, chunk, process_args), hosts, batch_size, mode)
+
+    processes = list()
+    for chunk in result:
+        processes += chunk.processes
+    for process in processes:
+        if _is_retryable(process):
+            # the command is retried on all hosts, the connection errors still count for the quarantine
+            get_host_health_registry().record(list(), [_host_address(p.host) for p in processes
+                                                       if _is_connection_error(p)])
+            logger.info('---> Retrying: %s\n' % _get_cmd(cmd, process.host))
+            raise ExecuteCommandException(message=process.stderr.strip(), is_continue=is_continue)
+    return _collect_results(hosts, result, processes)
+
+
+def _execute_cmd_on_failed_hosts(cmd, hosts, mode, batch_size, is_continue, process_args=None):
+    remote_executor = get_remote_executor()
+    actions = list()
+    host_processes = dict()
+    retry_hosts = list(hosts)
+    retrying = tenacity.Retrying(reraise=True,
+                                 stop=tenacity.stop_after_attempt(10),
+                                 wait=tenacity.wait_random(1, 10),
+                                 retry_error_callback=custom_retry_return,
+                                 retry=tenacity.retry_if_exception_type(ExecuteCommandException))
+    for attempt in retrying:
+        with attempt:
+            result = run_chunks(lambda chunk: _get_remote(remote_executor, cmd, chunk, process_args),
+                                retry_hosts, batch_size, mode)
+            actions += result
+            failed_processes = list()
+            for chunk in result:
+                for process in chunk.processes:
+                    host_processes[_host_address(process.host)] = process
+                    if _is_retryable(process):
+                        failed_processes.append(process)
+            if failed_processes:
+                retry_hosts = [_host_address(process.host) for process in failed_processes]
+                logger.info('---> Retrying on %s/%s hosts: %s\n' % (len(retry_hosts), len(hosts),
+                                                                     _get_cmd(cmd, retry_hosts[0])))
+                raise ExecuteCommandException(message=failed_processes[0].stderr.strip(),
+                                              is_continue=is_continue)
+    processes = [host_processes[_host_address(host)] for host in hosts
+                 if _host_address(host) in host_processes]
+    return _collect_results(hosts, actions, processes)
+
+
+def _execute_cmd_via_relays(cmd, hosts, batch_size, is_continue, retry_failed_hosts):
+    """Run a command on the hosts through the relays of a `RelayActionFactory`
+
+    The hops from a relay to its hosts are retried on transient errors as the direct commands:
+    only the failed hosts if `retry_failed_hosts`, all the hosts of the relays otherwise.
+    """
+    remote_executor = get_remote_executor()
+    relay_hosts, direct_hosts = remote_executor.group_hosts(hosts)
+    retry_hosts = [host for relay in relay_hosts for host in relay_hosts[relay]]
+    actions = list()
+    host_processes = dict()
+    retrying = tenacity.Retrying(reraise=True,
+                                 stop=tenacity.stop_after_attempt(10),
+                                 wait=tenacity.wait_random(1, 10),
+                                 retry_error_callback=custom_retry_return,
+                                 retry=tenacity.retry_if_exception_type(ExecuteCommandException))
+    for attempt in retrying:
+        with attempt:
+            relay_hosts, _ = remote_executor.group_hosts(retry_hosts)
+            relays = list(relay_hosts)
+            result = run_chunks(lambda chunk: remote_executor.get_relay_remote(cmd, chunk[0],
+                                                                               relay_hosts[chunk[0]]),
+                                relays, 1)
+            actions += result
+            failed_processes = list()
+            for relay, action in zip(relays, result):
+                relay_processes = remote_executor.parse_results(action.processes[0])
+                if relay_processes is None:
+                    logger.warning('Relay %s failed, running the command directly on its %s hosts:\n%s' %
+                                   (relay, len(relay_hosts[relay]), action.processes[0].stderr.strip()))
+                    direct_hosts += relay_hosts[relay]
+                    continue
+                logger.debug('Relay %s ran the command on %s hosts' % (relay, len(relay_processes)))
+                for process in relay_processes:
+                    host_processes[_host_address(process.host)] = process
+                    if _is_retryable(process):
+                        failed_processes.append(process)
+            if failed_processes:
+                if retry_failed_hosts:
+                    retry_hosts = [_host_address(process.host) for process in failed_processes]
+                else:
+                    retry_hosts = [host for host in retry_hosts if host not in direct_hosts]
+                logger.info('---> Retrying through the relays on %s hosts: %s\n' % (len(retry_hosts), cmd))
+                raise ExecuteCommandException(message=failed_processes[0].stderr.strip(), is_continue=is_continue)
+    processes = list(host_processes.values())
+    if direct_hosts:
+        if retry_failed_hosts:
+            direct_result = _execute_cmd_on_failed_hosts(cmd, direct_hosts, 'run', batch_size, is_continue)
+        else:
+            direct_result = _execute_cmd_on_all_hosts(cmd, direct_hosts, 'run', batch_size, is_continue)
+        if direct_result:
+            _, direct_result = direct_result
+            if direct_result:
+                actions.insert(0, direct_result)
+                processes += direct_result.processes
+    host_processes = {_host_address(process.host): process for process in processes}
+    processes = [host_processes[_host_address(host)] for host in hosts if _host_address(host) in host_processes]
+    return _collect_results(hosts, actions, processes)
+
+
+def _execute_cmd_via_agents(cmd, hosts):
+    """Run a command on the hosts through the agents of an `AgentActionFactory`"""
+    remote_executor = get_remote_executor()
+    result = remote_executor.run(cmd, hosts)
+    return _collect_results(hosts, [result], result.processes)
+
+
+def _skip_quarantined_hosts(hosts):
+    """Return the hosts that are not quarantined and the addresses of the quarantined ones"""
+    live_hosts = get_host_health_registry().filter(hosts)
+    skipped_hosts = list()
+    if len(live_hosts) < len(hosts):
+        skipped_hosts = [_host_address(host) for host in hosts if host not in live_hosts]
+        logger.warning('Skipping %s quarantined hosts:\n%s' % (len(skipped_hosts), '\n'.join(skipped_hosts)))
+        if not live_hosts:
+            logger.error("All %s hosts are quarantined.\nProgram is terminated" % len(hosts))
+            exit()
+    return live_hosts, skipped_hosts
+
+
+def _add_skipped_hosts(result, skipped_hosts):
+    """Report the quarantined hosts in the host errors of a result of `execute_cmd`"""
+    if not skipped_hosts or result is None:
+        return result
+    host_errors, action = result
+    return list(host_errors) + skipped_hosts, action
+
+
+def execute_cmd(cmd, hosts, mode='run', batch_size=None, is_continue=False, retry_failed_hosts=False,
+                log_step=None):
+    """ Performing a command on remote hosts
+    Parameters
+    ----------
+    cmd: str
+        command to perform on remote hosts
+
+    hosts: list of str
+        list of host names or IPs,
+        the hosts quarantined by the `HostHealthRegistry` (see `get_host_health_registry`) are skipped
+        and returned in the host errors
+
+    mode: str
+        run: start a process and wait until it ends
+        start: start a process
+
+    batch_size: int
+        chunk the hosts to smaller batches with batch size,
+        the batches are run concurrently within the global limit of SSH connections;
+        if None, the batch size is adjusted automatically from the connection errors and latency
+
+    is_continue: bool
+        if True, do not raise an exception after retrying maximum times
+
+    retry_failed_hosts: bool
+        if True, only the hosts that fail with a connection error are retried,
+        their results are merged with the results of the hosts that already succeeded;
+        if False, the command is retried on all hosts
+
+    log_step: str
+        if set, the output of the command is written as it arrives to per-host log files
+        of this step in the output log dir (see `StreamingOutputHandler` and `set_output_log_dir`),
+        only the tail of the output is kept in the processes
+
+    Returns
+    -------
+    host_errors: list of str
+        the hosts that cannot be connected to, including the skipped quarantined hosts
+
+    result: execo.action.Remote
+        the action that contains the processes of all hosts,
+        `result.report` is an `ExecutionReport` of the exit code, stdout, stderr,
+        start and end time of the command on each host
+    """
+    if hosts is None:
+        raise Exception("Hosts cannot be None")
+    if isinstance(hosts, str):
+        hosts = [hosts]
+    hosts, skipped_hosts = _skip_quarantined_hosts(hosts)
+    remote_executor = get_remote_executor()
+    if isinstance(remote_executor, HybridActionFactory):
+        strategy = remote_executor.get_strategy(hosts)
+        if strategy == TAKTUK:
+            # TakTuk propagates the command through the hosts by itself
+            batch_size = len(hosts)
+        start_time = time.time()
+    output_handler = StreamingOutputHandler(log_step) if log_step else None
+    if isinstance(remote_executor, AgentActionFactory) and mode == 'run':
+        result = _execute_cmd_via_agents(cmd, hosts)
+    elif isinstance(remote_executor, RelayActionFactory) and mode == 'run':
+        result = _execute_cmd_via_relays(cmd, hosts, batch_size, is_continue, retry_failed_hosts)
+    else:
+        process_args = output_handler.get_process_args() if output_handler else None
+        if retry_failed_hosts:
+            result = _execute_cmd_on_failed_hosts(cmd, hosts, mode, batch_size, is_continue, process_args)
+        else:
+            result = _execute_cmd_on_all_hosts(cmd, hosts, mode, batch_size, is_continue, process_args)
+        # the outputs are already streamed to the log files
+        output_handler = None
+    if output_handler is not None and result and result[1]:
+        output_handler.save(result[1].processes)
+        result[1].report = build_report(result[1].processes)
+    if isinstance(remote_executor, HybridActionFactory):
+        remote_executor.record(strategy, len(hosts), time.time() - start_time)
+    return _add_skipped_hosts(result, skipped_hosts)
+
+
+def execute_cmd_per_host(cmd_template, host_vars, mode='run', is_continue=False, retry_failed_hosts=False):
+    """Render a command for each host and run all the rendered commands in one parallel dispatch
+
+    Parameters
+    ----------
+    cmd_template: str
+        the command with `%(name)s` placeholders, a literal `%` has to be written as `%%`
+
+    host_vars: dict
+        key: str, the host name or IP
+        value: dict, the values of the placeholders for this host
+
+    mode: str
+        run: start a process and wait until it ends
+        start: start a process
+
+    is_continue: bool
+        if True, do not raise an exception after retrying maximum times
+
+    retry_failed_hosts: bool
+        if True, only the hosts that fail with a connection error are retried
+
+    Returns
+    -------
+    host_errors: list of str
+        the hosts that cannot be connected to, including the skipped quarantined hosts
+
+    result: execo.action.Remote
+        the action that contains the processes of all hosts, see `execute_cmd`
+
+    Example
+    -------
+        execute_cmd_per_host('sed -i "s/node_id = 0/node_id = %(node_id)s/g" /tmp/Elmerfs.template.toml',
+                             {'host-1': {'node_id': 0}, 'host-2': {'node_id': 1}})
+    """
+    hosts = list(host_vars)
+    if not hosts:
+        return list(), list()
+    hosts, skipped_hosts = _skip_quarantined_hosts(hosts)
+    cmds = {host: cmd_template % variables for host, variables in host_vars.items()}
+    logger.debug('Running %s on %s hosts' % (cmd_template, len(hosts)))
+    # each host has its own command, so one chunk is one host, the global connection budget
+    # still limits the number of hosts contacted at once
+    if retry_failed_hosts:
+        result = _execute_cmd_on_failed_hosts(cmds, hosts, mode, 1, is_continue)
+    else:
+        result = _execute_cmd_on_all_hosts(cmds, hosts, mode, 1, is_continue)
+    return _add_skipped_hosts(result, skipped_hosts)
+
+
+# the directory of the markers of the steps run by `ensure_cmd` on the hosts,
+# it is kept across reboots and cleaned by a new deployment of the OS
+ENSURE_MARKER_DIR = '/var/tmp/cloudal_markers'
+ENSURE_SKIPPED = '__CLOUDAL_SKIPPED__'
+
+
+def get_ensure_key(cmd, inputs=None):
+    """Return the key of a step from its command and its inputs"""
+    checksum = hashlib.sha256(cmd.encode())
+    if inputs is not None:
+        checksum.update(json.dumps(inputs, sort_keys=True, default=str).encode())
+    return checksum.hexdigest()[:16]
+
+
+def ensure_cmd(cmd, hosts, inputs=None, key=None, batch_size=None, is_continue=False, retry_failed_hosts=False,
+               log_step=None):
+    """Run a command only on the hosts where it has not succeeded yet
+
+    After the command succeeds on a host, a marker file named after the key of the step
+    is written on this host, the hosts that already have the marker skip the command.
+    The check and the command are sent in the same call, so a step that is already done
+    on all hosts costs one round trip.
+
+    Parameters
+    ----------
+    cmd: str
+        command to perform on remote hosts
+
+    hosts: list of str
+        list of host names or IPs
+
+    inputs: object
+        the other inputs of the step (e.g. the version of a package), serializable to JSON,
+        the step is run again when they change
+
+    key: str
+        the name of the step, used instead of the command to build the key
+        when the command changes at each run (e.g. it contains a token)
+
+    batch_size, is_continue, retry_failed_hosts, log_step:
+        see `execute_cmd`
+
+    Returns
+    -------
+    host_errors: list of str
+        the hosts that cannot be connected to
+
+    result: execo.action.Remote
+        see `execute_cmd`
+    """
+    if isinstance(hosts, str):
+        hosts = [hosts]
+    marker = '%s/%s' % (ENSURE_MARKER_DIR, get_ensure_key(key or cmd, inputs))
+    # the command is sent encoded, so that any command (e.g. with a heredoc) runs as it is
+    script = base64.b64encode(cmd.encode()).decode()
+    ensure = ('if [ -f %s ]; then echo %s; else bash -c "$(echo %s | base64 -d)" && mkdir -p %s && date +%%s > %s; fi'
+              % (marker, ENSURE_SKIPPED, script, ENSURE_MARKER_DIR, marker))
+    host_errors, result = execute_cmd(ensure, hosts, batch_size=batch_size, is_continue=is_continue,
+                                      retry_failed_hosts=retry_failed_hosts, log_step=log_step)
+    if result:
+        skipped_hosts = [host for host, stdout in result.report.stdout().items() if stdout == ENSURE_SKIPPED]
+        if skipped_hosts:
+            logger.info('Skipped on %s/%s hosts where it is already done: %s' % (len(skipped_hosts), len(hosts),
+                                                                               key or cmd))
+    return host_errors, result
+
+
+def reset_ensure_markers(hosts):
+    """Remove the markers of `ensure_cmd` so that all the steps are run again on the hosts"""
+    return execute_cmd('rm -rf %s' % ENSURE_MARKER_DIR, hosts)
+
+
+FACTS_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cloudal', 'facts')
+
+# one line `name=value` per fact
+FACTS_CMD = '''. /etc/os-release 2>/dev/null
+echo "os=$ID"
+echo "os_version=$VERSION_ID"
+echo "os_full_name=$PRETTY_NAME"
+echo "kernel=$(uname -r)"
+echo "arch=$(uname -m)"
+echo "hostname=$(hostname)"
+echo "n_cpus=$(nproc)"
+echo "memory_kb=$(awk '/MemTotal/ {print $2}' /proc/meminfo)"
+echo "disks=$(lsblk -dnb -o NAME,SIZE 2>/dev/null | awk '{printf "%s:%s ", $1, $2}')"
+echo "ips=$(hostname -I)"
+echo "boot_id=$(cat /proc/sys/kernel/random/boot_id)"'''
+
+
+def _parse_facts(stdout):
+    facts = dict()
+    for line in stdout.splitlines():
+        name, sep, value = line.partition('=')
+        if sep:
+            facts[name.strip()] = value.strip()
+    if 'os' not in facts:
+        return None
+    for name in ('n_cpus', 'memory_kb'):
+        facts[name] = int(facts[name]) if facts.get(name, '').isdigit() else None
+    facts['disks'] = dict((disk.split(':')[0], int(disk.split(':')[1])) for disk in facts.get('disks', '').split()
+                          if ':' in disk and disk.split(':')[1].isdigit())
+    facts['ips'] = facts.get('ips', '').split()
+    return facts
+
+
+class FactCache(object):
+    """Cache of the facts of the hosts, in memory and on disk
+
+    The facts are kept on disk with the cache key, e.g. the reservation of the hosts,
+    and are reused from disk by a later run only when it has the same cache key.
+    Without a cache key, the facts are only kept in memory.
+    """
+
+    def __init__(self, cache_dir=FACTS_CACHE_DIR, cache_key=None):
+        self.cache_dir = cache_dir
+        self.cache_key = cache_key
+        self.facts = dict()
+        self._lock = threading.Lock()
+
+    def _path(self, host):
+        return os.path.join(self.cache_dir, '%s.json' % host)
+
+    def get(self, host):
+        with self._lock:
+            if host in self.facts:
+                return self.facts[host]
+        if self.cache_dir is None or self.cache_key is None or not os.path.exists(self._path(host)):
+            return None
+        try:
+            with open(self._path(host)) as f:
+                entry = json.load(f)
+        except (IOError, ValueError) as e:
+            logger.debug('Cannot load the facts of %s: %s' % (host, e))
+            return None
+        if entry.get('cache_key') != self.cache_key:
+            return None
+        with self._lock:
+            self.facts[host] = entry['facts']
+        return entry['facts']
+
+    def put(self, host, facts):
+        with self._lock:
+            self.facts[host] = facts
+        # the facts on disk are only read back with a cache key
+        if self.cache_dir is None or self.cache_key is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self._path(host), 'w') as f:
+                json.dump({'cache_key': self.cache_key, 'facts': facts}, f)
+        except IOError as e:
+            logger.debug('Cannot save the facts of %s: %s' % (host, e))
+
+    def invalidate(self, hosts=None):
+        """Forget the facts of the hosts (e.g. after a new deployment of their OS), or of all hosts"""
+        with self._lock:
+            if hosts is None:
+                hosts = list(self.facts)
+            for host in hosts:
+                self.facts.pop(_host_address(host), None)
+        if self.cache_dir is None:
+            return
+        for host in hosts:
+            if os.path.exists(self._path(_host_address(host))):
+                os.remove(self._path(_host_address(host)))
+
+
+fact_cache_singleton = list()
+
+
+def get_fact_cache():
+    '''Get the cache of the facts of the hosts, the cache is created on the first call
+
+    Returns
+    -------
+    FactCache
+        the cache shared by all configurators
+    '''
+    global fact_cache_singleton
+    if len(fact_cache_singleton) > 0:
+        return fact_cache_singleton[0]
+    cache = FactCache()
+    fact_cache_singleton.append(cache)
+    return cache
+
+
+def gather_facts(hosts, refresh=False):
+    """Get the OS, kernel, CPU count, memory, disks and IPs of the hosts
+
+    The facts of all hosts that are not in the fact cache are collected with one parallel call.
+
+    Parameters
+    ----------
+    hosts: list of str
+        list of host names or IPs
+
+    refresh: bool
+        if True, collect the facts again even if they are in the cache
+
+    Returns
+    -------
+    dict
+        key: str, the host
+        value: dict, the facts of the host (os, os_version, os_full_name, kernel, arch, hostname,
+        n_cpus, memory_kb, disks, ips, boot_id); the hosts whose facts cannot be collected are missing
+    """
+    if isinstance(hosts, str):
+        hosts = [hosts]
+    cache = get_fact_cache()
+    facts = dict()
+    missing_hosts = list()
+    for host in hosts:
+        host_facts = None if refresh else cache.get(_host_address(host))
+        if host_facts is None:
+            missing_hosts.append(host)
+        else:
+            facts[_host_address(host)] = host_facts
+    if not missing_hosts:
+        return facts
+    logger.debug('Gathering facts of %s hosts' % len(missing_hosts))
+    _, r = execute_cmd(FACTS_CMD, missing_hosts, is_continue=True, retry_failed_hosts=True)
+    for host, host_result in (r.report.items() if r else list()):
+        host_facts = _parse_facts(host_result.stdout)
+        if host_facts is None:
+            logger.error('Cannot gather the facts of host %s: %s' % (host, host_result.stderr.strip()))
+            continue
+        cache.put(host, host_facts)
+        facts[host] = host_facts
+    return facts
+
+
+STEP_MARKER = '__CLOUDAL_STEP__'
+
+
+class BatchHostResult(object):
+    """The result of a `CommandBatch` on one host"""
+    __slots__ = ('host', 'exit_codes', 'failed_step')
+
+    def __init__(self, host, exit_codes, failed_step=None):
+        self.host = host
+        self.exit_codes = exit_codes
+        self.failed_step = failed_step
+
+    @property
+    def ok(self):
+        return self.failed_step is None
+
+    def __repr__(self):
+        return 'BatchHostResult(host=%r, exit_codes=%r, failed_step=%r)' % (
+            self.host, self.exit_codes, self.failed_step)
+
+
+class CommandBatch(object):
+    """Queue several commands for a set of hosts and run them in one round trip
+
+    The queued commands are shipped to the hosts as one shell script, each command
+    is run in its own subshell and its exit status is reported back.
+
+    Example
+    -------
+        batch = CommandBatch(hosts)
+        batch.add('sed -i "s/run 60/run 600/g" /tmp/varmail.f')
+        batch.add('sync; echo 3 > /proc/sys/vm/drop_caches')
+        results = batch.run()
+    """
+
+    def __init__(self, hosts, stop_on_failure=True):
+        """
+        Parameters
+        ----------
+        hosts: list of str
+            list of host names or IPs
+
+        stop_on_failure: bool
+            if True, a host stops running the remaining commands after the first failed one
+        """
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        self.hosts = hosts
+        self.stop_on_failure = stop_on_failure
+        self.commands = list()
+        self.results = None
+
+    def add(self, cmd):
+        """Queue a command, the commands are run in the order they are added"""
+        self.commands.append(cmd)
+        return self
+
+    def get_script(self):
+        lines = list()
+        for index, cmd in enumerate(self.commands):
+            lines.append('(\n%s\n)' % cmd)
+            lines.append('__rc=$?; echo; echo "%s %s $__rc"' % (STEP_MARKER, index))
+            if self.stop_on_failure:
+                lines.append('[ $__rc -eq 0 ] || exit 0')
+        return '\n'.join(lines)
+
+    def _parse_exit_codes(self, stdout):
+        exit_codes = dict()
+        for index, exit_code in re.findall(r'^%s (\d+) (\d+)\s*$' % STEP_MARKER, stdout, flags=re.M):
+            exit_codes[int(index)] = int(exit_code)
+        return [exit_codes[index] for index in sorted(exit_codes)]
+
+    def run(self, batch_size=None, is_continue=False):
+        """Run all the queued commands on the hosts
+
+        Returns
+        -------
+        dict
+            key: str, the host
+            value: BatchHostResult, the exit code of each command that was run on this host
+            and the index of the first failed command (None if all commands succeed)
+        """
+        if not self.commands:
+            return dict()
+        script = base64.b64encode(self.get_script().encode()).decode()
+        cmd = 'bash -c "$(echo %s | base64 -d)"' % script
+        _, r = execute_cmd(cmd, self.hosts, batch_size=batch_size,
+                           is_continue=is_continue, retry_failed_hosts=True)
+        self.results = dict()
+        for host, host_result in r.report.items():
+            exit_codes = self._parse_exit_codes(host_result.stdout)
+            failed_step = None
+            for index, exit_code in enumerate(exit_codes):
+                if exit_code != 0:
+                    failed_step = index
+                    break
+            else:
+                if len(exit_codes) < len(self.commands):
+                    failed_step = len(exit_codes)
+            self.results[host] = BatchHostResult(host, exit_codes, failed_step)
+            if failed_step is not None:
+                logger.error('Command #%s failed on host %s: %s' % (failed_step, host, self.commands[failed_step]))
+        return self.results
+
+
+class RemoteLogTailer(ProcessOutputHandler):
+    """Follow a remote log file on many hosts and copy its new lines to a local sink
+
+    The lines of all hosts are written to the sink prefixed with `[host] `. The byte offset
+    that has been read on each host is saved to `<sink>.offsets`, so a new tailer
+    on the same sink resumes where the previous one stopped. The lines are matched
+    against the triggers, e.g. to abort a combination as soon as a process panics.
+
+    Example
+    -------
+        tailer = RemoteLogTailer('/tmp/elmer.log', hosts, os.path.join(comb_dir, 'elmer.log'))
+        tailer.add_trigger('panicked at')
+        tailer.start()
+        if tailer.triggered.wait(timeout=600):
+            logger.info('elmerfs panicked on %s' % tailer.matches[0][0])
+        tailer.stop()
+    """
+
+    def __init__(self, remote_path, hosts, sink, checkpoint_interval=1):
+        """
+        Parameters
+        ----------
+        remote_path: str
+            the path of the log file on the hosts
+
+        hosts: list of str
+            list of host names or IPs
+
+        sink: str or function
+            the path of the local file where the lines are appended,
+            or a function that takes the host and the line
+
+        checkpoint_interval: int
+            the minimum number of seconds between two saves of the offsets
+        """
+        ProcessOutputHandler.__init__(self)
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        self.remote_path = remote_path
+        self.hosts = hosts
+        self.sink = sink
+        self.checkpoint_interval = checkpoint_interval
+        self.offsets = self._load_offsets()
+        self.triggers = list()
+        self.matches = list()
+        self.triggered = threading.Event()
+        self.actions = list()
+        self._sink_file = None
+        self._partial_lines = dict()
+        self._last_checkpoint = 0
+        self._lock = threading.Lock()
+
+    @property
+    def offsets_path(self):
+        if isinstance(self.sink, str):
+            return self.sink + '.offsets'
+        return None
+
+    def _load_offsets(self):
+        if self.offsets_path is None or not os.path.exists(self.offsets_path):
+            return dict()
+        with open(self.offsets_path) as f:
+            return json.load(f)
+
+    def save_offsets(self):
+        if self.offsets_path is None:
+            return
+        with self._lock:
+            offsets = dict(self.offsets)
+        with open(self.offsets_path + '.tmp', 'w') as f:
+            json.dump(offsets, f)
+        os.rename(self.offsets_path + '.tmp', self.offsets_path)
+
+    def add_trigger(self, pattern, callback=None):
+        """Call a function when a line matches a regular expression
+
+        Parameters
+        ----------
+        pattern: str
+            the regular expression searched in each line
+
+        callback: function
+            a function that takes the host and the line, the `triggered` event is always set
+        """
+        self.triggers.append((re.compile(pattern), callback))
+        return self
+
+    def handle_line(self, host, line):
+        with self._lock:
+            if callable(self.sink):
+                self.sink(host, line)
+            else:
+                if self._sink_file is None:
+                    if os.path.dirname(self.sink):
+                        os.makedirs(os.path.dirname(self.sink), exist_ok=True)
+                    self._sink_file = open(self.sink, 'a')
+                self._sink_file.write('[%s] %s\n' % (host, line))
+        for pattern, callback in self.triggers:
+            if pattern.search(line):
+                logger.info('Trigger "%s" on host %s: %s' % (pattern.pattern, host, line))
+                self.matches.append((host, line))
+                self.triggered.set()
+                if callback is not None:
+                    callback(host, line)
+
+    def read(self, process, stream, string, eof, error):
+        host = _host_address(process.host)
+        buffer = self._partial_lines.get(host, '') + string
+        lines = buffer.split('\n')
+        # the last item is the beginning of a line that is not complete yet
+        self._partial_lines[host] = lines.pop()
+        for line in lines:
+            self.handle_line(host, line)
+            with self._lock:
+                self.offsets[host] = self.offsets.get(host, 0) + len(line.encode()) + 1
+        if lines:
+            with self._lock:
+                if self._sink_file is not None:
+                    self._sink_file.flush()
+            if time.time() - self._last_checkpoint >= self.checkpoint_interval:
+                self._last_checkpoint = time.time()
+                self.save_offsets()
+
+    def start(self):
+        """Start following the log file on all hosts, from the saved offset of each host
+
+        Like the sessions of the agents, a tail session takes a slot of the connection budget only
+        while it is started, so the long-lived sessions never block the short commands
+        (e.g. `RemoteJob.poll`) that need the budget while the log is followed.
+        """
+        remote_executor = get_remote_executor()
+        cmds = {_host_address(host): 'tail -c +%s -F %s 2>/dev/null' % (self.offsets.get(_host_address(host), 0) + 1,
+                                                                       self.remote_path)
+                for host in self.hosts}
+        process_args = {'default_stdout_handler': False, 'stdout_handlers': [self]}
+        self.actions = run_chunks(lambda chunk: _get_remote(remote_executor, cmds, chunk, process_args),
+                                  self.hosts, 1, 'start')
+        return self
+
+    def stop(self):
+        """Stop following the log file and save the offsets"""
+        for action in self.actions:
+            action.kill()
+        self.actions = list()
+        self.save_offsets()
+        with self._lock:
+            if self._sink_file is not None:
+                self._sink_file.close()
+                self._sink_file = None
+
+
+JOB_DIR = '/tmp/cloudal_jobs'
+
+
+class RemoteJob(object):
+    """A handle on a long-running command started in the background on a set of hosts
+
+    The command is detached from the SSH session in its own process group, its pid and
+    its exit code are written to files in `job_dir` on each host, so the state of the job
+    on all hosts is read back with one probe.
+
+    Example
+    -------
+        job = RemoteJob('filebench -f /tmp/varmail.f > /tmp/results/filebench_$(hostname)', hosts)
+        job.start()
+        if not job.wait(timeout=900):
+            job.kill()
+        failed_hosts = [host for host, exit_code in job.exit_codes.items() if exit_code != 0]
+    """
+
+    RUNNING = 'running'
+    DONE = 'done'
+    LOST = 'lost'
+
+    def __init__(self, cmd, hosts, host_vars=None, name='job', job_dir=JOB_DIR):
+        """
+        Parameters
+        ----------
+        cmd: str
+            the command to run in the background,
+            a command template with `%(name)s` placeholders if host_vars is given
+
+        hosts: list of str
+            list of host names or IPs
+
+        host_vars: dict
+            key: str, the host name or IP
+            value: dict, the values of the placeholders of the command for this host
+
+        name: str
+            the prefix of the job files on the hosts
+
+        job_dir: str
+            the directory of the job files on the hosts
+        """
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        self.cmd = cmd
+        self.hosts = hosts
+        self.host_vars = host_vars
+        self.job_id = '%s_%x' % (name, int(time.time() * 1000000))
+        self.job_dir = job_dir
+        self.exit_codes = dict()
+        self.start_date = None
+        self.end_dates = dict()
+
+    def _path(self, extension):
+        return '%s/%s.%s' % (self.job_dir, self.job_id, extension)
+
+    def _wrap(self, cmd):
+        script = '(\n%s\n)\necho $? > %s' % (cmd, self._path('rc'))
+        script = base64.b64encode(script.encode()).decode()
+        return ('mkdir -p %s && rm -f %s && '
+                '(setsid nohup bash -c "$(echo %s | base64 -d)" > %s 2>&1 < /dev/null & echo $! > %s)'
+                % (self.job_dir, self._path('rc'), script, self._path('log'), self._path('pid')))
+
+    def start(self, hosts=None):
+        """Start the command on the hosts, or only on the given hosts to restart the job on them
+
+        Returns
+        -------
+        list of str
+            the hosts that cannot be connected to
+        """
+        if hosts is None:
+            hosts = self.hosts
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        if self.start_date is None:
+            self.start_date = time.time()
+        for host in hosts:
+            self.exit_codes.pop(host, None)
+            self.end_dates.pop(host, None)
+        logger.debug('Starting job %s on %s hosts: %s' % (self.job_id, len(hosts), self.cmd))
+        if self.host_vars is None:
+            host_errors, _ = execute_cmd(self._wrap(self.cmd), hosts, retry_failed_hosts=True)
+        else:
+            host_errors, _ = execute_cmd_per_host(
+                '%(cmd)s', {host: {'cmd': self._wrap(self.cmd % self.host_vars[host])} for host in hosts},
+                retry_failed_hosts=True)
+        return host_errors
+
+    def poll(self, hosts=None):
+        """Check the state of the job on all hosts with one batched probe
+
+        Returns
+        -------
+        dict
+            key: str, the host
+            value: str, `running`, `done` or `lost` if the process ended without an exit code,
+            None if the host cannot be connected to
+        """
+        if hosts is None:
+            hosts = [host for host in self.hosts if host not in self.exit_codes]
+        states = {host: self.DONE for host in self.hosts if host in self.exit_codes}
+        if not hosts:
+            return states
+        cmd = ('if [ -f %(rc)s ]; then echo "%(done)s $(cat %(rc)s)"; '
+               'elif [ -f %(pid)s ] && kill -0 $(cat %(pid)s) 2>/dev/null; then echo %(running)s; '
+               'else echo %(lost)s; fi') % {'rc': self._path('rc'), 'pid': self._path('pid'), 'done': self.DONE,
+                                            'running': self.RUNNING, 'lost': self.LOST}
+        _, r = execute_cmd(cmd, hosts, is_continue=True, retry_failed_hosts=True)
+        for host, state in r.report.stdout().items():
+            state = state.split()
+            if not state:
+                states[host] = None
+                continue
+            states[host] = state[0]
+            if state[0] == self.DONE:
+                self.exit_codes[host] = int(state[1]) if len(state) > 1 else None
+                self.end_dates[host] = time.time()
+        return states
+
+    def running_hosts(self):
+        """Return the hosts where the job is still running"""
+        return [host for host, state in self.poll().items() if state == self.RUNNING]
+
+    def wait(self, timeout=None, interval=10, abort=None):
+        """Wait until the job ends on all hosts
+
+        Parameters
+        ----------
+        timeout: int
+            the maximum number of seconds to wait, None to wait forever
+
+        interval: int
+            the number of seconds between two probes
+
+        abort: threading.Event
+            stop waiting as soon as this event is set, e.g. `RemoteLogTailer.triggered`
+
+        Returns
+        -------
+        bool
+            True if the job ends on all hosts before the timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if abort is not None and abort.is_set():
+                logger.info('Stop waiting for job %s' % self.job_id)
+                return False
+            states = self.poll()
+            if self.RUNNING not in states.values():
+                lost_hosts = [host for host, state in states.items() if state != self.DONE]
+                if lost_hosts:
+                    logger.error('Job %s is lost on %s hosts:\n%s' % (self.job_id, len(lost_hosts),
+                                                                     '\n'.join(lost_hosts)))
+                return True
+            if deadline is not None and time.time() + interval > deadline:
+                logger.info('Job %s is still running after %s seconds' % (self.job_id, timeout))
+                return False
+            if abort is not None:
+                abort.wait(interval)
+            else:
+                time.sleep(interval)
+
+    def kill(self, hosts=None, signal='TERM'):
+        """Send a signal to the process group of the job on the hosts
+
+        The job is recorded with the exit code of a shell command killed by this signal (128 + signal number).
+        """
+        if hosts is None:
+            hosts = self.hosts
+        cmd = ('[ -f %(pid)s ] && kill -%(signal)s -- -$(cat %(pid)s) 2>/dev/null '
+               '&& [ ! -f %(rc)s ] && echo $((128 + $(kill -l %(signal)s))) > %(rc)s; true') % {
+            'pid': self._path('pid'), 'rc': self._path('rc'), 'signal': signal}
+        host_errors, _ = execute_cmd(cmd, hosts, is_continue=True, retry_failed_hosts=True)
+        return host_errors
+
+
+def start_job(cmd, hosts, host_vars=None, name='job'):
+    """Start a command in the background on remote hosts and return a handle on it
+
+    Parameters
+    ----------
+    cmd: str
+        the command to run in the background,
+        a command template with `%(name)s` placeholders if host_vars is given
+
+    hosts: list of str
+        list of host names or IPs
+
+    host_vars: dict
+        key: str, the host name or IP
+        value: dict, the values of the placeholders of the command for this host
+
+    name: str
+        the prefix of the job files on the hosts
+
+    Returns
+    -------
+    RemoteJob
+        the handle to wait for, probe or kill the job
+    """
+    job = RemoteJob(cmd, hosts, host_vars=host_vars, name=name)
+    job.start()
+    return job
+
+
+def get_file(remote_file_paths, host, local_dir, mode='run'):
+    """
+    2 modes:
+        run: start a process and wait until it ends
+        start: start a process
+    """
+    remote_executor = get_remote_executor()
+    if mode == 'run':
+        remote_executor.get_fileget(host, remote_file_paths, local_dir).run()
+    elif mode == 'start':
+        remote_executor.get_fileget(host, remote_file_paths, local_dir).start()
+
+
+def getput_file(hosts, file_paths, dest_location, action, mode='run', batch_size=None, broadcast=None, fanout=2):
+    """Perform files copy between local and remote
+
+    Parameters
+    ----------
+    hosts: list of str
+        list of remote hosts to get/send files
+
+    file_paths: list of str
+        list of file paths to (1) the local files to send to remote hosts or (2) the remote files to get to local
+
+    dest_location: str
+        the path to the destination directory
 
     action: str
         a type of action to perform between local and remote, there are 2 actions:
@@ -242,24 +2298,192 @@ def getput_file(hosts, file_paths, dest_location, action, mode='run', batch_size
 
     batch_size: int
         the list of hosts will be chunked into N chunks of size: batch_size before executing a command
-        as a workaround to the limitation of Grid5k for the number of concurrent ssh connection from local
+        as a workaround to the limitation of Grid5k for the number of concurrent ssh connection from local,
+        the chunks are run concurrently within the global limit of SSH connections (see `set_max_connections`);
+        if None, the batch size is adjusted automatically from the connection errors and latency
+
+    broadcast: str
+        only used with the `put` action, the hosts that already received the files forward them
+        to the other hosts instead of uploading everything from local (see `broadcast_file`):
+        - None: upload the files from local to every host
+        - tree: each host that has the files forwards them to `fanout` other hosts
+        - chain: the files are sent through a pipeline chain of hosts
+
+    fanout: int
+        the number of hosts that each host forwards the files to in the `tree` broadcast
 
     """
-    remote_executor = get_remote_executor()
     if isinstance(hosts, str):
         hosts = [hosts]
-    result = list()
-    for chunk in chunk_list(hosts, batch_size):
-        act = None
+    if action == 'put' and broadcast is not None:
+        return broadcast_file(hosts, file_paths, dest_location, method=broadcast,
+                              fanout=fanout, batch_size=batch_size)
+    remote_executor = get_remote_executor()
+    if isinstance(remote_executor, AgentActionFactory) and mode == 'run':
+        # the agents copy regular files, the other copies are done with the file copy tools
+        hosts = remote_executor.copy(hosts, file_paths, dest_location, action)
+        if not hosts:
+            return
+
+    def get_action(chunk):
         if action == 'get':
-            act = remote_executor.get_fileget(chunk, file_paths, dest_location)
+            return remote_executor.get_fileget(chunk, file_paths, dest_location)
         elif action == 'put':
-            act = remote_executor.get_fileput(chunk, file_paths, dest_location)
-        if act:
-            if mode == 'run':
-                result.append(act.run())
-            elif mode == 'start':
-                result.append(act.start())
+            return remote_executor.get_fileput(chunk, file_paths, dest_location)
+    run_chunks(get_action, hosts, batch_size, mode)
+
+
+def _sha256sum(file_path):
+    checksum = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def _verify_checksums(hosts, checksums, batch_size=None):
+    """Return the hosts on which all the remote files match their checksum"""
+    if not hosts:
+        return list()
+    # only directories are sent, there is no file to verify
+    if not checksums:
+        return list(hosts)
+    # a missing file is reported as a mismatch, not as a failed command that is retried
+    cmd = 'sha256sum %s 2>/dev/null; true' % ' '.join(checksums)
+    result = execute_cmd(cmd, hosts, batch_size=batch_size, is_continue=True, retry_failed_hosts=True)
+    if not result or not result[1]:
+        return list()
+    _, r = result
+    ok_hosts = list()
+    for host, host_result in r.report.items():
+        remote_checksums = dict()
+        for line in host_result.stdout.strip().splitlines():
+            elements = line.strip().split()
+            if len(elements) == 2:
+                remote_checksums[elements[1]] = elements[0]
+        if all(remote_checksums.get(path) == checksum for path, checksum in checksums.items()):
+            ok_hosts.append(host)
+        else:
+            logger.warning('Checksum mismatch of the files sent to host %s' % host)
+    return ok_hosts
+
+
+def _forward_cmd(targets, file_paths, dest_location):
+    scp = [default_connection_params['scp'], '-o', 'BatchMode=yes', '-o', 'StrictHostKeyChecking=no', '-rp']
+    if default_connection_params.get('port'):
+        scp += ['-P', str(default_connection_params['port'])]
+    user = default_connection_params.get('user')
+    copies = list()
+    for target in targets:
+        target = '%s@%s' % (user, target) if user else target
+        copies.append('%s %s %s:%s &' % (' '.join(scp), ' '.join(file_paths), target, dest_location))
+    return ' '.join(copies) + ' wait'
+
+
+MAX_BROADCAST_ATTEMPTS = 3
+
+
+def broadcast_file(hosts, file_paths, dest_location, method='tree', fanout=2, batch_size=None):
+    """Send local files to many hosts, the hosts that received the files forward them to the others
+
+    The files are first uploaded from local to `fanout` hosts. Then in each round, every host
+    that has the files sends them to `fanout` other hosts, so our upload bandwidth is used only once.
+    The checksums of the files are verified on every host after each hop, the hosts that
+    fail to receive the files several times get them directly from local.
+    The hosts have to be able to connect to each other with ssh.
+
+    Parameters
+    ----------
+    hosts: list of str
+        list of remote hosts to send files
+
+    file_paths: list of str
+        list of paths to the local files to send to remote hosts
+
+    dest_location: str
+        the path to the destination directory on the remote hosts
+
+    method: str
+        tree: forward the files through a tree of hosts, each host has `fanout` children
+        chain: forward the files through a pipeline chain of hosts (`execo.action.ChainPut`)
+
+    fanout: int
+        the number of children of a host in the tree
+
+    batch_size: int
+        the number of hosts in one chunk of a direct upload from local, adjusted automatically if None
+
+    Returns
+    -------
+    list of str
+        the hosts that failed to receive the files
+    """
+    if isinstance(hosts, str):
+        hosts = [hosts]
+    if isinstance(file_paths, str):
+        file_paths = [file_paths]
+    checksums = dict()
+    remote_paths = list()
+    for file_path in file_paths:
+        remote_path = os.path.join(dest_location, os.path.basename(file_path.rstrip('/')))
+        remote_paths.append(remote_path)
+        if os.path.isfile(file_path):
+            checksums[remote_path] = _sha256sum(file_path)
+
+    if method == 'chain':
+        logger.debug('Sending %s files through a chain of %s hosts' % (len(file_paths), len(hosts)))
+        ChainPut(hosts, file_paths, dest_location).run()
+        holders = _verify_checksums(hosts, checksums, batch_size)
+        pending = [host for host in hosts if host not in holders]
+    elif method == 'tree':
+        fanout = max(1, fanout)
+        holders = list()
+        pending = list(hosts)
+        attempts = dict()
+        remote_executor = get_remote_executor()
+        while pending:
+            # the first round is uploaded from local (source None), then every holder forwards the files
+            transfers = dict()
+            for source in (holders or [None]):
+                if not pending:
+                    break
+                transfers[source] = pending[:fanout]
+                pending = pending[fanout:]
+
+            targets = list()
+            local_targets = transfers.pop(None, None)
+            if local_targets:
+                getput_file(local_targets, file_paths, dest_location, 'put', batch_size=batch_size)
+                targets += local_targets
+            if transfers:
+                cmds = {source: _forward_cmd(source_targets, remote_paths, dest_location)
+                        for source, source_targets in transfers.items()}
+                run_chunks(lambda chunk: remote_executor.get_remote(cmds[chunk[0]], chunk),
+                           list(transfers), 1)
+                for source_targets in transfers.values():
+                    targets += source_targets
+
+            received = _verify_checksums(targets, checksums, batch_size)
+            holders += received
+            for host in targets:
+                if host in received:
+                    continue
+                attempts[host] = attempts.get(host, 0) + 1
+                if attempts[host] < MAX_BROADCAST_ATTEMPTS:
+                    pending.append(host)
+            logger.debug('%s/%s hosts received the files' % (len(holders), len(hosts)))
+        pending = [host for host in hosts if host not in holders]
+    else:
+        raise ValueError('Not support this broadcast method: %s' % method)
+
+    if pending:
+        logger.info('Uploading the files from local to %s hosts which failed to receive them' % len(pending))
+        getput_file(pending, file_paths, dest_location, 'put', batch_size=batch_size)
+        holders += _verify_checksums(pending, checksums, batch_size)
+    failed_hosts = [host for host in hosts if host not in holders]
+    if failed_hosts:
+        logger.error('Cannot send the files to %s hosts:\n%s' % (len(failed_hosts), '\n'.join(failed_hosts)))
+    return failed_hosts
 
 
 def is_ip(ip):
@@ -164,7 +164,8 @@ class elmerfs_g5k(performing_actions_g5k):
         logger.info("Uploading elmerfs binary file from local to %s elmerfs hosts" %
                     len(elmerfs_hosts))
         getput_file(hosts=elmerfs_hosts, file_paths=[
-                    elmerfs_file_path], dest_location='/tmp', action='put')
+                    elmerfs_file_path], dest_location='/tmp', action='put',
+                    broadcast=self.configs['exp_env'].get('elmerfs_broadcast'))
         cmd = "chmod +x /tmp/elmerfs \
                && mkdir -p /tmp/dc-$(hostname)"
         execute_cmd(cmd, elmerfs_hosts)
@@ -9,6 +9,7 @@ from cloudal.utils import get_logger, execute_cmd, getput_file, parse_config_fil
 from cloudal.action import performing_actions
 from cloudal.provisioner import gke_provisioner, gcp_provisioner
 from cloudal.configurator import k8s_resources_configurator, docker_configurator, packages_configurator
+from cloudal.configurator.k8s_resources_configurator import get_k8s_client_registry
 
 from kubernetes import client
 
@@ -210,6 +211,12 @@ class elmerfs_gke(performing_actions):
         kube_config.ssl_ca_cert = ca_cert.name
         kube_config.api_key_prefix['authorization'] = 'Bearer'
         kube_config.api_key['authorization'] = creds.token
+
+        def refresh_token():
+            creds.refresh(google.auth.transport.requests.Request())
+            return creds.token
+        # the k8s client of this cluster is shared by all the calls, its token is refreshed when it expires
+        get_k8s_client_registry().set_token_refresher(kube_config, refresh_token)
         logger.debug('Getting credential for cluster : DONE')
         return kube_config
 
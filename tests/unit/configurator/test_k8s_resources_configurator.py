@@ -0,0 +1,271 @@
+import json
+import importlib
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from kubernetes import client
+
+from cloudal.configurator.k8s_resources_configurator import k8s_resources_configurator, K8sClientRegistry
+
+k8s_module = importlib.import_module('cloudal.configurator.k8s_resources_configurator')
+
+
+def pod(name, ready):
+    condition = SimpleNamespace(type='Ready', status='True' if ready else 'False')
+    return SimpleNamespace(metadata=SimpleNamespace(name=name), status=SimpleNamespace(conditions=[condition]))
+
+
+class FakeWatch(object):
+    """Replay the given events, the watch is stopped by the waiter once all pods are ready"""
+    events = list()
+
+    def __init__(self):
+        self.resource_version = None
+
+    def stream(self, func, **kwargs):
+        self._stop = False
+        for event_type, obj in FakeWatch.events:
+            if self._stop:
+                break
+            self.resource_version = kwargs['resource_version'] + 1
+            FakeWatch.received.append(obj.metadata.name)
+            yield {'type': event_type, 'object': obj}
+
+    def stop(self):
+        self._stop = True
+
+
+@pytest.fixture
+def fake_k8s(monkeypatch):
+    FakeWatch.received = list()
+
+    def list_namespaced_pod(namespace, label_selector, **kwargs):
+        return SimpleNamespace(items=[pod('antidote-0', True), pod('antidote-1', False)],
+                               metadata=SimpleNamespace(resource_version=1))
+    api = SimpleNamespace(list_namespaced_pod=list_namespaced_pod)
+    monkeypatch.setitem(k8s_module.READY_CONDITIONS, 'pod',
+                        (lambda api_client: api,) + k8s_module.READY_CONDITIONS['pod'][1:])
+    monkeypatch.setattr(k8s_module.watch, 'Watch', FakeWatch)
+    monkeypatch.setattr(k8s_module, 'get_k8s_client_registry',
+                        lambda: SimpleNamespace(get_client=lambda kube_config: None))
+
+
+def test_wait_k8s_resources_returns_when_last_pod_is_ready(fake_k8s):
+    FakeWatch.events = [('MODIFIED', pod('antidote-1', True)),
+                        ('ADDED', pod('antidote-2', False)),
+                        ('MODIFIED', pod('antidote-2', True)),
+                        ('MODIFIED', pod('antidote-3', True))]
+    configurator = k8s_resources_configurator()
+    ready_times = configurator.watch_k8s_resources('pod', 'app=antidote', timeout=10, n_expected=3)
+    assert sorted(ready_times) == ['antidote-0', 'antidote-1', 'antidote-2']
+    assert ready_times['antidote-0'] < 1
+    # the last event is not waited for
+    assert FakeWatch.received == ['antidote-1', 'antidote-2', 'antidote-2']
+
+
+def test_wait_k8s_resources_timeout(fake_k8s):
+    FakeWatch.events = [('DELETED', pod('antidote-0', True))]
+    configurator = k8s_resources_configurator()
+    assert not configurator.wait_k8s_resources('pod', 'app=antidote', timeout=1)
+    assert not configurator.wait_k8s_resources('replicaset', 'app=antidote', timeout=1)
+
+
+class FakeApiServer(BaseHTTPRequestHandler):
+    """Accept the requests with the valid token only"""
+    valid_token = 'token-1'
+    connections = set()
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        FakeApiServer.connections.add(self.client_address)
+        if self.headers['authorization'] == 'Bearer %s' % FakeApiServer.valid_token:
+            status, body = 200, {'kind': 'NamespaceList', 'apiVersion': 'v1', 'metadata': {}, 'items': []}
+        else:
+            status, body = 401, {'kind': 'Status', 'code': 401}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeApiServer)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%s' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+def kube_config(host, token):
+    kube_config = client.Configuration()
+    kube_config.host = host
+    kube_config.api_key_prefix['authorization'] = 'Bearer'
+    kube_config.api_key['authorization'] = token
+    return kube_config
+
+
+def test_k8s_client_registry(api_server):
+    FakeApiServer.valid_token = 'token-1'
+    FakeApiServer.connections = set()
+    registry = K8sClientRegistry(pool_size=4)
+    try:
+        api_client = registry.get_client(kube_config(api_server, 'token-1'))
+        for _ in range(3):
+            client.CoreV1Api(registry.get_client(kube_config(api_server, 'token-1'))).list_namespace()
+        assert registry.get_client(kube_config(api_server, 'token-1')) is api_client
+        assert api_client.configuration.connection_pool_maxsize == 4
+        # the connection is kept alive between the requests
+        assert len(FakeApiServer.connections) == 1
+
+        # the rejected token is refreshed and the request is sent again
+        tokens = iter(['token-2', 'token-3'])
+        registry.set_token_refresher(api_client.configuration, lambda: next(tokens))
+        FakeApiServer.valid_token = 'token-2'
+        client.CoreV1Api(api_client).list_namespace()
+        assert api_client.configuration.api_key['authorization'] == 'token-2'
+
+        stats = registry.stats()[api_server]
+        assert (stats['requests'], stats['errors']) == (4, 0)
+        assert 0 < stats['mean_time'] <= stats['max_time']
+    finally:
+        registry.close()
+
+
+def labeled_pod(name, **labels):
+    return SimpleNamespace(metadata=SimpleNamespace(name=name, namespace='default', labels=labels))
+
+
+class BlockingWatch(object):
+    """Send the queued events, then wait until the watch is stopped"""
+    def __init__(self, events):
+        self.events = events
+        self.stopped = threading.Event()
+        self.resource_version = None
+
+    def __call__(self):
+        return self
+
+    def stream(self, func, **kwargs):
+        while self.events:
+            self.resource_version = kwargs['resource_version'] + 1
+            yield self.events.pop(0)
+        self.stopped.wait(5)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def test_k8s_informer(monkeypatch):
+    n_lists = list()
+
+    def list_resources(**kwargs):
+        n_lists.append(kwargs)
+        return SimpleNamespace(items=[labeled_pod('antidote-0', app='antidote', cluster='a'),
+                                      labeled_pod('fmke-0', app='fmke')],
+                               metadata=SimpleNamespace(resource_version=1))
+    watcher = BlockingWatch([{'type': 'ADDED', 'object': labeled_pod('antidote-1', app='antidote', cluster='b')},
+                             {'type': 'DELETED', 'object': labeled_pod('fmke-0', app='fmke')}])
+    monkeypatch.setattr(k8s_module.watch, 'Watch', watcher)
+    informer = k8s_module.K8sInformer(list_resources, 'pod default')
+    informer.start()
+    try:
+        # the deletion is the last event
+        for _ in range(100):
+            if informer.synced.is_set() and ('default', 'fmke-0') not in informer.objects:
+                break
+            threading.Event().wait(0.01)
+
+        def names(selectors):
+            return [r.metadata.name for r in informer.list(selectors)]
+        assert names('app=antidote') == ['antidote-0', 'antidote-1']
+        assert names('app=antidote,cluster!=a') == ['antidote-1']
+        assert names('cluster') == ['antidote-0', 'antidote-1']
+        assert names('app==fmke') == []
+        assert informer.list('app in (antidote)') is None
+        assert informer.get('antidote-1', 'default').metadata.labels['cluster'] == 'b'
+        # the queries are answered without listing the resources again
+        assert len(n_lists) == 1
+    finally:
+        informer.stop()
+
+
+def manifest(kind, name, namespace=None):
+    metadata = {'name': name}
+    if namespace:
+        metadata['namespace'] = namespace
+    return {'apiVersion': 'v1', 'kind': kind, 'metadata': metadata}
+
+
+class FakeDynamicClient(object):
+    """Record the applied objects, the objects named 'broken' are rejected"""
+    def __init__(self):
+        self.applied = list()
+        self.resources = SimpleNamespace(get=lambda api_version, kind: kind)
+
+    def server_side_apply(self, resource, body, namespace, field_manager, force_conflicts):
+        if body['metadata']['name'] == 'broken':
+            raise ValueError('rejected')
+        self.applied.append((resource, body['metadata']['name'], namespace))
+
+
+def test_apply_k8s_resources(monkeypatch):
+    manifests = [manifest('StatefulSet', 'antidote'),
+                 manifest('Service', 'antidote'),
+                 manifest('Job', 'createdc', namespace='other'),
+                 manifest('ConfigMap', 'broken', namespace='other'),
+                 manifest('ConfigMap', 'config'),
+                 manifest('Namespace', 'antidote-ns')]
+    dependencies = k8s_module.get_apply_dependencies(manifests, namespace='antidote-ns')
+    assert dependencies == [{1, 4, 5}, {4, 5}, {3, 5}, {5}, {5}, set()]
+
+    dynamic_client = FakeDynamicClient()
+    monkeypatch.setattr(k8s_module, 'get_k8s_client_registry',
+                        lambda: SimpleNamespace(get_dynamic_client=lambda kube_config: dynamic_client))
+    configurator = k8s_resources_configurator()
+    failed = configurator.apply_k8s_resources(manifests, namespace='antidote-ns')
+    assert failed == ['Job/createdc', 'ConfigMap/broken']
+    assert dynamic_client.applied == [('Namespace', 'antidote-ns', 'antidote-ns'),
+                                      ('ConfigMap', 'config', 'antidote-ns'),
+                                      ('Service', 'antidote', 'antidote-ns'),
+                                      ('StatefulSet', 'antidote', 'antidote-ns')]
+
+
+def test_load_manifests(tmp_path):
+    path = tmp_path / 'antidote.yaml'
+    path.write_text('kind: Service\nmetadata: {name: a}\n---\n'
+                    'kind: List\nitems:\n- {kind: ConfigMap, metadata: {name: b}}\n---\n')
+    assert [m['metadata']['name'] for m in k8s_module.load_manifests([str(path)])] == ['a', 'b']
+
+
+def test_manifest_renderer(tmp_path, monkeypatch):
+    template = tmp_path / 'statefulSet.yaml.template'
+    template.write_text('kind: StatefulSet\nmetadata: {name: antidote}\nspec: {nodeName: node_hostname}\n')
+    n_parses = list()
+    safe_load_all = k8s_module.yaml.safe_load_all
+    monkeypatch.setattr(k8s_module.yaml, 'safe_load_all', lambda text: n_parses.append(1) or safe_load_all(text))
+
+    renderer = k8s_module.ManifestRenderer(dump_dir=str(tmp_path / 'dump'))
+    docs = list()
+    for cluster in ['nantes', 'rennes']:
+        doc = renderer.load(str(template))
+        doc['metadata']['name'] = 'antidote-%s' % cluster
+        docs.append(doc)
+    assert [doc['metadata']['name'] for doc in docs] == ['antidote-nantes', 'antidote-rennes']
+    assert len(n_parses) == 1
+
+    rendered = renderer.render_text(str(template), {'node_hostname': 'econome-1'})
+    assert rendered[0]['spec'] == {'nodeName': 'econome-1'}
+
+    renderer.dump('statefulSet_antidote', docs)
+    assert 'antidote-rennes' in (tmp_path / 'dump' / 'statefulSet_antidote.yaml').read_text()
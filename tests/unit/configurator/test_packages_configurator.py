@@ -0,0 +1,100 @@
+import os
+import importlib
+import subprocess
+
+import pytest
+
+from cloudal.configurator.packages_configurator import packages_configurator
+from cloudal.configurator.kubernetes_configurator import kubernetes_configurator
+from cloudal.utils import _is_retryable, ExecuteCommandException
+from tests.unit.fakes import FakeProcess, FakeResult
+
+packages_module = importlib.import_module('cloudal.configurator.packages_configurator')
+kubernetes_module = importlib.import_module('cloudal.configurator.kubernetes_configurator')
+
+
+FAKE_DPKG_QUERY = """#!/bin/bash
+# print the installed packages of the host, and fail if one of the queried packages is missing
+status=0
+for package in "${@:3}"; do
+    line=$(echo "$INSTALLED" | grep "^$package ")
+    if [ -n "$line" ]; then echo "$line"; else echo "dpkg-query: no packages found matching $package" >&2; status=1; fi
+done
+exit $status
+"""
+
+
+@pytest.fixture
+def fake_hosts(monkeypatch, tmp_path):
+    """The installed packages of each fake host and the install commands sent to them"""
+    installed = {'host-1': 'curl 7.88.1-10 installed\nwget 1.21.3-1 installed',
+                 'host-2': 'curl 7.88.1-10 installed',
+                 'host-3': 'curl 7.74.0-1 installed\nwget 1.21.3-1 installed'}
+    boot_ids = {host: 'boot-1' for host in installed}
+    install_cmds = dict()
+    (tmp_path / 'dpkg-query').write_text(FAKE_DPKG_QUERY)
+    (tmp_path / 'dpkg-query').chmod(0o755)
+
+    def _execute_cmd(cmd, hosts, **kwargs):
+        processes = list()
+        for host in hosts:
+            env = dict(os.environ, PATH='%s:%s' % (tmp_path, os.environ['PATH']), INSTALLED=installed[host])
+            output = subprocess.run(['bash', '-c', cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+            process = FakeProcess(host, output.stdout.decode(), ok=output.returncode == 0)
+            # as execute_cmd, a failed process with an output is retried and fails
+            if _is_retryable(process):
+                raise ExecuteCommandException(message=cmd)
+            processes.append(process)
+        return [], FakeResult(processes)
+
+    def _execute_cmd_per_host(cmd_template, host_vars, **kwargs):
+        install_cmds.update({host: cmd_template % variables for host, variables in host_vars.items()})
+        return [], FakeResult([FakeProcess(host) for host in host_vars])
+
+    monkeypatch.setattr(packages_module, 'execute_cmd', _execute_cmd)
+    monkeypatch.setattr(packages_module, 'execute_cmd_per_host', _execute_cmd_per_host)
+    monkeypatch.setattr(packages_module, 'gather_facts',
+                        lambda hosts: {host: {'boot_id': boot_ids[host], 'os': 'debian'} for host in hosts})
+    monkeypatch.setattr(packages_module, 'refreshed_hosts', set())
+    return install_cmds, boot_ids
+
+
+def test_install_packages_with_apt_skips_installed_packages(fake_hosts):
+    install_cmds, boot_ids = fake_hosts
+    configurator = packages_configurator()
+    configurator.install_packages_with_apt(['curl=7.88.1-10', 'wget'], ['host-1', 'host-2', 'host-3'])
+    assert sorted(install_cmds) == ['host-2', 'host-3']
+    assert install_cmds['host-2'].endswith('apt-get install -q -y --allow-change-held-packages wget')
+    assert install_cmds['host-3'].endswith('apt-get install -q -y --allow-change-held-packages curl=7.88.1-10')
+    assert all('apt-get update' in cmd for cmd in install_cmds.values())
+
+    # the package index of a host is only refreshed once per session
+    install_cmds.clear()
+    configurator.install_packages_with_apt(['htop'], ['host-1', 'host-2'])
+    assert 'apt-get update' in install_cmds['host-1']
+    assert 'apt-get update' not in install_cmds['host-2']
+
+    # and again after the OS of the host is deployed again
+    install_cmds.clear()
+    boot_ids['host-2'] = 'boot-2'
+    configurator.install_packages_with_apt(['htop'], ['host-2'])
+    assert 'apt-get update' in install_cmds['host-2']
+
+
+def test_install_kubeadm_refreshes_new_repository(fake_hosts, monkeypatch):
+    install_cmds, _ = fake_hosts
+
+    class FakeBatch(object):
+        def __init__(self, hosts, stop_on_failure=True):
+            pass
+
+        def add(self, cmd):
+            return self
+
+        def run(self):
+            return dict()
+    monkeypatch.setattr(kubernetes_module, 'CommandBatch', FakeBatch)
+    kubernetes_configurator(['host-2'])._install_kubeadm()
+    # the index is refreshed again after the kubernetes repository is added
+    assert install_cmds['host-2'].endswith('kubelet kubeadm kubectl')
+    assert 'apt-get update' in install_cmds['host-2']
@@ -0,0 +1,15 @@
+import pytest
+import tenacity
+
+import cloudal.utils
+from tests.unit.fakes import FakeExecutor
+
+
+@pytest.fixture
+def fake_executor(monkeypatch):
+    def _make(flaky, **kwargs):
+        executor = FakeExecutor(flaky, **kwargs)
+        monkeypatch.setattr(cloudal.utils, 'get_remote_executor', lambda *args, **kwargs: executor)
+        monkeypatch.setattr(tenacity.nap.time, 'sleep', lambda seconds: None)
+        return executor
+    return _make
@@ -1,9 +1,12 @@
 import os 
+import subprocess
 
 import pytest
 
-from cloudal.experimenter import define_parameters
+import cloudal.experimenter.experimenter as experimenter
+from cloudal.experimenter import define_parameters, collect_results
 from cloudal.utils import parse_config_file
+from tests.unit.fakes import FakeProcess, FakeResult, FakeExecutor
 
 @pytest.mark.parametrize('parameters', [
     None,
@@ -25,3 +28,24 @@ def test_define_parameters():
     assert actual['iteration'] == range(1,5)
     assert actual['duration'] == [10]
     assert actual['workloads'] == ['write']
+
+
+def test_collect_results(tmp_path, monkeypatch):
+    remote_dir = tmp_path / 'remote'
+    (remote_dir / 'results').mkdir(parents=True)
+    (remote_dir / 'results' / 'filebench_host').write_text('IO Summary')
+    (remote_dir / 'elmer.log').write_text('log')
+    comb_dir = tmp_path / 'comb'
+    comb_dir.mkdir()
+
+    def _execute_cmd(cmd, hosts, **kwargs):
+        output = subprocess.run(['bash', '-c', cmd], stdout=subprocess.PIPE)
+        return [], FakeResult([FakeProcess(host, stdout=output.stdout.decode()) for host in hosts])
+    monkeypatch.setattr(experimenter, 'REMOTE_RESULT_ARCHIVE', str(tmp_path / 'archive.tar'))
+    monkeypatch.setattr(experimenter, 'execute_cmd', _execute_cmd)
+    monkeypatch.setattr(experimenter, 'get_remote_executor', FakeExecutor)
+
+    stats = collect_results(['host-1'], ['%s/results/*' % remote_dir, '%s/*.log' % remote_dir], str(comb_dir))
+    assert sorted(os.listdir(str(comb_dir))) == ['elmer.log', 'filebench_host']
+    assert stats['host-1']['bytes'] > 0
+    assert stats['host-1']['seconds'] == 2.0
@@ -0,0 +1,74 @@
+"""Fake hosts, processes and executors shared by the unit tests"""
+import os
+import shutil
+
+from cloudal.utils import build_report
+
+
+class FakeHost(object):
+    def __init__(self, address):
+        self.address = address
+
+
+class FakeProcess(object):
+    def __init__(self, host, stdout='', stderr='', ok=True):
+        self.host = FakeHost(host)
+        self.stdout = stdout
+        self.stderr = stderr
+        self.ok = ok
+        self.exit_code = 0 if ok else 255
+        self.error_reason = None
+        self.start_date = 100.0
+        self.end_date = 101.0
+
+
+class FakeResult(object):
+    def __init__(self, processes):
+        self.processes = processes
+        self.report = build_report(processes)
+
+
+class FakeRemote(object):
+    def __init__(self, cmd, hosts, calls, flaky, error):
+        self.cmd = cmd
+        self.hosts = hosts
+        self.calls = calls
+        self.flaky = flaky
+        self.error = error
+
+    def run(self):
+        self.processes = list()
+        for host in self.hosts:
+            self.calls.append(host)
+            if self.flaky.get(host, 0) > 0:
+                self.flaky[host] -= 1
+                self.processes.append(FakeProcess(host, stderr=self.error, ok=False))
+            else:
+                self.processes.append(FakeProcess(host, stdout='done on %s' % host))
+        return self
+
+
+class FakeGet(object):
+    """Copy the "remote" files from the local machine"""
+    def __init__(self, hosts, files, dest):
+        self.hosts, self.files, self.dest = hosts, files, dest
+
+    def run(self):
+        for f in self.files:
+            if os.path.exists(f):
+                shutil.copy(f, self.dest)
+        self.processes = [FakeProcess(self.hosts[0])]
+        return self
+
+
+class FakeExecutor(object):
+    def __init__(self, flaky=None, error='ssh: Connection timed out'):
+        self.calls = list()
+        self.flaky = flaky or dict()
+        self.error = error
+
+    def get_remote(self, cmd, hosts, **kwargs):
+        return FakeRemote(cmd, hosts, self.calls, self.flaky, self.error)
+
+    def get_fileget(self, hosts, files, dest):
+        return FakeGet(hosts, files, dest)
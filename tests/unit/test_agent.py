@@ -0,0 +1,103 @@
+import sys
+from concurrent.futures import wait
+
+import pytest
+
+import cloudal.utils
+from cloudal import agent
+from cloudal.agent import AgentConnection, AgentError
+from cloudal.utils import (AgentActionFactory, ConnectionBudget, execute_cmd, getput_file, host_health_singleton,
+                           HostHealthRegistry)
+
+
+def loopback(host):
+    """Start the agent on the local machine instead of through ssh"""
+    return [sys.executable, agent.__file__]
+
+
+@pytest.fixture
+def connection():
+    connection = AgentConnection(loopback('localhost'))
+    yield connection
+    connection.close()
+
+
+def test_agent_run(connection):
+    response = connection.run('echo out; echo err >&2; exit 3')
+    assert (response['exit_code'], response['stdout'], response['stderr']) == (3, 'out\n', 'err\n')
+
+    lines = list()
+    response = connection.run('for i in 1 2 3; do echo line $i; done', on_stream=lines.append)
+    assert lines == ['line 1\n', 'line 2\n', 'line 3\n']
+    assert response['stdout'] == ''.join(lines)
+
+
+def test_agent_multiplexes_requests(connection):
+    futures = [connection.request('run', cmd='sleep 0.2; echo %s' % i) for i in range(50)]
+    done, not_done = wait(futures, timeout=10)
+    assert not not_done
+    assert [future.result()['stdout'] for future in futures] == ['%s\n' % i for i in range(50)]
+
+
+def test_agent_files(connection, tmp_path):
+    local_file = tmp_path / 'binary'
+    local_file.write_bytes(b'\x00elmerfs')
+    local_file.chmod(0o755)
+    connection.put(str(local_file), str(tmp_path / 'remote' / 'binary'))
+    assert (tmp_path / 'remote' / 'binary').read_bytes() == b'\x00elmerfs'
+    connection.get(str(tmp_path / 'remote' / 'binary'), str(tmp_path / 'copy'))
+    assert (tmp_path / 'copy').stat().st_mode & 0o777 == 0o755
+    with pytest.raises(AgentError):
+        connection.get(str(tmp_path / 'missing'), str(tmp_path / 'copy'))
+
+
+def test_agent_connection_error():
+    connection = AgentConnection([sys.executable, '-c', 'import sys; sys.exit("Connection refused")'])
+    with pytest.raises(AgentError, match='Connection refused'):
+        connection.run('hostname', timeout=10)
+
+
+def test_agent_action_factory(monkeypatch, tmp_path):
+    host_health_singleton[:] = [HostHealthRegistry()]
+    executor = AgentActionFactory(connect_cmd=loopback)
+    monkeypatch.setattr(cloudal.utils, 'get_remote_executor', lambda *args, **kwargs: executor)
+    try:
+        hosts = ['host-1', 'host-2']
+        host_errors, result = execute_cmd('echo hello', hosts)
+        assert host_errors == []
+        assert result.report.stdout() == {'host-1': 'hello', 'host-2': 'hello'}
+        # the following commands reuse the same agents
+        agents = dict(executor.agents)
+        execute_cmd('true', hosts)
+        assert executor.agents == agents
+
+        local_file = tmp_path / 'config.toml'
+        local_file.write_text('node_id = 0')
+        getput_file(hosts, [str(local_file)], str(tmp_path / 'remote'), 'put')
+        assert (tmp_path / 'remote' / 'config.toml').read_text() == 'node_id = 0'
+    finally:
+        executor.close()
+        del host_health_singleton[:]
+
+
+def test_agent_action_factory_budget_and_timeout(monkeypatch):
+    budget = ConnectionBudget(2)
+    monkeypatch.setattr(cloudal.utils, 'get_connection_budget', lambda *args: budget)
+    in_use = list()
+
+    def _connect_cmd(host):
+        in_use.append(budget.in_use)
+        return ['env', 'HOST=%s' % host, sys.executable, agent.__file__]
+    executor = AgentActionFactory(connect_cmd=_connect_cmd, cmd_timeout=1)
+    try:
+        hosts = ['host-%s' % i for i in range(6)]
+        action = executor.run('if [ $HOST = host-1 ]; then sleep 5; fi; echo $HOST', hosts)
+        # the agents are started with at most 2 ssh sessions at once
+        assert len(in_use) == 6 and max(in_use) <= 2
+        assert budget.in_use == 0
+        processes = {process.host.address: process for process in action.processes}
+        assert processes['host-1'].error_reason == 'agent timed out'
+        assert cloudal.utils._is_connection_error(processes['host-1'])
+        assert processes['host-0'].stdout == 'host-0\n'
+    finally:
+        executor.close()
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('asyncssh')
+
+import cloudal.async_utils as async_utils
+from cloudal.async_utils import async_execute_cmd, get_async_executor, AsyncRemoteExecutor
+from cloudal.utils import get_remote_executor, ASYNCSSH, ConnectionBudget
+
+
+class FakeCompletedProcess(object):
+    def __init__(self, stdout, exit_status):
+        self.stdout = stdout
+        self.stderr = ''
+        self.exit_status = exit_status
+
+
+class FakeConnection(object):
+    def __init__(self, host, tracker):
+        self.host = host
+        self.tracker = tracker
+
+    async def run(self, cmd, check=False):
+        self.tracker['running'] += 1
+        self.tracker['peak'] = max(self.tracker['peak'], self.tracker['running'])
+        await asyncio.sleep(0.01)
+        self.tracker['running'] -= 1
+        return FakeCompletedProcess('%s on %s' % (cmd, self.host), 0)
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    tracker = {'running': 0, 'peak': 0, 'connects': 0}
+
+    async def _connect(host, **kwargs):
+        tracker['connects'] += 1
+        return FakeConnection(host, tracker)
+    monkeypatch.setattr(async_utils.asyncssh, 'connect', _connect)
+    budget = ConnectionBudget(4)
+    monkeypatch.setattr(async_utils, 'get_connection_budget', lambda *args: budget)
+    executor = AsyncRemoteExecutor()
+    executor.budget = budget
+    executor.tracker = tracker
+    async_utils.async_executor_singleton[:] = [executor]
+    yield executor
+    del async_utils.async_executor_singleton[:]
+
+
+def test_get_remote_executor_asyncssh(executor):
+    assert get_remote_executor(remote_tool=ASYNCSSH) is executor
+
+
+def test_async_execute_cmd(executor):
+    hosts = ['host-%s' % i for i in range(20)]
+
+    async def _main():
+        await async_execute_cmd('hostname', hosts)
+        return await async_execute_cmd('uptime', hosts)
+    host_errors, report = asyncio.run(_main())
+    assert host_errors == []
+    assert list(report) == hosts
+    assert report['host-3'].stdout == 'uptime on host-3'
+    assert executor.tracker['peak'] == 4
+    # the connections are reused between commands
+    assert executor.tracker['connects'] == 20
+
+
+def test_async_execute_cmd_batches_and_event_loops(executor):
+    hosts = ['host-%s' % i for i in range(6)]
+    # the batches are run concurrently, a batch takes one connection per host at once,
+    # so only one batch of 3 hosts fits in the budget of 4 connections
+    host_errors, report = asyncio.run(async_execute_cmd('hostname', hosts, batch_size=3))
+    assert list(report) == hosts
+    assert executor.tracker['peak'] == 3
+    assert executor.budget.in_use == 0
+
+    # the executor is used again in a new event loop
+    host_errors, report = asyncio.run(async_execute_cmd('uptime', hosts))
+    assert host_errors == []
+    assert get_async_executor() is executor
+    assert executor.tracker['connects'] == 12
+
+
+def test_async_execute_cmd_shares_connection_budget(executor):
+    # the connections taken by the synchronous callers are not available to the async executor
+    executor.budget.acquire(3)
+    host_errors, report = asyncio.run(async_execute_cmd('hostname', ['host-%s' % i for i in range(5)]))
+    assert host_errors == []
+    assert executor.tracker['peak'] == 1
+    assert executor.budget.in_use == 3
@@ -1,8 +1,21 @@
 from operator import ipow
 import os
+import subprocess
+import threading
+import time
 import pytest
 
-from cloudal.utils import parse_config_file, is_ip
+import cloudal.utils
+from cloudal.utils import (parse_config_file, is_ip, run_chunks, ConnectionBudget, connection_budget_singleton,
+                           execute_cmd, build_report, SshConnectionPool, CommandBatch,
+                           broadcast_file, BatchSizeController, batch_size_controller_singleton,
+                           HybridActionFactory, execute_cmd_per_host, RemoteJob,
+                           HostHealthRegistry, host_health_singleton, RelayActionFactory,
+                           ensure_cmd, StreamingOutputHandler, RemoteLogTailer,
+                           FactCache, fact_cache_singleton, gather_facts)
+from execo.action import Remote
+from execo.config import default_connection_params
+from tests.unit.fakes import FakeHost, FakeProcess, FakeResult, FakeExecutor
 
 @pytest.mark.parametrize('file_path, message', [
     (None, 'Please enter the configuration file path'),
@@ -46,4 +59,517 @@ def test_is_ip_wrong_input(ip):
 ])
 def test_is_ip(ip):
     actual = is_ip(ip)
-    assert actual == True
\ No newline at end of file
+    assert actual == True
+
+
+@pytest.fixture(autouse=True)
+def batch_size_controller():
+    """Do not save the learned batch size of the tests"""
+    batch_size_controller_singleton[:] = [BatchSizeController(state_file=None, origin='test')]
+    yield batch_size_controller_singleton[0]
+    del batch_size_controller_singleton[:]
+
+
+@pytest.fixture(autouse=True)
+def host_health():
+    host_health_singleton[:] = [HostHealthRegistry(max_failures=2, probe_delay=10)]
+    yield host_health_singleton[0]
+    del host_health_singleton[:]
+
+
+class FakeAction(object):
+    def __init__(self, chunk, tracker):
+        self.chunk = chunk
+        self.tracker = tracker
+
+    def run(self):
+        with self.tracker['lock']:
+            self.tracker['in_use'] += len(self.chunk)
+            self.tracker['peak'] = max(self.tracker['peak'], self.tracker['in_use'])
+        time.sleep(0.05)
+        with self.tracker['lock']:
+            self.tracker['in_use'] -= len(self.chunk)
+        return self
+
+
+@pytest.fixture
+def budget():
+    connection_budget_singleton[:] = [ConnectionBudget(6)]
+    yield connection_budget_singleton[0]
+    del connection_budget_singleton[:]
+
+
+def test_run_chunks_respects_connection_budget(budget):
+    tracker = {'lock': threading.Lock(), 'in_use': 0, 'peak': 0}
+    hosts = ['host-%s' % i for i in range(20)]
+    actions = run_chunks(lambda chunk: FakeAction(chunk, tracker), hosts, 3)
+    assert [h for a in actions for h in a.chunk] == hosts
+    assert 3 < tracker['peak'] <= 6
+    assert budget.in_use == 0
+
+
+def test_connection_budget_clamps_large_chunks():
+    budget = ConnectionBudget(4)
+    assert budget.acquire(10) == 4
+    budget.release(4)
+    assert budget.in_use == 0
+
+
+def test_execute_cmd_retry_failed_hosts(fake_executor):
+    executor = fake_executor({'host-2': 2})
+    hosts = ['host-%s' % i for i in range(4)]
+    host_errors, result = execute_cmd('hostname', hosts, retry_failed_hosts=True)
+    assert host_errors == []
+    assert sorted(executor.calls) == sorted(hosts + ['host-2', 'host-2'])
+    assert [p.host.address for p in result.processes] == hosts
+    assert all(p.ok for p in result.processes)
+    assert result.report['host-2'].stdout == 'done on host-2'
+
+
+def test_execute_cmd_retry_transient_error(fake_executor):
+    executor = fake_executor({'host-1': 1}, error='ssh_exchange_identification: read: Connection reset by peer')
+    hosts = ['host-%s' % i for i in range(3)]
+    host_errors, result = execute_cmd('hostname', hosts, is_continue=True)
+    assert host_errors == []
+    # the default path runs the command again on all hosts
+    assert sorted(executor.calls) == sorted(hosts * 2)
+    assert all(p.ok for p in result.processes)
+
+
+def test_build_report():
+    processes = [FakeProcess('a', stdout=' x \n'), FakeProcess('b', ok=False), FakeProcess('c')]
+    processes[2].end_date = 110.0
+    report = build_report(processes)
+    assert list(report) == ['a', 'b', 'c']
+    assert report.ok_hosts == ['a', 'c']
+    assert report.failed_hosts == ['b']
+    assert report.stdout()['a'] == 'x'
+    assert report['a'].duration == 1.0
+    assert [r.host for r in report.slowest(1)] == ['c']
+    with pytest.raises(AttributeError):
+        report['a'].extra = 1
+
+
+def test_ssh_connection_pool_options(tmp_path):
+    pool = SshConnectionPool(socket_dir=str(tmp_path / 'sockets'), idle_timeout=60)
+    ssh_options = default_connection_params['ssh_options']
+    pool.enable()
+    assert 'ControlMaster=auto' in default_connection_params['ssh_options']
+    assert 'ControlPersist=60' in default_connection_params['scp_options']
+    pool.close()
+    assert default_connection_params['ssh_options'] == ssh_options
+    assert not os.path.exists(pool.socket_dir)
+
+
+def test_ssh_connection_pool_evict_idle(tmp_path, monkeypatch):
+    pool = SshConnectionPool(socket_dir=str(tmp_path), idle_timeout=60)
+    closed = list()
+    monkeypatch.setattr(pool, 'close_connections', closed.extend)
+    pool.touch(['busy'])
+    pool.last_used['idle'] = time.time() - 120
+    assert pool.evict_idle() == ['idle']
+    assert closed == ['idle']
+
+
+@pytest.fixture
+def local_execute_cmd(monkeypatch):
+    """Run the commands given to execute_cmd on the local machine, once per host"""
+    def _execute_cmd(cmd, hosts, **kwargs):
+        processes = list()
+        for host in hosts:
+            output = subprocess.run(['bash', '-c', cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            process = FakeProcess(host, stdout=output.stdout.decode(), stderr=output.stderr.decode(),
+                                  ok=output.returncode == 0)
+            processes.append(process)
+        return [], FakeResult(processes)
+    monkeypatch.setattr(cloudal.utils, 'execute_cmd', _execute_cmd)
+
+
+@pytest.mark.parametrize('stop_on_failure, exit_codes', [
+    (True, [0, 3]),
+    (False, [0, 3, 0]),
+])
+def test_command_batch(local_execute_cmd, stop_on_failure, exit_codes):
+    batch = CommandBatch(['a', 'b'], stop_on_failure=stop_on_failure)
+    batch.add('echo "first step"').add('echo -n no newline; exit 3').add('cd /tmp && pwd')
+    results = batch.run()
+    assert sorted(results) == ['a', 'b']
+    assert results['a'].exit_codes == exit_codes
+    assert results['a'].failed_step == 1
+    assert not results['b'].ok
+
+
+def test_broadcast_file_tree(tmp_path, monkeypatch):
+    local_file = tmp_path / 'binary'
+    local_file.write_bytes(b'elmerfs')
+    uploads, forwards = list(), list()
+    failures = {'host-5': 1}
+
+    def _verify_checksums(hosts, checksums, batch_size=5):
+        assert list(checksums) == ['/tmp/binary']
+        ok_hosts = list()
+        for host in hosts:
+            if failures.get(host, 0) > 0:
+                failures[host] -= 1
+            else:
+                ok_hosts.append(host)
+        return ok_hosts
+
+    class _Executor(object):
+        def get_remote(self, cmd, hosts):
+            forwards.append((hosts[0], cmd))
+    monkeypatch.setattr(cloudal.utils, '_verify_checksums', _verify_checksums)
+    monkeypatch.setattr(cloudal.utils, 'getput_file', lambda hosts, *args, **kwargs: uploads.extend(hosts))
+    monkeypatch.setattr(cloudal.utils, 'get_remote_executor', lambda: _Executor())
+    monkeypatch.setattr(cloudal.utils, 'run_chunks',
+                        lambda get_action, hosts, batch_size: [get_action([host]) for host in hosts])
+
+    hosts = ['host-%s' % i for i in range(10)]
+    assert broadcast_file(hosts, [str(local_file)], '/tmp', fanout=2) == []
+    assert uploads == ['host-0', 'host-1']
+    source, cmd = forwards[0]
+    assert source == 'host-0' and 'host-2:/tmp' in cmd and 'host-3:/tmp' in cmd
+    # host-5 fails the checksum once and is sent again
+    assert sum(cmd.count('scp') for _, cmd in forwards) == 9
+
+
+def test_verify_checksums_directories_only(monkeypatch):
+    def _execute_cmd(cmd, hosts, **kwargs):
+        raise AssertionError('sha256sum without files waits for stdin')
+    monkeypatch.setattr(cloudal.utils, 'execute_cmd', _execute_cmd)
+    assert cloudal.utils._verify_checksums(['host-1', 'host-2'], dict()) == ['host-1', 'host-2']
+
+
+class DirRemote(object):
+    """Run the command in the directory of each host on the local machine"""
+    def __init__(self, cmd, hosts, root):
+        self.cmd = cmd
+        self.hosts = hosts
+        self.root = root
+
+    def run(self):
+        self.processes = list()
+        for host in self.hosts:
+            output = subprocess.run(['bash', '-c', self.cmd], cwd=str(self.root / host),
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.processes.append(FakeProcess(host, stdout=output.stdout.decode(), stderr=output.stderr.decode(),
+                                              ok=output.returncode == 0))
+        return self
+
+
+def test_verify_checksums_missing_file(fake_executor, tmp_path):
+    executor = fake_executor({})
+    executor.get_remote = lambda cmd, hosts, **kwargs: DirRemote(cmd, hosts, tmp_path)
+    checksums = dict()
+    for host in ['host-1', 'host-2']:
+        (tmp_path / host).mkdir()
+        (tmp_path / host / 'elmerfs').write_bytes(b'elmerfs')
+        checksums['elmerfs'] = cloudal.utils._sha256sum(str(tmp_path / host / 'elmerfs'))
+    (tmp_path / 'host-1' / 'Elmerfs.toml').write_text('node_id = 0')
+    checksums['Elmerfs.toml'] = cloudal.utils._sha256sum(str(tmp_path / 'host-1' / 'Elmerfs.toml'))
+    assert cloudal.utils._verify_checksums(['host-1', 'host-2'], checksums) == ['host-1']
+
+
+def test_batch_size_controller_aimd(tmp_path):
+    state_file = str(tmp_path / 'batch_size.json')
+    controller = BatchSizeController(initial_size=5, max_size=8, state_file=state_file, origin='laptop')
+    assert controller.update(1.0, 1.0, False) == 6
+    # latency is not flat: keep the batch size
+    assert controller.update(3.0, 1.0, False) == 6
+    assert controller.update(1.0, 1.0, True) == 3
+    for i in range(10):
+        controller.update(1.0, 1.0, False)
+    assert controller.batch_size == 8
+    controller.save()
+    assert BatchSizeController(state_file=state_file, origin='laptop').batch_size == 8
+    assert BatchSizeController(state_file=state_file, origin='frontend').batch_size == 5
+
+    # concurrent saves keep a valid state file, and an unchanged batch size is not saved again
+    threads = [threading.Thread(target=BatchSizeController(initial_size=i + 1, state_file=state_file,
+                                                           origin='origin-%s' % i).save) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert BatchSizeController(state_file=state_file, origin='laptop').batch_size == 8
+    os.remove(state_file)
+    controller.save()
+    assert not os.path.exists(state_file)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_run_chunks_adaptive_batch_size(budget, batch_size_controller):
+    tracker = {'lock': threading.Lock(), 'in_use': 0, 'peak': 0}
+    hosts = ['host-%s' % i for i in range(30)]
+    actions = run_chunks(lambda chunk: FakeAction(chunk, tracker), hosts, None)
+    assert [h for a in actions for h in a.chunk] == hosts
+    assert len(actions[0].chunk) == 5
+    assert batch_size_controller.batch_size > 5
+
+
+def test_hybrid_action_factory(monkeypatch):
+    class FakeTaktukRemote(object):
+        def __init__(self, cmd, hosts):
+            self.hosts = hosts
+    monkeypatch.setattr(cloudal.utils, 'TaktukRemote', FakeTaktukRemote)
+    executor = HybridActionFactory(taktuk_threshold=3)
+    assert isinstance(executor.get_remote('hostname', ['a', 'b', 'c']), Remote)
+    assert isinstance(executor.get_remote('hostname', ['a', 'b', 'c', 'd']), FakeTaktukRemote)
+    executor.record(executor.get_strategy(['a']), 1, 1.0)
+    executor.record(executor.get_strategy(['a']), 1, 2.0)
+    executor.record(executor.get_strategy(['a', 'b', 'c', 'd']), 4, 3.0)
+    assert executor.summary() == {('ssh', 1): 1.5, ('taktuk', 4): 3.0}
+
+
+def test_execute_cmd_per_host(fake_executor):
+    executor = fake_executor({})
+    cmds = list()
+    get_remote = executor.get_remote
+    executor.get_remote = lambda cmd, hosts: cmds.append((cmd, hosts)) or get_remote(cmd, hosts)
+    host_vars = {'host-%s' % i: {'node_id': i, 'uid': 10 + i} for i in range(3)}
+    host_errors, result = execute_cmd_per_host('run --node-id=%(node_id)s --uid=%(uid)s', host_vars)
+    assert host_errors == []
+    assert sorted(cmds) == [('run --node-id=%s --uid=%s' % (i, 10 + i), ['host-%s' % i]) for i in range(3)]
+    assert list(result.report) == list(host_vars)
+
+
+def test_remote_job(local_execute_cmd, tmp_path):
+    job = RemoteJob('sleep 0.5; exit 4', ['a'], job_dir=str(tmp_path))
+    assert job.start() == []
+    assert job.poll() == {'a': RemoteJob.RUNNING}
+    assert job.wait(timeout=10, interval=0.2)
+    assert job.exit_codes == {'a': 4}
+
+    job = RemoteJob('sleep 30', ['a'], job_dir=str(tmp_path))
+    job.start()
+    assert not job.wait(timeout=0.5, interval=0.2)
+    job.kill()
+    assert job.wait(timeout=5, interval=0.2)
+    assert job.exit_codes == {'a': 143}
+
+
+def test_host_health_quarantine(fake_executor, host_health, monkeypatch):
+    executor = fake_executor({'host-1': 100})
+    hosts = ['host-0', 'host-1', 'host-2']
+    for i in range(2):
+        host_errors, _ = execute_cmd('hostname', hosts, retry_failed_hosts=True, is_continue=True)
+    assert host_health.quarantined_hosts == {'host-1'}
+
+    executor.calls[:] = []
+    host_errors, result = execute_cmd('hostname', hosts)
+    assert 'host-1' not in executor.calls
+    assert sorted(result.report) == ['host-0', 'host-2']
+    # the skipped host is still reported to the caller
+    assert host_errors == ['host-1']
+
+    # the host is probed again after the backoff delay and released when it answers
+    now = time.time()
+    monkeypatch.setattr(cloudal.utils.time, 'time', lambda: now + 11)
+    executor.flaky['host-1'] = 0
+    assert host_health.filter(hosts) == hosts
+    assert host_health.quarantined_hosts == set()
+
+
+def test_host_health_quarantine_default_path(fake_executor, host_health):
+    executor = fake_executor({'host-1': 100})
+    hosts = ['host-0', 'host-1', 'host-2']
+    # the retries of the command on all hosts record the connection errors of the dead host
+    assert execute_cmd('hostname', hosts, is_continue=True) is None
+    assert host_health.quarantined_hosts == {'host-1'}
+
+    executor.calls[:] = []
+    host_errors, result = execute_cmd('hostname', hosts)
+    assert 'host-1' not in executor.calls
+    assert host_errors == ['host-1']
+
+
+class LocalRemote(object):
+    """Run the command of a relay on the local machine"""
+    def __init__(self, cmd, hosts, connection_params=None):
+        self.cmd = cmd
+        self.hosts = hosts
+
+    def run(self):
+        if self.hosts[0] == 'dead-relay':
+            self.processes = [FakeProcess(self.hosts[0], stderr='ssh: Connection refused', ok=False)]
+            return self
+        output = subprocess.run(['bash', '-c', self.cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.processes = [FakeProcess(self.hosts[0], stdout=output.stdout.decode(), stderr=output.stderr.decode(),
+                                      ok=output.returncode == 0)]
+        return self
+
+
+def test_relay_action_factory(fake_executor, monkeypatch):
+    direct_executor = fake_executor({})
+    # the relays run the command locally, with the host name in an environment variable
+    executor = RelayActionFactory(ssh_cmd=['bash', '-c', 'HOST=$0 && eval "$1"'])
+    executor.get_remote = direct_executor.get_remote
+    executor.add_relay('nantes', ['econome-1', 'econome-2'])
+    executor.add_relay('dead-relay', ['paravance-1'])
+    monkeypatch.setattr(cloudal.utils, 'get_remote_executor', lambda *args, **kwargs: executor)
+    monkeypatch.setattr(cloudal.utils, 'Remote', LocalRemote)
+
+    hosts = ['econome-1', 'econome-2', 'paravance-1', 'other-1']
+    host_errors, result = execute_cmd('[ $HOST != econome-2 ] && echo "on $HOST"', hosts)
+    assert host_errors == []
+    assert [p.host.address for p in result.processes] == hosts
+    assert result.report['econome-1'].stdout == 'on econome-1\n'
+    assert result.report['econome-2'].exit_code == 1
+    # the hosts of a dead relay and the hosts without relay are contacted directly
+    assert sorted(direct_executor.calls) == ['other-1', 'paravance-1']
+
+
+def test_relay_action_factory_retries_hops(fake_executor, tmp_path, monkeypatch):
+    fake_executor({})
+    # the first hop from the relay to econome-2 times out
+    marker = str(tmp_path / 'timed_out')
+    executor = RelayActionFactory(ssh_cmd=['bash', '-c', 'HOST=$0; if [ $HOST = econome-2 ] && [ ! -f %s ]; then '
+                                           'touch %s; echo "ssh: connect to host $HOST: Connection timed out" >&2; '
+                                           'exit 255; fi; eval "$1"' % (marker, marker)])
+    executor.add_relay('nantes', ['econome-1', 'econome-2'])
+    monkeypatch.setattr(cloudal.utils, 'get_remote_executor', lambda *args, **kwargs: executor)
+    monkeypatch.setattr(cloudal.utils, 'Remote', LocalRemote)
+    for retry_failed_hosts in [True, False]:
+        if os.path.exists(marker):
+            os.remove(marker)
+        host_errors, result = execute_cmd('echo "on $HOST"', ['econome-1', 'econome-2'],
+                                          retry_failed_hosts=retry_failed_hosts)
+        assert host_errors == []
+        assert result.report.stdout() == {'econome-1': 'on econome-1', 'econome-2': 'on econome-2'}
+
+
+def test_ensure_cmd(local_execute_cmd, tmp_path, monkeypatch):
+    monkeypatch.setattr(cloudal.utils, 'ENSURE_MARKER_DIR', str(tmp_path / 'markers'))
+    counter = tmp_path / 'counter'
+    cmd = 'echo run >> %s' % counter
+    ensure_cmd(cmd, ['a'])
+    _, result = ensure_cmd(cmd, ['a'])
+    assert counter.read_text() == 'run\n'
+    assert result.report['a'].stdout.strip() == cloudal.utils.ENSURE_SKIPPED
+
+    # a step is run again when its inputs change, and after it fails
+    ensure_cmd(cmd, ['a'], inputs={'version': 2})
+    ensure_cmd('exit 1', ['a'])
+    _, result = ensure_cmd('exit 1', ['a'])
+    assert counter.read_text() == 'run\nrun\n'
+    assert not result.report['a'].ok
+
+
+def test_ensure_cmd_multiline(local_execute_cmd, tmp_path, monkeypatch):
+    monkeypatch.setattr(cloudal.utils, 'ENSURE_MARKER_DIR', str(tmp_path / 'markers'))
+    config = tmp_path / 'daemon.json'
+    cmd = """cat <<EOF > %s
+{"exec-opts": ["native.cgroupdriver=systemd"]}
+EOF
+echo "it's done" """ % config
+    _, result = ensure_cmd(cmd, ['a'])
+    assert result.report['a'].ok
+    assert result.report['a'].stdout.strip() == "it's done"
+    assert config.read_text() == '{"exec-opts": ["native.cgroupdriver=systemd"]}\n'
+
+
+def test_streaming_output_handler(tmp_path):
+    from execo.process import Process
+    handler = StreamingOutputHandler('make', log_dir=str(tmp_path), tail_size=10)
+    process = Process('seq 1 1000; echo failed >&2; exit 2', shell=True, **handler.get_process_args())
+    process.host = FakeHost('host-1')
+    process.run()
+    assert (tmp_path / 'make' / 'host-1.stdout').read_text() == ''.join('%s\n' % i for i in range(1, 1001))
+    assert (tmp_path / 'make' / 'host-1.stderr').read_text() == 'failed\n'
+    assert process.stdout == '\n999\n1000\n'
+    assert process.stderr == 'failed\n'
+    assert handler.files == {}
+
+
+class StartedRemote(object):
+    def __init__(self, cmd, hosts, started, process_args=None):
+        self.cmd = cmd
+        self.hosts = hosts
+        started.append((cmd, hosts))
+
+    def start(self):
+        return self
+
+    def kill(self):
+        pass
+
+
+def test_remote_log_tailer(tmp_path, monkeypatch):
+    sink = str(tmp_path / 'logs' / 'elmer.log')
+    matches = list()
+    tailer = RemoteLogTailer('/tmp/elmer.log', ['a', 'b'], sink)
+    tailer.add_trigger('panicked', lambda host, line: matches.append(host))
+    tailer.read(FakeProcess('a'), 1, 'starting\nthread main pani', False, False)
+    tailer.read(FakeProcess('b'), 1, 'ok\n', False, False)
+    tailer.read(FakeProcess('a'), 1, 'cked at src/main.rs\n', False, False)
+    tailer.stop()
+    with open(sink) as f:
+        assert f.read() == '[a] starting\n[b] ok\n[a] thread main panicked at src/main.rs\n'
+    assert matches == ['a']
+    assert tailer.triggered.is_set()
+
+    # a new tailer resumes from the saved byte offsets
+    started = list()
+    executor = FakeExecutor({})
+    executor.get_remote = lambda cmd, hosts, **kwargs: StartedRemote(cmd, hosts, started, **kwargs)
+    monkeypatch.setattr(cloudal.utils, 'get_remote_executor', lambda *args, **kwargs: executor)
+    tailer = RemoteLogTailer('/tmp/elmer.log', ['a', 'b', 'c'], sink).start()
+    assert {hosts[0]: cmd for cmd, hosts in started} == {
+        host: 'tail -c +%s -F /tmp/elmer.log 2>/dev/null' % (offset + 1)
+        for host, offset in [('a', 45), ('b', 3), ('c', 0)]}
+    tailer.stop()
+
+
+class RunningJobRemote(object):
+    def __init__(self, cmd, hosts):
+        self.hosts = hosts
+
+    def run(self):
+        self.processes = [FakeProcess(host, stdout='running\n') for host in self.hosts]
+        return self
+
+
+def test_poll_job_while_tailing(tmp_path, monkeypatch):
+    budget = ConnectionBudget(2)
+    monkeypatch.setattr(cloudal.utils, 'get_connection_budget', lambda *args: budget)
+    started = list()
+    executor = FakeExecutor({})
+    executor.get_remote = lambda cmd, hosts, **kwargs: (StartedRemote(cmd, hosts, started, **kwargs)
+                                                        if cmd.startswith('tail') else RunningJobRemote(cmd, hosts))
+    monkeypatch.setattr(cloudal.utils, 'get_remote_executor', lambda *args, **kwargs: executor)
+    hosts = ['host-%s' % i for i in range(3)]
+    tailer = RemoteLogTailer('/tmp/filebench.log', hosts, str(tmp_path / 'filebench.log')).start()
+    try:
+        # the tail sessions on more hosts than the budget do not block the probes of the job
+        states = dict()
+        job = RemoteJob('filebench -f /tmp/varmail.f', hosts, job_dir=str(tmp_path))
+        poller = threading.Thread(target=lambda: states.update(job.poll()), daemon=True)
+        poller.start()
+        poller.join(timeout=5)
+        assert not poller.is_alive()
+        assert states == {host: RemoteJob.RUNNING for host in hosts}
+        assert len(started) == 3
+    finally:
+        tailer.stop()
+
+
+def test_gather_facts(local_execute_cmd, tmp_path, monkeypatch):
+    fact_cache_singleton[:] = [FactCache(cache_dir=str(tmp_path), cache_key='g5k:nantes:1')]
+    try:
+        facts = gather_facts(['a', 'b'])
+        assert sorted(facts) == ['a', 'b']
+        assert facts['a']['n_cpus'] > 0 and facts['a']['boot_id']
+
+        # the facts are reused from memory, then from disk by a new cache with the same key
+        fact_cache_singleton[:] = [FactCache(cache_dir=str(tmp_path), cache_key='g5k:nantes:1')]
+        monkeypatch.setattr(cloudal.utils, 'execute_cmd', None)
+        assert gather_facts(['a']) == {'a': facts['a']}
+        assert FactCache(cache_dir=str(tmp_path), cache_key='g5k:nantes:2').get('a') is None
+
+        # without a cache key, the facts are not written to disk
+        cache = FactCache(cache_dir=str(tmp_path / 'no_key'))
+        cache.put('a', facts['a'])
+        assert cache.get('a') == facts['a']
+        assert not os.path.exists(str(tmp_path / 'no_key'))
+    finally:
+        del fact_cache_singleton[:]